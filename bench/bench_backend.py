@@ -0,0 +1,121 @@
+'''
+    compare the Server network backends (poll, epoll, epoll edge triggered)
+
+    to run the benchmark:
+
+        python -m bench.bench_backend [count ...]
+
+    for each connection count (default 1000 10000 50000) a set of connected
+    socket pairs is created. one end of each pair is registered with a Server,
+    and the Server.service method is timed in two scenarios:
+
+        idle   - no socket has any activity; this is the cost of asking the
+                 kernel about every registered socket when nothing happens
+
+        active - one byte is written to every connection before each call
+                 to service, so every registered socket is ready
+
+    Notes:
+
+        1. each connection uses two file descriptors; counts which exceed the
+           process limit (ulimit -n) are skipped.
+
+        2. socket pairs are used instead of tcp connections in order to
+           measure the event loop and not the tcp stack.
+'''
+import errno
+import resource
+import socket
+import sys
+import time
+
+import rhc.tcpsocket as network
+
+
+ROUNDS = 20
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    except (ValueError, resource.error):
+        return soft
+
+
+class Reader(object):
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.count = 0
+
+    def on_read(self):
+        try:
+            self.sock.recv(1024)
+        except socket.error as e:
+            if e.errno != errno.EAGAIN:
+                raise
+            self.server._set_idle(self.sock)  # edge triggered: drained
+        else:
+            self.count += 1
+
+
+def setup(server, count):
+    pairs = []
+    for _ in range(count):
+        a, b = socket.socketpair()
+        a.setblocking(False)
+        reader = Reader(server, a)
+        server._register(a, network.EVENT_READ, reader.on_read)
+        pairs.append((a, b, reader))
+    return pairs
+
+
+def teardown(server, pairs):
+    for a, b, _ in pairs:
+        server._unregister(a)
+        a.close()
+        b.close()
+
+
+def run_idle(server):
+    start = time.time()
+    for _ in range(ROUNDS):
+        server.service()
+    return (time.time() - start) / ROUNDS
+
+
+def run_active(server, pairs):
+    elapsed = 0
+    for _ in range(ROUNDS):
+        for _, b, _ in pairs:
+            b.send('x')
+        start = time.time()
+        server.service()
+        elapsed += time.time() - start
+    assert all(r.count == ROUNDS for _, _, r in pairs)
+    return elapsed / ROUNDS
+
+
+def main(counts):
+    limit = raise_fd_limit()
+    print '%-6s %-14s %12s %12s' % ('count', 'backend', 'idle (ms)', 'active (ms)')
+    for count in counts:
+        if count * 2 + 100 > limit:
+            print '%-6d skipped: needs %d file descriptors, limit is %d' % (count, count * 2 + 100, limit)
+            continue
+        for backend, edge_triggered in (('poll', False), ('epoll', False), ('epoll', True)):
+            server = network.Server(backend, edge_triggered)
+            pairs = setup(server, count)
+            idle = run_idle(server)
+            active = run_active(server, pairs)
+            teardown(server, pairs)
+            server.close()
+            name = backend + (' (edge)' if edge_triggered else '')
+            print '%-6d %-14s %12.3f %12.3f' % (count, name, idle * 1000.0, active * 1000.0)
+
+
+if __name__ == '__main__':
+    main([int(c) for c in sys.argv[1:]] or [1000, 10000, 50000])
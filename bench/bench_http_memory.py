@@ -0,0 +1,97 @@
+'''
+    measure peak memory for concurrent large POSTs with and without
+    http_message retention
+
+    to run the benchmark:
+
+        python -m bench.bench_http_memory [count]
+
+    count (default 20) handlers each receive a POST with a 5MB body. the
+    pieces (64K each) are delivered round-robin, so every upload is in
+    progress at the same time. each handler holds on to its RESTRequest,
+    as it would while waiting on a delayed response, until all of the
+    uploads are complete.
+
+    the test is run once for each http_message_limit setting:
+
+        all    - None, the entire message is kept (default)
+        prefix - 1024, only the start of the message is kept
+        none   - 0, nothing is kept
+
+    Notes:
+
+        1. each setting runs in a separate process, since peak RSS
+           (ru_maxrss) can't be reset.
+
+        2. the reported growth is peak RSS minus RSS before the first
+           upload starts.
+'''
+import resource
+import subprocess
+import sys
+
+from rhc.httphandler import HTTPHandler
+from rhc.resthandler import RESTRequest
+
+
+BODY = 5 * 1024 * 1024
+PIECE = 65536
+MODES = (('all', None), ('prefix', 1024), ('none', 0))
+
+
+class _Network(object):
+
+    def _unregister(self, sock):
+        pass
+
+
+class _Context(object):
+
+    def __init__(self):
+        self.context = None
+
+
+class Handler(HTTPHandler):
+
+    def __init__(self, limit):
+        super(Handler, self).__init__(None, _Context())
+        self._network = _Network()
+        self.http_message_limit = limit
+        self.request = None
+
+    def on_http_data(self):
+        self.request = RESTRequest(self)
+
+
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # linux reports KB
+
+
+def run(count, limit):
+    headers = 'POST /upload HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\n\r\n' % BODY
+    piece = 'x' * PIECE
+    handlers = [Handler(limit) for _ in range(count)]
+    start = peak_rss()
+    for h in handlers:
+        h.on_data(headers)
+    for _ in range(BODY / PIECE):
+        for h in handlers:
+            h.on_data(piece)
+    assert all(h.request and len(h.request.http_content) == BODY for h in handlers)
+    return start, peak_rss()
+
+
+def main(count):
+    print '%d x %dMB POST' % (count, BODY / 1024 / 1024)
+    print '%-8s %12s %12s' % ('mode', 'peak (MB)', 'growth (MB)')
+    for name, limit in MODES:
+        out = subprocess.check_output([sys.executable, '-m', 'bench.bench_http_memory', '--child', str(count), repr(limit)])
+        start, peak = [float(v) for v in out.split()]
+        print '%-8s %12.1f %12.1f' % (name, peak, peak - start)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        print '%f %f' % run(int(sys.argv[2]), eval(sys.argv[3]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
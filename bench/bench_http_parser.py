@@ -0,0 +1,145 @@
+'''
+    measure the HTTPHandler parser
+
+    to run the benchmark:
+
+        python -m bench.bench_http_parser
+
+    the parser is fed directly (no sockets) in these scenarios:
+
+        small gets - 10000 small GET requests, pipelined, delivered in 16K
+                     pieces
+
+        10MB body  - one POST with a 10MB Content-Length body, delivered in
+                     64K pieces
+
+        10MB chunk - one POST with a 10MB chunked body (64K chunks),
+                     delivered in 64K pieces
+
+        trickle    - one POST with 2K of headers and a 4K body, delivered
+                     one byte at a time
+
+        headers    - 50000 GET requests with 12 typical browser headers,
+                     pipelined, delivered in 16K pieces; http_headers from
+                     every request is kept, and the growth in peak RSS per
+                     request is reported (run first, so that it sets the peak)
+'''
+import resource
+import time
+
+from rhc.httphandler import HTTPHandler
+
+
+class _Network(object):
+
+    def _unregister(self, sock):
+        pass
+
+
+class Parser(HTTPHandler):
+
+    def __init__(self):
+        super(Parser, self).__init__(None)
+        self._network = _Network()
+        self.count = 0
+        self.size = 0
+
+    def on_http_data(self):
+        self.count += 1
+        self.size += len(self.http_content)
+
+
+def feed(message, piece):
+    h = Parser()
+    start = time.time()
+    for n in range(0, len(message), piece):
+        h.on_data(message[n:n + piece])
+    elapsed = time.time() - start
+    assert not h.closed, h.error
+    return elapsed, h
+
+
+def small_gets():
+    request = 'GET /resource/path?a=1&b=2 HTTP/1.1\r\nHost: localhost\r\nAccept: */*\r\nContent-Length: 0\r\n\r\n'
+    elapsed, h = feed(request * 10000, 16384)
+    assert h.count == 10000
+    return elapsed
+
+
+def large_body():
+    body = 'x' * (10 * 1024 * 1024)
+    message = 'POST /upload HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body)
+    elapsed, h = feed(message, 65536)
+    assert h.size == len(body)
+    return elapsed
+
+
+def large_chunked():
+    chunk = 'x' * 65536
+    count = 160
+    message = 'POST /upload HTTP/1.1\r\nHost: localhost\r\nTransfer-Encoding: chunked\r\n\r\n'
+    message += ('%x\r\n%s\r\n' % (len(chunk), chunk)) * count + '0\r\n\r\n'
+    elapsed, h = feed(message, 65536)
+    assert h.size == len(chunk) * count
+    return elapsed
+
+
+def trickle():
+    headers = ''.join('X-Header-%d: %s\r\n' % (n, 'v' * 40) for n in range(40))
+    body = 'y' * 4096
+    message = 'POST /upload HTTP/1.1\r\nHost: localhost\r\n%sContent-Length: %d\r\n\r\n%s' % (headers, len(body), body)
+    elapsed, h = feed(message, 1)
+    assert h.size == len(body)
+    return elapsed
+
+
+BROWSER_HEADERS = (
+    'Host: www.example.com\r\n'
+    'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0\r\n'
+    'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n'
+    'Accept-Language: en-US,en;q=0.5\r\n'
+    'Accept-Encoding: gzip, deflate\r\n'
+    'Referer: https://www.example.com/index.html\r\n'
+    'Connection: keep-alive\r\n'
+    'Cookie: session=0123456789abcdef; theme=dark\r\n'
+    'Upgrade-Insecure-Requests: 1\r\n'
+    'Cache-Control: max-age=0\r\n'
+    'X-Request-Id: 5f0c1d2e3b4a\r\n'
+    'Content-Length: 0\r\n'
+)
+
+
+class Keeper(Parser):
+
+    def __init__(self):
+        super(Keeper, self).__init__()
+        self.kept = []
+
+    def on_http_data(self):
+        self.kept.append(self.http_headers)
+
+
+def headers():
+    count = 50000
+    request = 'GET /resource/path HTTP/1.1\r\n%s\r\n' % BROWSER_HEADERS
+    message = request * count
+    h = Keeper()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    for n in range(0, len(message), 16384):
+        h.on_data(message[n:n + 16384])
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert len(h.kept) == count
+    return elapsed, (after - before) * 1024.0 / count
+
+
+def main():
+    elapsed, per_request = headers()
+    print '%-12s %10.3f ms %8.0f bytes/request' % ('headers', elapsed * 1000.0, per_request)
+    for name, test in (('small gets', small_gets), ('10MB body', large_body), ('10MB chunk', large_chunked), ('trickle', trickle)):
+        print '%-12s %10.3f ms' % (name, test() * 1000.0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+'''
+    measure RESTHandler responses per second for small json payloads
+
+    to run the benchmark:
+
+        python -m bench.bench_http_response [count]
+
+    count (default 20000) GET requests are fed, one at a time, to a
+    RESTHandler whose route returns a small dict (sent as json). the
+    socket accepts everything sent to it, so the time is spent parsing the
+    request, routing, and building and queueing the response.
+
+    the best of ROUNDS runs is reported for each of these scenarios:
+
+        plain   - the route returns the dict
+
+        headers - the route returns a RESTResult with three extra headers
+
+        send    - send_server is called directly with the json content and
+                  the three extra headers (no parsing or routing)
+'''
+import json
+import sys
+import time
+
+from rhc.resthandler import RESTHandler, RESTMapper, RESTResult
+
+
+ITEM = {'id': 1234, 'name': 'widget', 'price': 9.95, 'tags': ['a', 'b']}
+ROUNDS = 5
+HEADERS = {'Cache-Control': 'no-cache', 'X-Request-Id': 'abcdef0123456789', 'Vary': 'Accept'}
+
+
+class _Socket(object):
+
+    def send(self, data):
+        return len(data)
+
+    def close(self):
+        pass
+
+
+class _Network(object):
+
+    def _register(self, sock, mask, callback):
+        pass
+
+    def _unregister(self, sock):
+        pass
+
+    def _set_idle(self, sock):
+        pass
+
+
+def plain(request):
+    return ITEM
+
+
+def headers(request):
+    return RESTResult(content=ITEM, headers=dict(HEADERS))
+
+
+def handler():
+    mapper = RESTMapper()
+    mapper.add('/plain$', get=plain)
+    mapper.add('/headers$', get=headers)
+    h = RESTHandler(_Socket(), mapper)
+    h._network = _Network()
+    h.t_ready = time.time()
+    return h
+
+
+def run(path, count):
+    h = handler()
+    message = 'GET %s HTTP/1.1\r\nHost: localhost\r\nAccept: */*\r\n\r\n' % path
+    start = time.time()
+    for _ in range(count):
+        h.on_data(message)
+    elapsed = time.time() - start
+    assert not h.closed and h.txByteCount > 0
+    return count / elapsed
+
+
+def send(count):
+    h = handler()
+    content = json.dumps(ITEM)
+    start = time.time()
+    for _ in range(count):
+        h.send_server(content, headers=dict(HEADERS, **{'Content-Type': 'application/json; charset=utf-8'}))
+    elapsed = time.time() - start
+    assert not h.closed and h.txByteCount > 0
+    return count / elapsed
+
+
+def main(count):
+    for name, test in (
+            ('plain', lambda: run('/plain', count)),
+            ('headers', lambda: run('/headers', count)),
+            ('send', lambda: send(count))):
+        best = max(test() for _ in range(ROUNDS))
+        print '%-8s %10.0f responses/s' % (name, best)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
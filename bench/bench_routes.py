@@ -0,0 +1,106 @@
+'''
+    measure RESTMapper route lookup cost against the number of routes
+
+    to run the benchmark:
+
+        python -m bench.bench_routes [count ...]
+
+    for each route count (default 10 50 150 500) a RESTMapper is built with
+    routes in the style of a typical service, added three at a time:
+
+        /svcN$
+        /svcN/(\d+)$
+        /svcN/(\d+)/detail$
+
+    LOOKUPS resources, spread evenly over the routes, are matched in each of
+    these scenarios:
+
+        linear - every pattern is tried in order until one matches (what
+                 _match did before the route table)
+
+        table  - the route table, with the match cache disabled
+
+        cached - the route table and match cache, with 100 distinct
+                 resources (a cache hit after the first lookup of each)
+
+        miss   - the route table, with the match cache disabled, for a
+                 resource which matches no route
+
+    the best of ROUNDS runs is reported, in microseconds per lookup (the
+    RESTMapper._lookup method used by RESTHandler).
+'''
+import re
+import sys
+import time
+
+from rhc.resthandler import RESTMapper
+
+
+LOOKUPS = 20000
+ROUNDS = 5
+
+
+def routes(count):
+    result = []
+    for n in range(count):
+        svc = n / 3
+        result.append(('/svc%d$', '/svc%d/(\d+)$', '/svc%d/(\d+)/detail$')[n % 3] % svc)
+    return result
+
+
+def resources(count, distinct):
+    ''' resource n matches route n % count '''
+    result = []
+    for n in range(distinct):
+        route = n % count
+        svc = route / 3
+        result.append(('/svc%d' % svc, '/svc%d/%d' % (svc, n), '/svc%d/%d/detail' % (svc, n))[route % 3])
+    return result
+
+
+def mapper(count, match_cache_size):
+    m = RESTMapper(match_cache_size=match_cache_size)
+    for n, pattern in enumerate(routes(count)):
+        m.add(pattern, get=n)
+    return m
+
+
+def linear(count):
+    mapping = [re.compile(pattern) for pattern in routes(count)]
+
+    def match(resource, method):
+        for pattern in mapping:
+            m = pattern.match(resource)
+            if m:
+                return pattern, m.groups(), False
+        return None, None, False
+    return match
+
+
+def run(match, targets):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.time()
+        for resource in targets:
+            match(resource, 'GET')
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(targets) * 1e6
+
+
+def main(counts):
+    print '%-6s %10s %10s %10s %10s' % ('routes', 'linear', 'table', 'cached', 'miss')
+    for count in counts:
+        spread = resources(count, LOOKUPS)
+        repeated = resources(count, 100) * (LOOKUPS / 100)
+        print '%-6d %10.2f %10.2f %10.2f %10.2f' % (
+            count,
+            run(linear(count), spread),
+            run(mapper(count, 0)._lookup, spread),
+            run(mapper(count, 1024)._lookup, repeated),
+            run(mapper(count, 0)._lookup, ['/nothing/here'] * LOOKUPS),
+        )
+
+
+if __name__ == '__main__':
+    main([int(c) for c in sys.argv[1:]] or [10, 50, 150, 500])
@@ -0,0 +1,78 @@
+'''
+    compare the Timer engines (heap, wheel)
+
+    to run the benchmark:
+
+        python -m bench.bench_timer [count ...]
+
+    for each timer count (default 1000 10000 100000) a set of running timers
+    is created, each with a duration of 30 seconds (like a connection idle
+    timeout). the following operations are timed:
+
+        start    - start every timer
+
+        re_start - re-start randomly chosen timers, as ConnectHandler does on
+                   every arriving packet, while servicing the timers after
+                   every 100 re-starts
+
+        cancel   - cancel every timer
+
+    Notes:
+
+        1. the number of re-starts is fixed (RESTARTS); the reported value
+           is the average time per re-start.
+
+        2. the heap engine deletes lazily, so the cancel time includes
+           discarding the dead entries (with next_expiration).
+'''
+import random
+import sys
+import time
+
+from rhc.timer import Timer
+
+
+RESTARTS = 2000
+DURATION = 30000
+
+
+def noop():
+    pass
+
+
+def run(engine, count):
+    t = Timer(engine)
+    timers = [t.add(noop, DURATION) for _ in range(count)]
+
+    start = time.time()
+    for item in timers:
+        item.start()
+    started = time.time() - start
+
+    choices = [random.choice(timers) for _ in range(RESTARTS)]
+    start = time.time()
+    for n, item in enumerate(choices):
+        item.re_start()
+        if n % 100 == 0:
+            t.service()
+    restarted = time.time() - start
+
+    start = time.time()
+    for item in timers:
+        item.cancel()
+    t.next_expiration()  # heap: discards cancelled timers
+    cancelled = time.time() - start
+
+    return started / count, restarted / RESTARTS, cancelled / count
+
+
+def main(counts):
+    print '%-7s %-6s %14s %14s %14s' % ('count', 'engine', 'start (us)', 're_start (us)', 'cancel (us)')
+    for count in counts:
+        for engine in ('heap', 'wheel'):
+            result = run(engine, count)
+            print '%-7d %-6s %14.2f %14.2f %14.2f' % ((count, engine) + tuple(r * 1000000.0 for r in result))
+
+
+if __name__ == '__main__':
+    main([int(c) for c in sys.argv[1:]] or [1000, 10000, 100000])
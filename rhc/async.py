@@ -27,11 +27,11 @@ import string
 import time
 import types
 
-from socket import gethostbyname
 from urllib import urlencode
 from urlparse import urlparse
 
 from rhc.httphandler import HTTPHandler
+import rhc.loop as event_loop
 from rhc.tcpsocket import SERVER
 from rhc.task import Task
 from rhc.timer import TIMERS
@@ -166,6 +166,8 @@ class Connection(object):
             handler - handler class for connection
                       a subclass of ConnectionHandler with special logic in setup or evaluate
             headers - dict of headers to be included in all connections
+            pool - rhc.pool.ConnectionPool for re-using connections (None means
+                   one connection per request)
 
         Notes:
 
@@ -182,7 +184,7 @@ class Connection(object):
                 Connection init.
     '''
 
-    def __init__(self, url, is_json=True, is_debug=False, timeout=5.0, is_form=False, wrapper=None, setup=None, handler=None, headers=None):
+    def __init__(self, url, is_json=True, is_debug=False, timeout=5.0, is_form=False, wrapper=None, setup=None, handler=None, headers=None, pool=None):
         self._url = url
         self._last_url = None
         if not callable(url):
@@ -195,6 +197,7 @@ class Connection(object):
         self.setup = setup
         self.handler = handler
         self.headers = headers
+        self.pool = pool
 
         self.mock = None
 
@@ -338,7 +341,7 @@ class Connection(object):
             return Mock()
         if not self.is_url_parsed:
             return callback(1, 'url not parsed')
-        return _connect(callback, self.url, self.host, self.address, self.port, path, self.is_ssl, method, body, headers, is_json, _is_debug, _timeout, wrapper, setup, handler, _trace, kwargs)
+        return _connect(callback, self.url, self.host, self.address, self.port, path, self.is_ssl, method, body, headers, is_json, _is_debug, _timeout, wrapper, setup, handler, _trace, kwargs, self.pool)
 
     def connect(self, method, callback, path, *args, **kwargs):
         is_json = kwargs.pop('is_json', self.is_json)
@@ -350,12 +353,12 @@ class Connection(object):
         url = self.url + path
         body = kwargs.pop('body', None)
         headers = kwargs.pop('headers', None)
-        return _connect(callback, url, self.host, self.address, self.port, path, self.is_ssl, method, body, headers, is_json, is_debug, timeout, wrapper, None, handler, False, kwargs)
+        return _connect(callback, url, self.host, self.address, self.port, path, self.is_ssl, method, body, headers, is_json, is_debug, timeout, wrapper, None, handler, False, kwargs, self.pool)
 
 
-def _connect(callback, url, host, address, port, path, is_ssl, method, body, headers, is_json, is_debug, timeout, wrapper, setup, handler, trace, kwargs):
+def _connect(callback, url, host, address, port, path, is_ssl, method, body, headers, is_json, is_debug, timeout, wrapper, setup, handler, trace, kwargs, pool=None):
     c = ConnectContext(callback, url, method, path, host, headers, body, is_json, is_debug, timeout, wrapper, setup, kwargs, trace)
-    return SERVER.add_connection((address, port), ConnectHandler if handler is None else handler, c, ssl=is_ssl)
+    return SERVER.add_connection((address, port), ConnectHandler if handler is None else handler, c, ssl=is_ssl, pool=pool)
 
 
 class ConnectContext(object):
@@ -424,6 +427,9 @@ class ConnectHandler(HTTPHandler):
         self.is_done = True
         self.timer.cancel()
         self.context.callback(rc, result)
+        if self._pool is not None and self.t_http_data and self.http_is_keep_alive:
+            if self._pool.release(self):
+                return
         if not self.close_reason:
             self.close_reason = 'transaction complete'
         self.close()
@@ -455,6 +461,11 @@ class ConnectHandler(HTTPHandler):
                 msg += ', ssl handshake=%s' % (
                     'success' if self.t_ready else 'fail',
                 )
+                if self.t_ready:
+                    msg += ' hs=%.4f%s' % (
+                        self.ssl_handshake_time,
+                        ' (resumed)' if self.is_ssl_resumed else '',
+                    )
             log.debug(msg)
         self.done(reason)
 
@@ -473,7 +484,7 @@ class ConnectHandler(HTTPHandler):
             resource=context.path,
             headers=context.headers,
             content=context.body,
-            close=True,
+            close=self._pool is None,
         )
 
     def on_http_send(self, headers, content):
@@ -538,7 +549,7 @@ def request(url, callback, content='', headers=None, method='GET', timeout=5.0,
             timeout : max time, in seconds, allowed for network inactivity
             close   : close socket after request complete, boolean
             ssl_args: dict of kwargs for add_connection
-            recv_len: read buffer size (default = BasicHandler.RECV_LEN)
+            recv_len: initial read size (default = BasicHandler.RECV_LEN)
             event   : dictionary of Handler event callback routines
 
                       on_init(handler)
@@ -706,16 +717,19 @@ class _URLParser(object):
         else:
             self.host = u.netloc
             self.port = 443 if self.is_ssl else 80
-        self.address = gethostbyname(self.host)
+        self.address = self.host  # resolved by SERVER.add_connection
         self.resource = u.path + ('?%s' % u.query if u.query else '')
 
 
-def run(command, delay=.01, loop=0):
-    ''' helper function: loop through SERVER/TIMER until command.is_done is True '''
+def run(command, delay=None, loop=0):
+    '''
+        helper function: loop through SERVER/TIMER until command.is_done is True
 
+        each pass blocks until the next timer expires or there is network
+        activity, but no longer than delay seconds (if delay is not None).
+    '''
     while not command.is_done:
-        SERVER.service(delay=delay, max_iterations=loop)
-        TIMERS.service()
+        event_loop.service(delay, loop)
 
 
 if __name__ == '__main__':
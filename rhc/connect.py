@@ -1,10 +1,10 @@
 import json
-from socket import gethostbyname
 import time
 from urllib import urlencode
 import urlparse
 
 from rhc.httphandler import HTTPHandler
+import rhc.loop as event_loop
 from rhc.tcpsocket import SERVER
 from rhc.timer import TIMERS
 
@@ -28,6 +28,7 @@ def connect(
             evaluate=None,
             debug=False,
             trace=False,
+            pool=None,
             **kwargs
         ):
     """ Make an async http connection, executing callback on completion
@@ -58,6 +59,8 @@ def connect(
                        (see ConnectHandler.evaluate)
             debug    - log debug messages on start/open/close
             trace    - log debug sent and recv'd http data
+            pool     - rhc.pool.ConnectionPool for re-using connections
+                       (default=None, one connection per request)
             kwargs   - additional keyword args that might be useful in a
                        ConnectHandler subclass
 
@@ -85,7 +88,7 @@ def connect(
     return connect_parsed(callback, url, p.host, p.address, p.port, p.path,
                           p.query, p.is_ssl, method, headers, body, is_json,
                           is_form, timeout, wrapper, handler, evaluate, debug,
-                          trace, **kwargs)
+                          trace, pool, **kwargs)
 
 
 def connect_parsed(
@@ -108,13 +111,14 @@ def connect_parsed(
             evaluate,
             debug,
             trace,
+            pool=None,
             **kwargs
         ):
     c = ConnectContext(callback, url, method, path, query, host, headers, body,
                        is_json, is_form, timeout, wrapper, evaluate, debug,
                        trace, kwargs)
     return SERVER.add_connection((address, port), handler or ConnectHandler,
-                                 context=c, ssl=is_ssl)
+                                 context=c, ssl=is_ssl, pool=pool)
 
 
 class ConnectContext(object):
@@ -243,6 +247,9 @@ class ConnectHandler(HTTPHandler):
         self.is_done = True
         self.timer.cancel()
         self.context.callback(rc, result)
+        if self._pool is not None and self.t_http_data and self.http_is_keep_alive:
+            if self._pool.release(self):
+                return
         self.close('transaction complete')
 
     def on_open(self):
@@ -272,6 +279,11 @@ class ConnectHandler(HTTPHandler):
                 msg += ', ssl handshake=%s' % (
                     'success' if self.t_ready else 'fail',
                 )
+                if self.t_ready:
+                    msg += ' hs=%.4f%s' % (
+                        self.ssl_handshake_time,
+                        ' (resumed)' if self.is_ssl_resumed else '',
+                    )
             log.debug(msg)
         self.done(reason)
 
@@ -289,7 +301,7 @@ class ConnectHandler(HTTPHandler):
             resource=context.path,
             headers=context.headers,
             content=context.body,
-            close=True,
+            close=self._pool is None,
         )
 
     def on_data(self, data):
@@ -363,11 +375,15 @@ class ConnectHandler(HTTPHandler):
                 log.debug('send: %s', content)
 
 
-def run(command, delay=.01, loop=0):
-    """ service SERVER/TIMER until command.is_done is True """
+def run(command, delay=None, loop=0):
+    """
+        service SERVER/TIMER until command.is_done is True
+
+        each pass blocks until the next timer expires or there is network
+        activity, but no longer than delay seconds (if delay is not None).
+    """
     while not command.is_done:
-        SERVER.service(delay=delay, max_iterations=loop)
-        TIMERS.service()
+        event_loop.service(delay, loop)
 
 
 class URLParser(object):
@@ -378,7 +394,7 @@ class URLParser(object):
             self.is_ssl   - True if scheme is https
             self.host
             self.port     - if not supplied, 80 or http, 443 for https
-            self.address  - ip address of host
+            self.address  - host name or ip address (see Server.add_connection)
             self.path
             self.query
             self.resource - path?query
@@ -392,7 +408,7 @@ class URLParser(object):
         else:
             self.host = u.netloc
             self.port = 443 if self.is_ssl else 80
-        self.address = gethostbyname(self.host)
+        self.address = self.host  # resolved by SERVER.add_connection
         self.resource = u.path + ('?%s' % u.query if u.query else '')
         self.path = u.path
         self.query = u.query
@@ -23,10 +23,51 @@ THE SOFTWARE.
 '''
 from rhc.tcpsocket import BasicHandler
 
-from StringIO import StringIO
+import tempfile
 import time
 import urlparse
-import gzip
+import zlib
+
+
+_date = [0, None]  # second, Date header value
+
+
+def http_date():
+    ''' value for the Date header, formatted at most once a second '''
+    now = int(time.time())
+    if now != _date[0]:
+        _date[1] = time.strftime("%a, %d %b %Y %H:%M:%S %Z", time.localtime(now))
+        _date[0] = now
+    return _date[1]
+
+
+_status_lines = {}  # (code, message): status line
+_MAX_STATUS_LINES = 256
+
+
+def _status_line(code, message):
+    key = (code, message)
+    line = _status_lines.get(key)
+    if line is None:
+        line = 'HTTP/1.1 %d %s\r\n' % (code, message)
+        if len(_status_lines) < _MAX_STATUS_LINES:  # don't grow without bound on odd messages
+            _status_lines[key] = line
+    return line
+
+
+def _serialize(first_line, headers, extra):
+    '''
+        the header block of a message: first_line (including its line end),
+        each header in the headers dict followed by each (name, value) pair
+        in extra, and the blank line
+    '''
+    lines = [first_line]
+    for name, value in headers.iteritems():
+        lines.append('%s: %s\r\n' % (name, value))
+    for name, value in extra:
+        lines.append('%s: %s\r\n' % (name, value))
+    lines.append('\r\n')
+    return ''.join(lines)
 
 
 class HTTPHandler(BasicHandler):
@@ -37,8 +78,9 @@ class HTTPHandler(BasicHandler):
 
                 available variables (on_http_data)
 
-                    http_message - entire message
-                    http_headers - dictionary of headers
+                    http_message - entire message (see http_message_limit)
+                    http_version - version from status line (eg, HTTP/1.1)
+                    http_headers - dictionary of headers (HTTPHeaders, case-insensitive)
                     http_content - content
                     error - any error message
 
@@ -57,29 +99,148 @@ class HTTPHandler(BasicHandler):
                         if charset:
                             http_content: decoded http_content
 
+                    http_query, http_multipart and the charset decoding of
+                    http_content are done on first access (and remembered),
+                    so a message that never looks at them doesn't pay for
+                    them.
+
                 on_http_send(self, headers, content) - useful for debugging
                 on_http_data(self) - when data is available
                 on_http_error(self)
+
+                streaming (http_stream = True):
+
+                    the content is not collected in http_content; instead,
+                    each piece is handed to on_http_body_chunk as it arrives,
+                    followed by a call to on_http_body_end, and then the usual
+                    on_http_data. gzip or deflate content is decompressed
+                    before it is handed on, as it is for http_content, but
+                    charset decoding is not done. http_stream can be changed
+                    in on_http_headers to decide message by message.
+
+                    on_http_body_chunk(self, data)
+                    on_http_body_end(self)
+
+                multipart (http_multipart_spool_threshold is not None):
+
+                    a multipart message is parsed (with MultipartParser) as
+                    it arrives, instead of being collected in http_content
+                    and split when http_multipart is accessed. a part whose
+                    content is longer than http_multipart_spool_threshold
+                    bytes is written to a temp file (see HTTPPart). this
+                    takes the place of streaming (http_stream) for multipart
+                    messages.
         '''
         super(HTTPHandler, self).__init__(socket, context)
         self.t_http_data = 0
-        self.__data = ''
+        self.__buf = bytearray()  # received data
+        self.__pos = 0  # start of unparsed data in __buf
+        self.__scan = 0  # where to resume looking for end of line in __buf
         self._setup()
 
         self.http_max_content_length = None
         self.http_max_line_length = 10000
         self.http_max_header_count = 100
+        self.http_message_limit = None  # bytes of http_message kept: None=all, 0=none
+        self.http_stream = False
+        self.http_multipart_spool_threshold = None
 
         self.__http_close_on_complete = False
+        self.__is_chunking = False  # sending a chunked response
+        self.__is_framed = True  # chunked response has Transfer-Encoding: chunked
+        self.__chunked_close = False
+        self.__is_processing = False
+
+    @property
+    def http_is_keep_alive(self):
+        '''
+            True if the connection can carry another message after the one
+            just received (useful in on_http_data): the peer is HTTP/1.1,
+            did not send 'Connection: close', the end of the message was
+            not marked by closing the connection, and no extra data arrived.
+        '''
+        return (
+            not self.closed and
+            self.http_version == 'HTTP/1.1' and
+            self.http_headers.get('connection', '').lower() != 'close' and
+            self.__pos == len(self.__buf)
+        )
+
+    # http_message and http_content are collected as lists of strings,
+    # joined only when read, so that accumulating them is linear.
+
+    @property
+    def http_message(self):
+        parts = self.__message_parts
+        if len(parts) > 1:
+            parts[:] = [''.join(parts)]
+        return parts[0] if parts else ''
+
+    @http_message.setter
+    def http_message(self, value):
+        self.__message_parts = [value] if value else []
+        self.__message_length = len(value)
+
+    @property
+    def http_content(self):
+        if self.__decoded is not None:
+            return self.__decoded
+        content = self._http_raw_content
+        if self.__is_decode_pending:
+            charset = self.charset
+            if charset:
+                self.__decoded = content = content.decode(charset)
+            self.__is_decode_pending = False
+        return content
+
+    @http_content.setter
+    def http_content(self, value):
+        self.__content_parts = [value] if value else []
+        self.__decoded = None
+        self.__is_decode_pending = False
+
+    @property
+    def _http_raw_content(self):
+        ''' http_content before charset decoding '''
+        parts = self.__content_parts
+        if len(parts) > 1:
+            parts[:] = [''.join(parts)]
+        return parts[0] if parts else ''
 
     @property
     def charset(self):
-        h = self.http_headers.get('Content-Type')
-        if h:
-            charset = [c.split('=')[1].strip() for c in h.split(';') if 'charset' in c]
-            if len(charset):
-                return charset[0]
-        return None
+        return content_charset(self.http_headers.get('Content-Type'))
+
+    @property
+    def http_query(self):
+        if self.__query is None:
+            self.__query = parse_query(self.http_query_string)
+        return self.__query
+
+    @http_query.setter
+    def http_query(self, value):
+        self.__query = value
+
+    @property
+    def http_multipart(self):
+        if self.__multipart is None:
+            self.__multipart = []
+            content_type = self.http_headers.get('Content-Type', '')
+            if content_type.startswith('multipart'):
+                try:
+                    self.__multipart = parse_multipart(self._http_raw_content, content_boundary(content_type))
+                except Exception:
+                    self.__error('Malformed multipart message')
+        return self.__multipart
+
+    @http_multipart.setter
+    def http_multipart(self, value):
+        self.__multipart = value
+
+    @property
+    def _http_parsed_multipart(self):
+        ''' http_multipart if it is already parsed, else None '''
+        return self.__multipart
 
     def on_http_send(self, headers, content):
         pass
@@ -90,27 +251,14 @@ class HTTPHandler(BasicHandler):
     def on_http_error(self):
         pass
 
-    def _multipart(self):
-        cache = self.__data
-        try:
-            self.http_headers['Content-Type'], boundary = self.http_headers['Content-Type'].split('; boundary=')
-            for self.__data in [p[2:] for p in self.http_content.split('--' + boundary)][1:-1]:  # split, remove \r\n and ignore first & last; stuff into __data for __line
-                headers = dict(l.split(': ', 1) for l in iter(self.__line, ''))
-                if 'Content-Disposition' in headers:
-                    headers['Content-Disposition'], rem = headers['Content-Disposition'].split('; ', 1)
-                    disposition = dict(part.split('=', 1) for part in rem.split('; '))
-                self.http_multipart.append(HTTPPart(headers, disposition, self.__data))
-        except Exception:
-            self.__error('Malformed multipart message')
-        self.__data = cache
+    def on_http_body_chunk(self, data):
+        pass
+
+    def on_http_body_end(self):
+        pass
 
     def _on_http_data(self):
-        if self.http_headers.get('Content-Encoding') == 'gzip':
-            self.http_content = gzip.GzipFile(fileobj=StringIO(self.http_content)).read()
-        if self.http_headers.get('Content-Type', '').startswith('multipart'):
-            self._multipart()
-        if self.charset:
-            self.http_content = self.http_content.decode(self.charset)
+        self.__is_decode_pending = True  # charset decoding waits for http_content access
         self.t_http_data = time.time()
         self.on_http_data()
 
@@ -122,8 +270,9 @@ class HTTPHandler(BasicHandler):
         self.on_http_send(headers, content)
         if isinstance(headers, unicode):
             headers = headers.encode('utf8')
-        data = headers + content
-        super(HTTPHandler, self).send(data)
+        if isinstance(content, unicode):
+            content = content.encode('utf8')
+        self._send_buffers((headers, content))  # content is queued, not copied
 
     def send(self, method='GET', host=None, resource='/', headers=None, content='', close=False, compress=False):
 
@@ -132,60 +281,124 @@ class HTTPHandler(BasicHandler):
         if not headers:
             headers = {}
 
+        extra = []
+
         if 'Date' not in headers:
-            headers['Date'] = time.strftime(
-                "%a, %d %b %Y %H:%M:%S %Z", time.localtime())
+            extra.append(('Date', http_date()))
 
         if 'Content-Length' not in headers:
-            headers['Content-Length'] = len(content)
+            extra.append(('Content-Length', len(content)))
 
         if close:
-            headers['Connection'] = 'close'
+            extra.append(('Connection', 'close'))
 
         if compress:
-            headers['Accept-Encoding'] = 'gzip'
+            extra.append(('Accept-Encoding', 'gzip'))
 
         if 'host' not in (k.lower() for k in headers):
             host = host if host else self.host if self.host else '%s:%s' % self.peer_address
-            headers['Host'] = host
+            extra.append(('Host', host))
 
-        headers = '%s %s HTTP/1.1\r\n%s\r\n\r\n' % (
-            method, resource, '\r\n'.join(['%s: %s' % (k, v) for k, v in headers.items()])
-        )
+        self.__send(_serialize('%s %s HTTP/1.1\r\n' % (method, resource), headers, extra), content)
 
-        self.__send(headers, content)
+    def send_server(self, content='', code=200, message='OK', headers=None, close=False, keep_alive=False):
+        '''
+            send a response
 
-    def send_server(self, content='', code=200, message='OK', headers=None, close=False):
+            the connection is closed after the response is sent if close is
+            True, or if the request included 'Connection: close' (unless
+            keep_alive is True, for a caller which has already decided).
+        '''
 
-        self.__http_close_on_complete = True if close else self.http_headers.get('Connection') == 'close'
+        self.__http_close_on_complete = self.__is_close(close, keep_alive)
 
         if headers is None:
             headers = {}
 
+        extra = []
+
         if 'Date' not in headers:
-            headers['Date'] = time.strftime(
-                "%a, %d %b %Y %H:%M:%S %Z", time.localtime())
+            extra.append(('Date', http_date()))
 
         if 'Content-Length' not in headers:
-            headers['Content-Length'] = len(content)
+            extra.append(('Content-Length', len(content)))
+
+        self.__send(_serialize(_status_line(code, message), headers, extra), content)
 
-        headers = 'HTTP/1.1 %d %s\r\n%s\r\n\r\n' % (
-            code, message,
-            '\r\n'.join(['%s: %s' % (k, v) for k, v in headers.items()]))
+    def send_server_chunked(self, code=200, message='OK', headers=None, close=False, keep_alive=False, chunked=True):
+        '''
+            start a response with Transfer-Encoding: chunked
+
+            the content is sent with any number of calls to send_chunk,
+            followed by a call to send_chunk_end. pipelined requests are
+            not processed until the response is complete. close and
+            keep_alive are the same as for send_server.
+
+            if chunked is False (for an HTTP/1.0 client, which can't decode
+            chunks) the content is sent as is, with 'Connection: close', and
+            the connection is closed by send_chunk_end to mark the end.
+        '''
+        self.__http_close_on_complete = False
+        self.__chunked_close = self.__is_close(close, keep_alive) or not chunked
+        self.__is_chunking = True
+        self.__is_framed = chunked
 
-        self.__send(headers, content)
+        if headers is None:
+            headers = {}
+
+        if chunked:
+            extra = [('Transfer-Encoding', 'chunked')]
+        else:
+            extra = [] if 'Connection' in headers else [('Connection', 'close')]
+
+        if 'Date' not in headers:
+            extra.append(('Date', http_date()))
+
+        self.__send(_serialize(_status_line(code, message), headers, extra), '')
+
+    def __is_close(self, close, keep_alive):
+        if close:
+            return True
+        if keep_alive:
+            return False
+        return self.http_headers.get('Connection', '').lower() == 'close'
+
+    def send_chunk(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf8')
+        if not data:
+            return  # an empty chunk would mark the end
+        if self.__is_framed:
+            data = '%x\r\n%s\r\n' % (len(data), data)
+        super(HTTPHandler, self).send(data)
+
+    def send_chunk_end(self):
+        self.__is_chunking = False
+        self.__http_close_on_complete = self.__chunked_close
+        if self.__is_framed:
+            super(HTTPHandler, self).send('0\r\n\r\n')
+        elif not self.queued_bytes:
+            self.close()  # everything is written: the close marks the end
+        if not self.closed:
+            self.__process()  # pick up any pipelined requests
 
     def _setup(self):
         self.http_message = ''
-        self.http_headers = {}
+        self.http_version = None
+        self.http_headers = HTTPHeaders()
+        self.__header_count = 0
         self.http_content = ''
         self.http_status_code = None
         self.http_status_message = None
         self.http_method = None
-        self.http_multipart = []
+        self.http_multipart = None  # parsed on first access
         self.http_resource = None
         self.http_query_string = None
-        self.http_query = {}
+        self.http_query = None  # parsed on first access
+        self.__received = 0  # chunked content length so far
+        self.__decompress = None  # zlib decompressobj for gzip/deflate content
+        self.__decompressed = 0
+        self.__multipart_parser = None  # MultipartParser for incremental multipart content
         self.__state = self.__status
 
     def on_http_headers(self):
@@ -197,10 +410,49 @@ class HTTPHandler(BasicHandler):
         return 0, None
 
     def on_data(self, data):
-        self.http_message += data
-        self.__data += data
-        while self.__state():
-            pass
+        limit = self.http_message_limit
+        if limit is None:
+            self.__message_parts.append(data)
+        elif self.__message_length < limit:
+            keep = data[:limit - self.__message_length]
+            self.__message_parts.append(keep)
+            self.__message_length += len(keep)
+        buf = self.__buf
+        if self.__pos:
+            del buf[:self.__pos]  # discard parsed data
+            self.__scan -= self.__pos
+            self.__pos = 0
+        buf += data
+        self.__process()
+
+    def __take(self, length):
+        ''' consume length bytes of unparsed data, returned as a string '''
+        start = self.__pos
+        self.__pos = start + length
+        if self.__scan < self.__pos:
+            self.__scan = self.__pos
+        data = memoryview(self.__buf)[start:start + length].tobytes()
+        if self.__pos == len(self.__buf):
+            del self.__buf[:]  # don't hold a consumed body until the next read
+            self.__pos = self.__scan = 0
+        return data
+
+    @property
+    def __available(self):
+        return len(self.__buf) - self.__pos
+
+    def __process(self):
+        if self.__is_processing:
+            return  # the loop already running will continue
+        self.__is_processing = True
+        try:
+            while not self.is_writing_paused and not self.__is_chunking and self.__state():  # hold pipelined messages while output is backed up
+                pass
+        finally:
+            self.__is_processing = False
+
+    def _on_resume_writing(self):
+        self.__process()
 
     def __error(self, message):
         self.error = message
@@ -209,12 +461,15 @@ class HTTPHandler(BasicHandler):
         return False
 
     def __line(self):
-        test = self.__data.split('\n', 1)
-        if len(test) == 1:
-            if len(self.__data) > self.http_max_line_length:
+        buf = self.__buf
+        end = buf.find('\n', self.__scan)
+        if end == -1:
+            self.__scan = len(buf)  # next time, look at new data only
+            if len(buf) - self.__pos > self.http_max_line_length:
                 return self.__error('too much data without a line termination (a)')
             return None
-        line, self.__data = test
+        line = str(buf[self.__pos:end])
+        self.__pos = self.__scan = end + 1
         if len(line):
             if line[-1] == '\r':
                 line = line[:-1]
@@ -238,6 +493,7 @@ class HTTPHandler(BasicHandler):
                 self.http_status_message = ' '.join(toks[2:])
             if toks[0] not in ('HTTP/1.0', 'HTTP/1.1'):
                 return self.__error('Invalid status line: not HTTP/1.0 or HTTP/1.1')
+            self.http_version = toks[0]
             try:
                 self.http_status_code = toks[1]
                 self.http_status_code = int(self.http_status_code)
@@ -251,19 +507,16 @@ class HTTPHandler(BasicHandler):
 
             if toks[2] not in ('HTTP/1.0', 'HTTP/1.1'):
                 return self.__error('Invalid status line: not HTTP/1.0 or HTTP/1.1')
+            self.http_version = toks[2]
             self.http_method = toks[0]
 
-            res = urlparse.urlparse(toks[1])
-            self.http_resource = res.path
-            self.http_query = {}
-            self.http_query_string = ''
-            if res.query:
+            target = toks[1]
+            if target[0] == '/' and '#' not in target and ';' not in target:
+                self.http_resource, _, self.http_query_string = target.partition('?')  # the usual case
+            else:
+                res = urlparse.urlparse(target)
+                self.http_resource = res.path
                 self.http_query_string = res.query
-                qs = urlparse.parse_qs(res.query)
-                for n, v in qs.items():
-                    if len(v) == 1:
-                        qs[n], = v
-                self.http_query = qs
 
         self.__state = self.__header
         return True
@@ -277,21 +530,37 @@ class HTTPHandler(BasicHandler):
             return self._end_header()
 
         else:
-            if len(self.http_headers) == self.http_max_header_count:
+            if self.__header_count == self.http_max_header_count:
                 return self.__error('Too many header records defined')
             test = line.split(':', 1)
             if len(test) != 2:
                 return self.__error('Invalid header: missing colon')
             name, value = test
-            self.http_headers[name.strip()] = value.strip()
+            name = name.strip()
+            headers = self.http_headers
+            lower = _lower_names.get(name)
+            index = headers._index
+            if lower is not None and lower not in index:  # HTTPHeaders.add, inlined for a common name
+                index[lower] = name
+                _dict_setitem(headers, name, value.strip())
+            else:
+                headers.add(name, value.strip())
+            self.__header_count += 1
 
         return True
 
     def _end_header(self):
 
-        # make sure lower-case versions of header names are available (for case-insensitive operation)
-        for n, v in self.http_headers.items():
-            self.http_headers[n.lower()] = v
+        if self.http_headers.get('content-encoding', '').lower() in ('gzip', 'x-gzip', 'deflate'):
+            self.__decompress = zlib.decompressobj(zlib.MAX_WBITS | 32)  # zlib or gzip header
+
+        if self.http_multipart_spool_threshold is not None:
+            content_type = self.http_headers.get('Content-Type', '')
+            if content_type.startswith('multipart'):
+                boundary = content_boundary(content_type)
+                if boundary is None:
+                    return self.__error('Malformed multipart message')
+                self.__multipart_parser = MultipartParser(boundary, self.http_multipart_spool_threshold, self.http_max_line_length)
 
         if getattr(self, '_http_method', None) == 'HEAD':  # this gets set if the send method is called
             self.__length = 0
@@ -327,18 +596,87 @@ class HTTPHandler(BasicHandler):
 
         return True
 
+    # content is handled a piece at a time as it arrives (instead of all at
+    # once) when it is streamed (http_stream), decompressed or multipart
+    # parsed.
+
+    @property
+    def __is_incremental(self):
+        return self.http_stream or self.__decompress is not None or self.__multipart_parser is not None
+
+    def __body_chunk(self, data):
+        if self.__decompress is not None:
+            try:
+                data = self.__decompress.decompress(data)
+            except zlib.error:
+                return self.__error('Invalid compressed content')
+            self.__decompressed += len(data)
+            if self.http_max_content_length and self.__decompressed > self.http_max_content_length:
+                return self.__error('Decompressed content exceeds maximum length')
+        return self.__deliver(data)
+
+    def __deliver(self, data):
+        ''' hand a piece of (decompressed) content to the multipart parser, on_http_body_chunk or http_content '''
+        if self.__multipart_parser is not None:
+            try:
+                self.__multipart_parser.feed(data)
+            except ValueError:
+                return self.__error('Malformed multipart message')
+        elif self.http_stream:
+            if data:
+                self.on_http_body_chunk(data)
+        else:
+            self.__content_parts.append(data)
+        return True
+
+    def __body_end(self):
+        if self.__decompress is not None and not self.__deliver(self.__decompress.flush()):
+            return False
+        parser = self.__multipart_parser
+        if parser is not None:
+            try:
+                self.__multipart = parser.close()
+            except ValueError:
+                return self.__error('Malformed multipart message')
+        elif self.http_stream:
+            self.on_http_body_end()
+        self._on_http_data()
+        return True
+
     def __identity(self):
+        if self.__is_incremental and self.__available:
+            self.__body_chunk(self.__take(self.__available))
         return False
 
     def __on_identity_close(self):
-        self.http_content = self.__data
-        self._on_http_data()
+        if self.__is_incremental:
+            if self.__available and not self.__body_chunk(self.__take(self.__available)):
+                return
+            self.__body_end()  # a failure has already closed the connection
+        else:
+            self.http_content = self.__take(self.__available)
+            self._on_http_data()
+
+    def __stream(self):
+        ''' hand up to __length bytes of available content to __body_chunk '''
+        data = self.__take(min(self.__available, self.__length))
+        self.__length -= len(data)
+        return self.__body_chunk(data)
 
     def __content(self):
-        if len(self.__data) >= self.__length:
-            self.http_content = self.__data[:self.__length]
+        if self.__is_incremental:
+            if self.__length and self.__available:
+                if not self.__stream():
+                    return False
+            if self.__length:
+                return False
+            if not self.__body_end():
+                return False
+            self._setup()
+            return True
+        if self.__available >= self.__length:
+            self.http_content = self.__take(self.__length)
             self._on_http_data()
-            self.__data = self.__data[self.__length:]
             self._setup()
             return True
         return False
@@ -355,17 +693,23 @@ class HTTPHandler(BasicHandler):
         if self.__length == 0:
             self.__state = self.__footer
             return True
+        self.__received += self.__length
         if self.http_max_content_length:
-            if (len(self.__data) + self.__length) > self.http_max_content_length:
+            if self.__received > self.http_max_content_length:
                 self.send_server(code=413, message='Request Entity Too Large')
                 return self.__error('Content-Length exceeds maximum length')
         self.__state = self.__chunked_content
         return True
 
     def __chunked_content(self):
-        if len(self.__data) >= self.__length:
-            self.http_content += self.__data[:self.__length]
-            self.__data = self.__data[self.__length:]
+        if self.__is_incremental:
+            if not self.__available or not self.__stream():
+                return False
+            if self.__length == 0:
+                self.__state = self.__chunked_content_end
+            return True
+        if self.__available >= self.__length:
+            self.__content_parts.append(self.__take(self.__length))
             self.__state = self.__chunked_content_end
             return True
         return False
@@ -385,29 +729,406 @@ class HTTPHandler(BasicHandler):
             return False
 
         if len(line) == 0:
-            self._on_http_data()
+            if self.__is_incremental:
+                if not self.__body_end():
+                    return False
+            else:
+                self._on_http_data()
             self._setup()
             return True
 
         test = line.split(':', 1)
         if len(test) != 2:
             return self.__error('Invalid footer: missing colon')
-        if len(self.http_headers) == self.http_max_header_count:
+        if self.__header_count == self.http_max_header_count:
             return self.__error('Too many header records defined')
         name, value = test
-        self.http_headers[name.strip()] = value.strip()
+        self.http_headers.add(name.strip(), value.strip())
+        self.__header_count += 1
         return True
 
 
+def content_charset(content_type):
+    ''' return the charset from a Content-Type header value, or None '''
+    if content_type:
+        charset = [c.split('=')[1].strip() for c in content_type.split(';') if 'charset' in c]
+        if len(charset):
+            return charset[0]
+    return None
+
+
+def content_boundary(content_type):
+    ''' return the boundary from a (multipart) Content-Type header value, or None '''
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'boundary':
+            value = value.strip()
+            if len(value) > 1 and value[0] == value[-1] == '"':
+                value = value[1:-1]  # quoted
+            return value or None
+    return None
+
+
+def decode_content(content, content_type):
+    ''' decode content using the charset in content_type, if there is one '''
+    charset = content_charset(content_type)
+    if charset:
+        return content.decode(charset)
+    return content
+
+
+def parse_query(query_string):
+    '''
+        parse a query string into a dict
+
+        a name which appears once has a string value; a name which appears
+        more than once has a list of values.
+    '''
+    if not query_string:
+        return {}
+    qs = urlparse.parse_qs(query_string)
+    for n, v in qs.items():
+        if len(v) == 1:
+            qs[n], = v
+    return qs
+
+
+def parse_multipart(content, boundary):
+    '''
+        split a multipart message into a list of HTTPPart objects
+
+        Parameters:
+            content  - undecoded message content
+            boundary - boundary from the Content-Type header (see
+                       content_boundary)
+
+        an exception is raised if the message is malformed.
+    '''
+    if not boundary:
+        raise ValueError('missing multipart boundary')
+    result = []
+    for part in [p[2:] for p in content.split('--' + boundary)][1:-1]:  # split, remove \r\n and ignore first & last
+        headers, content = _part_headers(part)
+        result.append(HTTPPart(headers, _disposition(headers), content))
+    return result
+
+
+def _disposition(headers):
+    ''' split the parameters from a part's Content-Disposition header into a dict '''
+    if 'Content-Disposition' not in headers:
+        return {}
+    headers['Content-Disposition'], rem = headers['Content-Disposition'].split('; ', 1)
+    return dict(part.split('=', 1) for part in rem.split('; '))
+
+
+def _part_headers(part):
+    ''' split one part of a multipart message into (headers, content) '''
+    headers = {}
+    start = 0
+    while True:
+        end = part.find('\n', start)
+        if end == -1:
+            raise ValueError('missing end of part headers')
+        line = part[start:end]
+        start = end + 1
+        if line.endswith('\r'):
+            line = line[:-1]
+        if line == '':
+            return headers, part[start:]
+        name, value = line.split(': ', 1)
+        headers[name] = value
+
+
+_dict_contains = dict.__contains__
+_dict_getitem = dict.__getitem__
+_dict_setitem = dict.__setitem__
+_dict_delitem = dict.__delitem__
+
+_lower_names = {}  # header name: lower-case name, shared between messages
+_MAX_LOWER_NAMES = 1024
+
+
+def _lower(name):
+    lower = _lower_names.get(name)
+    if lower is None:
+        lower = name.lower()
+        if len(_lower_names) < _MAX_LOWER_NAMES:  # don't grow without bound on odd names
+            _lower_names[name] = lower
+    return lower
+
+
+class HTTPHeaders(dict):
+
+    __slots__ = ('_index', '_multi')
+
+    def __init__(self, *args, **kwargs):
+        '''
+            A dict of http headers with case-insensitive names.
+
+            Names keep the case they were given with, which is what iteration
+            (keys, items, json.dumps) shows, but can be looked up, replaced or
+            deleted in any case.
+
+            A header that appears more than once (see add) has its values
+            joined with ', '; each separate value is available from get_all.
+        '''
+        dict.__init__(self)
+        self._index = {}  # lower-case name: name
+        self._multi = None  # lower-case name: [value, ...] for repeated headers
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    def _name(self, name):
+        ''' the name under which name is stored, or None '''
+        if _dict_contains(self, name):
+            return name
+        lower = _lower_names.get(name)
+        return self._index.get(lower if lower is not None else _lower(name))
+
+    def __getitem__(self, name):
+        if _dict_contains(self, name):  # exact case
+            return _dict_getitem(self, name)
+        stored = self._name(name)
+        if stored is None:
+            raise KeyError(name)
+        return _dict_getitem(self, stored)
+
+    def __setitem__(self, name, value):
+        lower = _lower(name)
+        index = self._index
+        stored = index.get(lower)
+        if stored is not None and stored != name:
+            _dict_delitem(self, stored)
+        index[lower] = name
+        if self._multi:
+            self._multi.pop(lower, None)
+        _dict_setitem(self, name, value)
+
+    def __delitem__(self, name):
+        stored = self._name(name)
+        if stored is None:
+            raise KeyError(name)
+        lower = _lower(name)
+        del self._index[lower]
+        if self._multi:
+            self._multi.pop(lower, None)
+        _dict_delitem(self, stored)
+
+    def __contains__(self, name):
+        if _dict_contains(self, name):  # exact case
+            return True
+        lower = _lower_names.get(name)
+        return (lower if lower is not None else _lower(name)) in self._index
+
+    has_key = __contains__
+
+    def get(self, name, default=None):
+        if _dict_contains(self, name):  # exact case
+            return _dict_getitem(self, name)
+        stored = self._name(name)
+        if stored is None:
+            return default
+        return _dict_getitem(self, stored)
+
+    def pop(self, name, *default):
+        if name not in self:
+            if default:
+                return default[0]
+            raise KeyError(name)
+        value = self[name]
+        del self[name]
+        return value
+
+    def setdefault(self, name, value=None):
+        if name not in self:
+            self[name] = value
+        return self[name]
+
+    def update(self, *args, **kwargs):
+        for name, value in dict(*args, **kwargs).items():
+            self[name] = value
+
+    def clear(self):
+        dict.clear(self)
+        self._index.clear()
+        self._multi = None
+
+    def copy(self):
+        return HTTPHeaders(self)
+
+    def add(self, name, value):
+        ''' add a header, keeping any value it already has '''
+        lower = _lower(name)
+        stored = self._index.get(lower)
+        if stored is None:
+            self._index[lower] = name
+            _dict_setitem(self, name, value)
+            return
+        if self._multi is None:
+            self._multi = {}
+        values = self._multi.get(lower)
+        if values is None:
+            values = self._multi[lower] = [_dict_getitem(self, stored)]
+        values.append(value)
+        _dict_setitem(self, stored, ', '.join(values))
+
+    def get_all(self, name):
+        ''' list of each value of a header (empty if missing) '''
+        stored = self._name(name)
+        if stored is None:
+            return []
+        if self._multi:
+            values = self._multi.get(_lower(name))
+            if values is not None:
+                return list(values)
+        return [_dict_getitem(self, stored)]
+
+
 class HTTPPart(object):
 
-    def __init__(self, headers, disposition, content):
+    def __init__(self, headers, disposition, content, file=None):
         '''
             Container for one part of a multipart message.
 
             The disposition is a dict with the k:v pairs from the 'Content-Disposition'
             header, where things like filename are stored.
+
+            The part's content is either in memory, as the string content, or,
+            if it was spooled by a MultipartParser, in file, a temp file
+            positioned at the start (content is None).
         '''
         self.headers = headers
         self.disposition = disposition
         self.content = content
+        self.file = file
+
+
+class MultipartParser(object):
+
+    def __init__(self, boundary, spool_threshold=None, max_header_length=10000):
+        '''
+            Incremental parser for the content of a multipart message.
+
+            Content is handed to feed as it arrives; close is called at the
+            end of the content, and returns the list of HTTPPart objects.
+            Only the tail of the content that might hold the start of a
+            boundary is held between calls to feed.
+
+            Parameters:
+                boundary          - boundary from the Content-Type header
+                spool_threshold   - a part with more than this many bytes
+                                    of content is written to a temp file
+                                    (None = never)
+                max_header_length - longest part header line allowed
+
+            A ValueError is raised by feed or close if the content is
+            malformed.
+
+            Notes:
+
+                1. the parts match the ones produced by parse_multipart.
+        '''
+        self.__delimiter = '--' + boundary
+        self.__spool_threshold = spool_threshold
+        self.__max_header_length = max_header_length
+        self.__buf = bytearray()
+        self.__headers = None
+        self.__pieces = []  # content of the current part
+        self.__size = 0
+        self.__file = None  # temp file for the current part
+        self.__state = self.__preamble
+        self.parts = []
+
+    def feed(self, data):
+        self.__buf += data
+        while self.__state():
+            pass
+
+    def close(self):
+        if self.__state != self.__epilogue:
+            raise ValueError('incomplete multipart message')
+        return self.parts
+
+    def __preamble(self):
+        buf = self.__buf
+        end = buf.find(self.__delimiter)
+        if end == -1:
+            del buf[:-len(self.__delimiter)]  # keep what could be the start of the delimiter
+            return False
+        del buf[:end + len(self.__delimiter)]
+        self.__state = self.__delimiter_end
+        return True
+
+    def __delimiter_end(self):
+        buf = self.__buf
+        if len(buf) < 2:
+            return False
+        if buf[:2] == '--':
+            self.__state = self.__epilogue
+            return True
+        del buf[:2]  # \r\n
+        self.__headers = {}
+        self.__state = self.__header
+        return True
+
+    def __header(self):
+        buf = self.__buf
+        end = buf.find('\n')
+        if end == -1:
+            if len(buf) > self.__max_header_length:
+                raise ValueError('part header too long')
+            return False
+        line = str(buf[:end])
+        del buf[:end + 1]
+        if line.endswith('\r'):
+            line = line[:-1]
+        if line == '':
+            self.__state = self.__content
+            return True
+        name, value = line.split(': ', 1)
+        self.__headers[name] = value
+        return True
+
+    def __content(self):
+        buf = self.__buf
+        end = buf.find(self.__delimiter)
+        if end == -1:
+            keep = len(self.__delimiter)
+            if len(buf) > keep:
+                self.__write(str(buf[:-keep]))
+                del buf[:-keep]
+            return False
+        self.__write(str(buf[:end]))
+        del buf[:end + len(self.__delimiter)]
+        self.__end_part()
+        self.__state = self.__delimiter_end
+        return True
+
+    def __epilogue(self):
+        del self.__buf[:]
+        return False
+
+    def __write(self, data):
+        if self.__file is not None:
+            self.__file.write(data)
+            return
+        self.__pieces.append(data)
+        self.__size += len(data)
+        if self.__spool_threshold is not None and self.__size > self.__spool_threshold:
+            self.__file = tempfile.TemporaryFile()
+            for piece in self.__pieces:
+                self.__file.write(piece)
+            self.__pieces = []
+
+    def __end_part(self):
+        headers = self.__headers
+        part = HTTPPart(headers, _disposition(headers), None)
+        if self.__file is not None:
+            self.__file.seek(0)
+            part.file = self.__file
+        else:
+            part.content = ''.join(self.__pieces)
+        self.parts.append(part)
+        self.__pieces = []
+        self.__size = 0
+        self.__file = None
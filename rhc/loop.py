@@ -0,0 +1,67 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2013-2017 Robert H Chase
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+from rhc.tcpsocket import SERVER
+from rhc.timer import TIMERS
+
+
+def timeout(max_delay=None, timers=TIMERS):
+    '''
+        Return the time, in seconds, until the next timer expires.
+
+        Parameters:
+            max_delay - upper limit on the returned value (None means no limit)
+            timers    - rhc.timer.Timer instance
+
+        If no timer is running, max_delay is returned.
+    '''
+    expiration = timers.next_expiration()
+    if expiration is None:
+        return max_delay
+    delay = max(0.0, expiration - timers.clock())
+    if max_delay is not None and delay > max_delay:
+        delay = max_delay
+    return delay
+
+
+def service(max_delay=None, max_iterations=0, server=SERVER, timers=TIMERS):
+    '''
+        Service network activity and timers once.
+
+        Parameters:
+            max_delay      - maximum time, in seconds, to block waiting for
+                             network activity (None means no limit)
+            max_iterations - passed to server.service
+            server         - rhc.tcpsocket.Server instance
+            timers         - rhc.timer.Timer instance
+
+        The network is polled until the earliest running timer expires or
+        network activity is detected, whichever comes first, after which any
+        expired timers are executed. With no running timers and no max_delay,
+        the call blocks until network activity.
+
+        Return True if any network activity was handled.
+    '''
+    did_anything = server.service(delay=timeout(max_delay, timers), max_iterations=max_iterations)
+    timers.service()
+    return did_anything
@@ -1,12 +1,18 @@
 from importlib import import_module
+import errno
 import logging
+import os
+import signal
 import sys
+import time
 import uuid
 
 import rhc.async as async
 import rhc.file_util as file_util
+import rhc.loop as event_loop
 from rhc.micro_fsm.parser import Parser as parser
-from rhc.resthandler import LoggingRESTHandler, RESTMapper
+from rhc.pool import POOL
+from rhc.resthandler import COMPRESS_TYPES, LoggingRESTHandler, RESTMapper
 from rhc.tcpsocket import SERVER
 from rhc.timer import TIMERS
 from rhc import CONNECTIONS as connection
@@ -30,12 +36,28 @@ class _User(object):
 USER = _User()
 
 
+class Shutdown(BaseException):
+    ''' raised in a worker process to stop the run loop '''
+    pass
+
+
 class MicroContext(object):
 
-    def __init__(self, http_max_content_length, http_max_line_length, http_max_header_count):
+    def __init__(self, http_max_content_length, http_max_line_length, http_max_header_count, http_message_limit=None, http_spool_threshold=None,
+                 http_keep_alive_timeout=None, http_max_requests=None,
+                 http_compress_min_size=None, http_compress_level=6, http_compress_types=COMPRESS_TYPES,
+                 http_multipart_spool_threshold=None):
         self.http_max_content_length = http_max_content_length
         self.http_max_line_length = http_max_line_length
         self.http_max_header_count = http_max_header_count
+        self.http_message_limit = http_message_limit
+        self.http_spool_threshold = http_spool_threshold
+        self.http_keep_alive_timeout = http_keep_alive_timeout
+        self.http_max_requests = http_max_requests
+        self.http_compress_min_size = http_compress_min_size
+        self.http_compress_level = http_compress_level
+        self.http_compress_types = http_compress_types
+        self.http_multipart_spool_threshold = http_multipart_spool_threshold
 
 
 class MicroRESTHandler(LoggingRESTHandler):
@@ -46,6 +68,14 @@ class MicroRESTHandler(LoggingRESTHandler):
         self.http_max_content_length = context.http_max_content_length
         self.http_max_line_length = context.http_max_line_length
         self.http_max_header_count = context.http_max_header_count
+        self.http_message_limit = context.http_message_limit
+        self.http_spool_threshold = context.http_spool_threshold
+        self.http_keep_alive_timeout = context.http_keep_alive_timeout
+        self.http_max_requests = context.http_max_requests
+        self.http_compress_min_size = context.http_compress_min_size
+        self.http_compress_level = context.http_compress_level
+        self.http_compress_types = context.http_compress_types
+        self.http_multipart_spool_threshold = context.http_multipart_spool_threshold
 
     def on_rest_exception(self, exception_type, value, trace):
         code = uuid.uuid4().hex
@@ -73,6 +103,7 @@ def load_server(filename, config=None):
         p.config._load(file_util.normalize_path(config))
     sys.modules[__name__].config = p.config
     SERVER.close()
+    setup_loop(p.config)
     setup_servers(p.config, p.servers, p.is_new)
     return p
 
@@ -98,7 +129,14 @@ def load_config(config='config', micro='micro'):
     return p.config
 
 
-def setup_servers(config, servers, is_new):
+def setup_loop(config):
+    SERVER.set_backend(config.loop.backend, config.loop.edge_triggered)
+    log.info('network backend %s%s', config.loop.backend, ' (edge triggered)' if config.loop.edge_triggered else '')
+    TIMERS.set_engine(config.loop.timers)
+    log.info('timer engine %s', config.loop.timers)
+
+
+def setup_servers(config, servers, is_new, reuse_port=False):
     for server in servers.values():
         if is_new:
             conf = config._get('server.%s' % server.name)
@@ -110,13 +148,21 @@ def setup_servers(config, servers, is_new):
             conf.http_max_content_length if hasattr(conf, 'http_max_content_length') else None,
             conf.http_max_line_length if hasattr(conf, 'http_max_line_length') else 10000,
             conf.http_max_header_count if hasattr(conf, 'http_max_header_count') else 100,
+            conf.http_message_limit if hasattr(conf, 'http_message_limit') else None,
+            conf.http_spool_threshold if hasattr(conf, 'http_spool_threshold') else None,
+            conf.http_keep_alive_timeout if hasattr(conf, 'http_keep_alive_timeout') else None,
+            conf.http_max_requests if hasattr(conf, 'http_max_requests') else None,
+            conf.http_compress_min_size if hasattr(conf, 'http_compress_min_size') else None,
+            conf.http_compress_level if hasattr(conf, 'http_compress_level') else 6,
+            tuple(t.strip() for t in conf.http_compress_types.split(',')) if hasattr(conf, 'http_compress_types') else COMPRESS_TYPES,
+            conf.http_multipart_spool_threshold if hasattr(conf, 'http_multipart_spool_threshold') else None,
         )
         mapper = RESTMapper(context)
         for route in server.routes:
             methods = {}
             for method, path in route.methods.items():
                 methods[method] = _import(path)
-            mapper.add(route.pattern, silent=route.silent, **methods)
+            mapper.add(route.pattern, silent=route.silent, cache=route.cache, cache_size=route.cache_size, vary=route.vary, **methods)
         handler = _import(server.handler) if server.handler else MicroRESTHandler
         SERVER.add_server(
             conf.port,
@@ -125,11 +171,14 @@ def setup_servers(config, servers, is_new):
             conf.ssl.is_active,
             conf.ssl.certfile,
             conf.ssl.keyfile,
+            reuse_port=reuse_port,
+            backlog=conf.backlog,
         )
         log.info('listening on %s port %d', server.name, conf.port)
 
 
 def setup_connections(config, connections):
+    POOL.configure(config.pool.max_idle, config.pool.max_per_host, config.pool.idle_timeout)
     for c in connections.values():
         conf = config._get('connection.%s' % c.name)
         headers = {}
@@ -147,6 +196,7 @@ def setup_connections(config, connections):
            _import(c.handler) if c.handler else None,
            _import(c.setup) if c.setup else None,
            headers,
+           POOL if conf.pool else None,
         )
         for resource in c.resources.values():
             optional = {}
@@ -185,14 +235,27 @@ def start(config, setup):
 
 
 def run(sleep=100, max_iterations=100):
+    '''
+        service SERVER and TIMERS until shutdown
+
+        Parameters:
+            sleep          - maximum time, in ms, between calls to the USER
+                             function; ignored if there is no USER function
+            max_iterations - passed to SERVER.service
+
+        Without a USER function, each pass blocks until the next timer
+        expires or there is network activity.
+    '''
     while True:
         try:
-            SERVER.service(delay=sleep/1000.0, max_iterations=max_iterations)
-            TIMERS.service()
+            event_loop.service(sleep/1000.0 if USER.execute else None, max_iterations)
             USER.service()
         except KeyboardInterrupt:
             log.info('Received shutdown command from keyboard')
             break
+        except Shutdown:
+            log.info('Received shutdown signal')
+            break
         except Exception:
             log.exception('exception encountered')
 
@@ -202,6 +265,110 @@ def stop(teardown):
         _import(teardown)()
 
 
+def serve(p, reuse_port=False):
+    ''' set up and run a micro service in this process '''
+    setup_loop(p.config)
+    setup_servers(p.config, p.servers, p.is_new, reuse_port)
+    if p.is_new:
+        setup_connections(p.config, p.connections)
+    setup_user(p.user)
+    start(p.config, p.setup)
+    run()
+    stop(p.teardown)
+
+
+def _worker(p):
+
+    def on_signal(signum, frame):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)  # once is enough
+        raise Shutdown()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor sends SIGTERM
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    rc = 0
+    try:
+        serve(p, reuse_port=True)
+    except BaseException:
+        log.exception('worker pid=%d failed', os.getpid())
+        rc = 1
+    finally:
+        logging.shutdown()
+        os._exit(rc)
+
+
+def _fork(p):
+    pid = os.fork()
+    if pid == 0:
+        _worker(p)  # does not return
+    log.info('started worker pid=%d', pid)
+    return pid
+
+
+def run_workers(p, workers, restart_delay=1.0):
+    '''
+        run a micro service in several worker processes
+
+        Parameters:
+            p             - parsed micro file (micro_fsm.parser.Parser)
+            workers       - number of worker processes
+            restart_delay - time, in seconds, to wait before replacing a
+                            worker which exits within restart_delay seconds
+                            of starting
+
+        Each worker is a forked copy of this process which runs serve with
+        its own SERVER, TIMERS and CONNECTIONS. Listening sockets are opened
+        with SO_REUSEPORT so that the kernel distributes connections among
+        the workers.
+
+        This process supervises the workers, replacing any that exit. On
+        SIGINT, SIGTERM or SIGHUP the workers are stopped (SIGHUP does not
+        reload): each is sent SIGTERM, and this function returns after they
+        all exit, with the previous signal handlers restored.
+    '''
+    state = {'running': True}
+
+    def on_signal(signum, frame):
+        if state['running']:
+            log.info('received signal %d, stopping workers', signum)
+        state['running'] = False
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    children = {}
+    for _ in range(workers):
+        children[_fork(p)] = time.time()
+
+    handlers = {}
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        handlers[signum] = signal.signal(signum, on_signal)
+    try:
+        while children:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            started = children.pop(pid, None)
+            if started is None:
+                continue
+            if not state['running']:
+                log.info('worker pid=%d stopped', pid)
+                continue
+            log.warning('worker pid=%d exited, status=%d', pid, status)
+            if time.time() - started < restart_delay:
+                time.sleep(restart_delay)
+            if state['running']:
+                children[_fork(p)] = time.time()
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+
 def launch(micro):
     p = parser.parse(micro)
     sys.modules[__name__].config = p.config
@@ -225,6 +392,7 @@ if __name__ == '__main__':
     aparser.add_argument('--no-config', dest='no_config', default=False, action='store_true', help="don't use a config file")
     aparser.add_argument('--micro', default='micro', help='micro description file')
     aparser.add_argument('-c', '--config-only', dest='config_only', action='store_true', default=False, help='parse micro and config files and display config values')
+    aparser.add_argument('-w', '--workers', type=int, default=0, help='number of worker processes (0=run in this process)')
 
     aparser.add_argument('-v', '--verbose', action='store_true', default=False, help='display debug level messages')
     aparser.add_argument('-s', '--stdout', action='store_true', default=False, help='display messages to stdout')
@@ -237,10 +405,7 @@ if __name__ == '__main__':
         print p.config
     else:
         module.config = p.config
-        setup_servers(p.config, p.servers, p.is_new)
-        if p.is_new:
-            setup_connections(p.config, p.connections)
-        setup_user(p.user)
-        start(p.config, p.setup)
-        run()
-        stop(p.teardown)
+        if args.workers:
+            run_workers(p, args.workers)
+        else:
+            serve(p)
@@ -4,6 +4,8 @@ import re
 import rhc.config as config_file
 from rhc.file_util import normalize_path
 from rhc.micro_fsm.fsm_micro import create as create_machine
+from rhc.tcpsocket import BACKENDS
+from rhc.timer import ENGINES
 
 import logging
 log = logging.getLogger(__name__)
@@ -91,6 +93,13 @@ class Parser(object):
         self.servers = {}
         self.user = None
 
+        self._add_config('loop.backend', value='poll', validator=validate_backend)
+        self._add_config('loop.edge_triggered', value=False, validator=config_file.validate_bool)
+        self._add_config('loop.timers', value='heap', validator=validate_timers)
+        self._add_config('pool.max_idle', value=100, validator=config_file.validate_int)
+        self._add_config('pool.max_per_host', value=10, validator=config_file.validate_int)
+        self._add_config('pool.idle_timeout', value=30.0, validator=float)
+
     @property
     def is_new(self):
         return len(self._config_servers) == 0
@@ -158,6 +167,7 @@ class Parser(object):
             self._add_config('connection.%s.is_active' % connection.name, value=True, validator=config_file.validate_bool)
             self._add_config('connection.%s.is_debug' % connection.name, value=connection.is_debug, validator=config_file.validate_bool)
             self._add_config('connection.%s.timeout' % connection.name, value=connection.timeout, validator=float)
+            self._add_config('connection.%s.pool' % connection.name, value=connection.pool, validator=config_file.validate_bool)
 
     def act_add_header(self):
         header = Header(*self.args, **self.kwargs)
@@ -222,6 +232,7 @@ class Parser(object):
             self.server = server
             self._add_config('server.%s.port' % server.name, value=server.port, validator=config_file.validate_int)
             self._add_config('server.%s.is_active' % server.name, value=True, validator=config_file.validate_bool)
+            self._add_config('server.%s.backlog' % server.name, value=server.backlog, validator=config_file.validate_int)
             self._add_config('server.%s.ssl.is_active' % server.name, value=False, validator=config_file.validate_bool)
             self._add_config('server.%s.ssl.keyfile' % server.name, validator=config_file.validate_file)
             self._add_config('server.%s.ssl.certfile' % server.name, validator=config_file.validate_file)
@@ -240,6 +251,7 @@ class Parser(object):
             self.server = server
             self._add_config('%s.port' % server.name, value=server.port, validator=config_file.validate_int)
             self._add_config('%s.is_active' % server.name, value=True, validator=config_file.validate_bool)
+            self._add_config('%s.backlog' % server.name, value=server.backlog, validator=config_file.validate_int)
             self._add_config('%s.ssl.is_active' % server.name, value=False, validator=config_file.validate_bool)
             self._add_config('%s.ssl.keyfile' % server.name, validator=config_file.validate_file)
             self._add_config('%s.ssl.certfile' % server.name, validator=config_file.validate_file)
@@ -265,6 +277,18 @@ class Parser(object):
         self.server.set_silent(config_file.validate_bool(self.args[0]))
 
 
+def validate_backend(value):
+    if value not in BACKENDS:
+        raise ValueError("invalid backend '%s', expecting one of %s" % (value, ', '.join(BACKENDS)))
+    return value
+
+
+def validate_timers(value):
+    if value not in ENGINES:
+        raise ValueError("invalid timer engine '%s', expecting one of %s" % (value, ', '.join(ENGINES)))
+    return value
+
+
 class Config(object):
 
     def __init__(self, name, default=None, validate=None, env=None):
@@ -280,10 +304,11 @@ class Config(object):
 
 class Server(object):
 
-    def __init__(self, name, port, handler=None):
+    def __init__(self, name, port, handler=None, backlog=100):
         self.name = name
         self.port = int(port)
         self.handler  = handler
+        self.backlog = int(backlog)
         self.routes = []
 
     def __repr__(self):
@@ -302,14 +327,17 @@ class Server(object):
 
 class Route(object):
 
-    def __init__(self, pattern):
+    def __init__(self, pattern, cache=None, cache_size=1000, vary=None):
         self.pattern = pattern
         self.methods = {}
         self.silent = False
+        self.cache = float(cache) if cache is not None else None
+        self.cache_size = int(cache_size)
+        self.vary = [name.strip() for name in vary.split(',')] if vary else None
 
     def __repr__(self):
-        return 'Route[pattern=%s, methods=%s, silent=%s]' % (
-            self.pattern, self.methods, self.silent
+        return 'Route[pattern=%s, methods=%s, silent=%s, cache=%s]' % (
+            self.pattern, self.methods, self.silent, self.cache
         )
 
 
@@ -325,7 +353,7 @@ class Method(object):
 
 class Connection(object):
 
-    def __init__(self, name, url=None, is_json=True, is_debug=False, timeout=5.0, handler=None, wrapper=None, setup=None, is_form=False, code=None):
+    def __init__(self, name, url=None, is_json=True, is_debug=False, timeout=5.0, handler=None, wrapper=None, setup=None, is_form=False, code=None, pool=False):
         self.name = name
         self.url = url
         self.is_json = config_file.validate_bool(is_json)
@@ -336,6 +364,7 @@ class Connection(object):
         self.setup = setup
         self.is_form = config_file.validate_bool(is_form)
         self.code = code
+        self.pool = config_file.validate_bool(pool)
 
         self.headers = {}
         self.resources = {}
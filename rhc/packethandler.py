@@ -22,17 +22,24 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 '''
 import struct
-from tcpsocket import BasicHandler, Client
+from rhc.tcpsocket import BasicHandler
 
 
 class PacketHandler (BasicHandler):
 
-    ''' Handle header+packet/TCP protocol '''
+    ''' Handle header+packet/TCP protocol
+
+        Complete packets are passed to on_data. While the handler's output is
+        backed up (see BasicHandler.is_writing_paused) packets which have
+        already been received are held until writing resumes.
+    '''
 
     def __init__(self, socket, context=None):
         super(PacketHandler, self).__init__(socket, context)
         self.txPacketCount = 0
         self.rxPacketCount = 0
+        self.__buf = bytearray()  # received data
+        self.__pos = 0  # start of unframed data in __buf
         self.__setup_header()  # start off waiting for a header
 
     # ---
@@ -65,33 +72,46 @@ class PacketHandler (BasicHandler):
     # --- leave the following methods alone
     # ---
 
-    def on_recv(self, data):
-        self.__read_buf += data
-        self.RECV_LEN -= len(data)
-        if 0 == self.RECV_LEN:
-            self.read_handler()
-
-    def __data_handler(self):
-        self.on_data(self.__read_buf)
+    def _on_data(self, data):
+        buf = self.__buf
+        if self.__pos:
+            del buf[:self.__pos]  # discard framed data
+            self.__pos = 0
+        buf += data
+        self.__process()
+
+    def _on_resume_writing(self):
+        self.__process()
+
+    def __process(self):
+        buf = self.__buf
+        while not self.is_writing_paused and not self.closed and len(buf) - self.__pos >= self.__length:
+            start = self.__pos
+            self.__pos = start + self.__length
+            self.read_handler(memoryview(buf)[start:self.__pos].tobytes())
+        if self.__pos == len(buf):
+            del buf[:]
+            self.__pos = 0
+
+    def __data_handler(self, data):
+        self.on_data(data)
         self.__setup_header()
 
-    def __header_handler(self):
+    def __header_handler(self, header):
         self.rxPacketCount += 1
-        self.RECV_LEN = self.on_header(self.__read_buf)
-        if 0 == self.RECV_LEN:
+        self.__length = self.on_header(header)
+        if 0 == self.__length:
             self.__setup_header()
         else:
             self.__setup_data()
 
     def __setup_header(self):
-        self.__read_buf = ''
         self.read_handler = self.__header_handler
-        self.RECV_LEN = self.header_length()
-        assert (self.RECV_LEN > 0)
+        self.__length = self.header_length()
+        assert (self.__length > 0)
         self.setup_header()
 
     def __setup_data(self):
-        self.__read_buf = ''
         self.read_handler = self.__data_handler
 
 
@@ -110,18 +130,6 @@ class TwoBytePacketHandler (PacketHandler):
                                                + data)
 
 
-class TwoBytePacketClient (Client):
-
-    def write(self, data):
-        super(TwoBytePacketClient, self).write(
-            struct.pack('!h', len(data)) + data)
-
-    def read(self):
-        l = super(TwoBytePacketClient, self).read(2)
-        l = struct.unpack('!h', l)[0]
-        return super(TwoBytePacketClient, self).read(l)
-
-
 class FourBytePacketHandler (PacketHandler):
 
     ''' PacketHandler for four byte network order data length header '''
@@ -137,21 +145,9 @@ class FourBytePacketHandler (PacketHandler):
                                                 + data)
 
 
-class FourBytePacketClient (Client):
-
-    def write(self, data):
-        super(FourBytePacketClient, self).write(
-            struct.pack('!I', len(data)) + data)
-
-    def read(self):
-        l = super(FourBytePacketClient, self).read(4)
-        l = struct.unpack('!I', l)[0]
-        return super(FourBytePacketClient, self).read(l)
-
-
 if '__main__' == __name__:
     # !!! TEST !!!
-    from tcpsocket import Server
+    from rhc.tcpsocket import Server
     import time
 
     TESTDATA = 'this is a test'
@@ -187,7 +183,7 @@ if '__main__' == __name__:
             assert (len(data) + 2 == self.rxByteCount)
             assert (len(data) + 2 == self.txByteCount)
             assert (1 == self.rxPacketCount)
-            self.shutdown()
+            self.close()
 
     class Context (object):
 
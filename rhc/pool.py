@@ -0,0 +1,211 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2013-2017 Robert H Chase
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+import errno
+import functools
+import socket
+
+from rhc.tcpsocket import SERVER, EVENT_READ
+from rhc.timer import TIMERS
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class _Idle(object):
+
+    def __init__(self, key, sock, ssl_ctx):
+        self.key = key
+        self.sock = sock
+        self.ssl_ctx = ssl_ctx
+        self.timer = None
+
+
+class ConnectionPool(object):
+    '''
+        Idle outbound connections, kept open for re-use.
+
+        Parameters:
+            max_idle     - maximum number of idle connections
+            max_per_host - maximum number of idle connections to one destination
+            idle_timeout - time, in seconds, that an idle connection is kept
+            server       - rhc.tcpsocket.Server which owns the connections
+            timers       - rhc.timer.Timer which runs the idle timeouts
+
+        A destination is the (host, port, ssl, certfile, cafile) used in
+        Server.add_connection. When add_connection is called with a pool,
+        the most recently released idle connection to the destination is
+        used, skipping connect, dns and ssl handshake.
+
+        An idle connection is health checked when it is taken from the
+        pool; if it is readable (the peer closed it, or sent unexpected
+        data) it is closed and the next one is tried. Any activity on an
+        idle connection while it is in the pool also closes it.
+
+        Counters:
+            hit_count     - connections re-used
+            miss_count    - requests for a connection which found none
+            release_count - connections returned to the pool
+            discard_count - connections closed because the pool was full
+            stale_count   - connections closed by the health check
+            expire_count  - connections closed by the idle timeout
+    '''
+
+    def __init__(self, max_idle=100, max_per_host=10, idle_timeout=30.0, server=SERVER, timers=TIMERS):
+        self.max_idle = max_idle
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self._server = server
+        self._timers = timers
+        self._idle = {}  # key -> [_Idle, ...], most recently released last
+        self._count = 0
+
+        self.hit_count = 0
+        self.miss_count = 0
+        self.release_count = 0
+        self.discard_count = 0
+        self.stale_count = 0
+        self.expire_count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def hit_rate(self):
+        ''' fraction of requests for a connection which re-used one '''
+        total = self.hit_count + self.miss_count
+        return float(self.hit_count) / total if total else 0.0
+
+    def configure(self, max_idle=None, max_per_host=None, idle_timeout=None):
+        ''' change limits (None means no change); existing idle connections are kept '''
+        if max_idle is not None:
+            self.max_idle = max_idle
+        if max_per_host is not None:
+            self.max_per_host = max_per_host
+        if idle_timeout is not None:
+            self.idle_timeout = idle_timeout
+
+    def acquire(self, key):
+        '''
+            Return an open _Idle for key (removed from the pool), or None.
+
+            This is called by Server.add_connection.
+        '''
+        idle = self._idle.get(key)
+        while idle:
+            entry = idle.pop()
+            self._count -= 1
+            entry.timer.cancel()
+            if self._is_stale(entry):
+                self.stale_count += 1
+                self._close(entry)
+                continue
+            self.hit_count += 1
+            return entry
+        self.miss_count += 1
+        return None
+
+    def release(self, handler):
+        '''
+            Put a handler's connection in the pool.
+
+            Parameters:
+                handler - a BasicHandler created by Server.add_connection
+                          with this pool, which is finished with the
+                          connection
+
+            Return:
+                True if the connection is pooled, after which the handler
+                is closed without closing the connection (on_close is not
+                called); False if the connection is not pooled, in which
+                case the handler is untouched and should be closed.
+        '''
+        key = handler._pool_key
+        if handler._pool is not self or handler.closed or not handler.t_ready or handler.queued_bytes:
+            return False
+        idle = self._idle.setdefault(key, [])
+        if len(idle) >= self.max_per_host or self._count >= self.max_idle:
+            self.discard_count += 1
+            return False
+        entry = _Idle(key, handler._detach(), handler._ssl_ctx)
+        self._server._register(entry.sock, EVENT_READ, functools.partial(self._on_activity, entry))
+        entry.timer = self._timers.add(functools.partial(self._on_timeout, entry), self.idle_timeout * 1000.0).start()
+        idle.append(entry)
+        self._count += 1
+        self.release_count += 1
+        return True
+
+    def close(self):
+        ''' close all idle connections '''
+        for idle in self._idle.values():
+            for entry in idle:
+                entry.timer.cancel()
+                self._close(entry)
+        self._idle = {}
+        self._count = 0
+
+    def _remove(self, entry):
+        idle = self._idle.get(entry.key)
+        if idle and entry in idle:
+            idle.remove(entry)
+            self._count -= 1
+            entry.timer.cancel()
+            self._close(entry)
+            return True
+        return False
+
+    def _on_activity(self, entry):
+        if self._is_stale(entry):
+            if self._remove(entry):
+                self.stale_count += 1
+        else:
+            self._server._set_idle(entry.sock)  # edge triggered: left over from the last handler
+
+    def _on_timeout(self, entry):
+        if self._remove(entry):
+            self.expire_count += 1
+
+    def _is_stale(self, entry):
+        ''' an idle connection is stale if it has anything to read: data (which no request asked for) or EOF '''
+        sock = entry.sock
+        try:
+            if entry.ssl_ctx is not None:
+                if sock.pending():
+                    return True
+                sock = sock._sock  # SSLSocket refuses recv flags; any tls record (eg, close_notify) makes it stale
+            sock.recv(1, socket.MSG_PEEK)  # non-blocking
+        except socket.error as e:
+            return e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK)
+        except Exception:
+            return True  # closed
+        return True
+
+    def _close(self, entry):
+        try:
+            self._server._unregister(entry.sock)
+            entry.sock.close()
+        except Exception:
+            pass
+
+
+POOL = ConnectionPool()
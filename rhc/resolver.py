@@ -0,0 +1,202 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2013-2017 Robert H Chase
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+from collections import deque, OrderedDict
+import errno
+import os
+import Queue
+import select
+import socket
+import threading
+import time
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def is_address(host):
+    ''' return True if host is a dotted-quad ip address '''
+    try:
+        socket.inet_pton(socket.AF_INET, host)
+    except (socket.error, TypeError, ValueError):
+        return False
+    return True
+
+
+class Resolver(object):
+    '''
+        Resolve host names without blocking a Server's service loop.
+
+        Parameters:
+            server       - rhc.tcpsocket.Server which delivers results
+            workers      - number of resolver threads
+            ttl          - time, in seconds, to cache a resolved address
+            negative_ttl - time, in seconds, to cache a failed resolution
+            max_size     - maximum number of cached hosts (least recently
+                           used hosts are discarded first)
+
+        Host names are resolved with socket.gethostbyname in a pool of
+        daemon threads. Results are passed back to the server's thread
+        through a socket pair registered with the server, so callbacks
+        always run inside Server.service.
+
+        Concurrent requests for the same host share a single lookup. The
+        threads are started on first use (and again after a fork).
+    '''
+
+    def __init__(self, server, workers=4, ttl=300.0, negative_ttl=30.0, max_size=1024):
+        self._server = server
+        self.workers = workers
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+
+        self._cache = OrderedDict()  # host -> (expiration, address, error); least recently used first
+        self._waiting = {}  # host -> [callback, ...]
+        self._results = deque()
+        self._pid = None
+        self._jobs = None
+        self._wake_r = self._wake_w = None
+
+        self.hit_count = 0
+        self.negative_hit_count = 0
+        self.miss_count = 0
+
+    def resolve(self, host, callback):
+        '''
+            Resolve a host name to an ip address.
+
+            Parameters:
+                host     - host name or ip address
+                callback - callable expecting (rc, result), where rc=0 on
+                           success and result is the ip address, otherwise
+                           result is an error message
+
+            If the address is already known (host is an ip address, or is
+            cached) callback is called before resolve returns; otherwise
+            it is called from Server.service when the lookup completes.
+        '''
+        if is_address(host):
+            return callback(0, host)
+        key = host.lower()
+        entry = self._cache.get(key)
+        if entry:
+            expiration, address, error = entry
+            if expiration > time.time():
+                del self._cache[key]
+                self._cache[key] = entry  # most recently used
+                if error:
+                    self.negative_hit_count += 1
+                    return callback(1, error)
+                self.hit_count += 1
+                return callback(0, address)
+            del self._cache[key]
+        self.miss_count += 1
+        if key in self._waiting:
+            self._waiting[key].append(callback)
+        else:
+            self._start()
+            self._waiting[key] = [callback]
+            self._jobs.put(key)
+
+    def lookup(self, host):
+        ''' return the cached address for host, or None '''
+        entry = self._cache.get(host.lower())
+        if entry and entry[0] > time.time():
+            return entry[1]
+        return None
+
+    def clear(self):
+        ''' discard all cached results '''
+        self._cache.clear()
+
+    def close(self):
+        '''
+            Stop delivering results.
+
+            Pending callbacks are discarded. The threads are left idle and
+            are re-used if resolve is called again.
+        '''
+        if self._wake_r is not None:
+            self._server._unregister(self._wake_r)
+            self._wake_r.close()
+            self._wake_w.close()
+        self._wake_r = self._wake_w = None
+        self._waiting = {}
+        self._results.clear()
+
+    def _start(self):
+        if self._pid != os.getpid():  # first use, or threads lost in a fork
+            self._pid = os.getpid()
+            self._jobs = Queue.Queue()
+            for _ in range(self.workers):
+                t = threading.Thread(target=self._work, args=(self._jobs,))
+                t.daemon = True
+                t.start()
+            self._wake_r = None
+        if self._wake_r is None:
+            self._wake_r, self._wake_w = socket.socketpair()
+            self._wake_r.setblocking(False)
+            self._wake_w.setblocking(False)
+            self._server._register(self._wake_r, select.POLLIN | select.POLLPRI, self._on_wake)
+
+    def _work(self, jobs):
+        while True:
+            try:
+                host = jobs.get()
+            except:  # noqa: E722 - interpreter shutdown (daemon thread); module globals may already be gone
+                return
+            try:
+                result = (host, socket.gethostbyname(host), None)
+            except Exception as e:
+                result = (host, None, 'unable to resolve %s: %s' % (host, e))
+            self._results.append(result)
+            wake = self._wake_w
+            if wake is not None:
+                try:
+                    wake.send('x')
+                except socket.error:
+                    pass  # closed, or full (already awake)
+
+    def _on_wake(self):
+        try:
+            while self._wake_r.recv(1024):
+                pass
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+        self._server._set_idle(self._wake_r)
+        while self._results:
+            host, address, error = self._results.popleft()
+            now = time.time()
+            self._cache[host] = (now + (self.negative_ttl if error else self.ttl), address, error)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+            for callback in self._waiting.pop(host, ()):
+                try:
+                    if error:
+                        callback(1, error)
+                    else:
+                        callback(0, address)
+                except Exception:
+                    log.exception('error running resolver callback for %s', host)
@@ -24,15 +24,22 @@ THE SOFTWARE.
 import datetime
 import json
 import re
+import sre_constants
+import sre_parse
 import sys
+import tempfile
 import time
 import traceback
 import types
 import urlparse
+import zlib
+from collections import deque, OrderedDict
+from StringIO import StringIO
 
 from rhc.database.db import DB
-from rhc.httphandler import HTTPHandler
+from rhc.httphandler import HTTPHandler, content_boundary, decode_content, parse_multipart, parse_query
 from rhc.task import Task, inspect_parameters
+from rhc.timer import TIMERS
 
 import logging
 log = logging.getLogger(__name__)
@@ -45,18 +52,87 @@ class RESTRequest(object):
         self.context = handler.context.context  # context from RESTMapper
         self.http_message = handler.http_message
         self.http_headers = handler.http_headers
-        self.http_content = handler.http_content
         self.http_method = handler.http_method
-        self.http_multipart = handler.http_multipart
+        self.http_version = handler.http_version
         self.http_resource = handler.http_resource
         self.http_query_string = handler.http_query_string
-        self.http_query = handler.http_query
+        self._http_raw_content = handler._http_raw_content
+        self._http_content = None  # decoded, parsed and cached on first access
+        self._http_query = None
+        self._http_multipart = handler._http_parsed_multipart  # already parsed if it arrived incrementally
         self.timestamp = datetime.datetime.now()
         self.is_delayed = False
+        self._body = getattr(handler, '_http_body', None)
+        self._cache = None  # RESTCache for the response, if it is cacheable
+
+    @property
+    def http_content(self):
+        ''' the content, decoded if the Content-Type header has a charset '''
+        if self._http_content is None:
+            self._http_content = decode_content(self._http_raw_content, self.http_headers.get('Content-Type'))
+        return self._http_content
+
+    @http_content.setter
+    def http_content(self, value):
+        self._http_content = value
+
+    @property
+    def http_query(self):
+        ''' dict of query string '''
+        if self._http_query is None:
+            self._http_query = parse_query(self.http_query_string)
+        return self._http_query
+
+    @http_query.setter
+    def http_query(self, value):
+        self._http_query = value
+
+    @property
+    def http_multipart(self):
+        ''' list of HTTPPart objects '''
+        if self._http_multipart is None:
+            content_type = self.http_headers.get('Content-Type', '')
+            if content_type.startswith('multipart'):
+                try:
+                    self._http_multipart = parse_multipart(self._http_raw_content, content_boundary(content_type))
+                except Exception:
+                    raise Exception('Malformed multipart message')
+            else:
+                self._http_multipart = []
+        return self._http_multipart
+
+    @http_multipart.setter
+    def http_multipart(self, value):
+        self._http_multipart = value
+
+    @property
+    def body(self):
+        '''
+            the content as a file object
+
+            if the content was spooled to a temp file by the RESTHandler (see
+            http_spool_threshold) the file is returned (positioned at the
+            start) and http_content is empty; otherwise, a file object
+            wrapping the content is returned. either way, the content is raw
+            bytes (no charset decoding).
+        '''
+        if self._body is None:
+            self._body = StringIO(self._http_raw_content)
+        return self._body
 
     def delay(self):
         self.is_delayed = True
 
+    def invalidate_cache(self, resource=None):
+        '''
+            discard cached responses (see RESTMapper.add) for resource, or
+            all cached responses if resource is None
+
+            useful in a handler which changes something that a cached GET
+            route returns.
+        '''
+        self.handler.context.invalidate_cache(resource)
+
     @property
     def id(self):
         return self.handler.id
@@ -72,9 +148,8 @@ class RESTRequest(object):
             result = RESTResult.coerce(args[0])
         else:
             result = RESTResult(*args, **kwargs)
-        result.close = self.http_headers.get('Connection') == 'close'  # grab Connection from cached headers in case they have been cleared on the HTTPHandler
         self.is_delayed = True  # treat as delayed to stop on_http_data from responding a second time in the non-delay case
-        self.handler.rest_response(result)
+        self.handler._rest_queue(self, result)  # sent after any responses to earlier requests on the connection
 
     @property
     def json(self):
@@ -288,7 +363,7 @@ class RESTResult(object):
     def __init__(self, code=200, content='', headers=None, message=None, content_type=None):
 
         self.code = code
-        self.close = False
+        self.close = None  # None: close if the request says 'Connection: close'
 
         if isinstance(content, (types.DictType, types.ListType, types.FloatType, types.BooleanType, types.IntType)):
             try:
@@ -329,6 +404,214 @@ class RESTResult(object):
         return cls(content=result)  # otherwise, assume status code 200 with result being the content
 
 
+class RESTCache(object):
+    '''
+        Cache of the responses to GET requests for one RESTMapper route.
+
+        Parameters:
+            ttl      - seconds a response is kept
+            max_size - most responses kept; the least recently used are
+                       dropped first
+            vary     - names of request headers which, along with the
+                       method, resource and query string, identify a
+                       response
+
+        Only 200 responses are cached, and not RESTStream responses or
+        responses which set a cookie. A cached response is stored before
+        compression or any Connection header is added, and a copy is sent
+        each time it is used.
+
+        hit_count and miss_count count the requests which were, and were
+        not, answered from the cache.
+    '''
+
+    def __init__(self, ttl, max_size=1000, vary=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.vary = tuple(vary or ())
+        self._cache = OrderedDict()  # key -> (expiration, code, message, content, headers); least recently used first
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _key(self, request):
+        headers = request.http_headers
+        return (request.http_method, request.http_resource, request.http_query_string) + \
+            tuple(headers.get(name) for name in self.vary)
+
+    def get(self, request):
+        ''' return a RESTResult for request, or None if one isn't cached '''
+        key = self._key(request)
+        entry = self._cache.get(key)
+        if entry:
+            expiration, code, message, content, headers = entry
+            if expiration > time.time():
+                del self._cache[key]
+                self._cache[key] = entry  # most recently used
+                self.hit_count += 1
+                return RESTResult(code, content, dict(headers) if headers else None, message)
+            del self._cache[key]
+        self.miss_count += 1
+        return None
+
+    def put(self, request, result):
+        ''' remember result as the response to request, if it is cacheable '''
+        if result.code != 200 or isinstance(result, RESTStream):
+            return
+        headers = result.headers
+        if headers and any(name.lower() == 'set-cookie' for name in headers):
+            return  # the result's headers are a plain dict
+        key = self._key(request)
+        self._cache.pop(key, None)
+        self._cache[key] = (time.time() + self.ttl, result.code, result.message, result.content, dict(headers) if headers else None)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def invalidate(self, resource=None):
+        ''' discard the responses for resource (any query or headers), or all responses if resource is None '''
+        if resource is None:
+            self._cache.clear()
+            return
+        for key in [k for k in self._cache if k[1] == resource]:
+            del self._cache[key]
+
+
+COMPRESS_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml')
+
+
+def accepted_encoding(accept_encoding):
+    '''
+        the preferred response encoding ('gzip' or 'deflate') allowed by an
+        Accept-Encoding header value, or None
+    '''
+    allowed = {}
+    for item in accept_encoding.lower().split(','):
+        toks = item.split(';')
+        name = toks[0].strip()
+        q = 1.0
+        for param in toks[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        allowed[name] = q
+    wildcard = allowed.get('*', 0.0)
+    for encoding in ('gzip', 'deflate'):
+        if allowed.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+class RESTStream(RESTResult):
+    '''
+        A response sent with Transfer-Encoding: chunked, as it is produced.
+
+        Return a RESTStream from a rest_handler, or pass one to
+        request.respond, in place of a RESTResult.
+
+        Parameters:
+            source - an iterable (for instance, a generator) of strings, or
+                     a callable producer
+
+                     an iterable is pulled one item at a time, only when
+                     everything sent so far has been written to the socket;
+                     the response ends when the iterable is exhausted.
+
+                     a producer is called with this RESTStream as the only
+                     argument each time everything sent so far has been
+                     written. it calls write(data) with any content that is
+                     ready, and finish() at the end. write and finish can
+                     also be called at any time, for instance from the
+                     callback of an async operation.
+
+            code, headers, message, content_type - as RESTResult
+
+        If source raises an Exception, the connection is closed, since the
+        status has already been sent.
+
+        An HTTP/1.0 client can't decode chunks, so it is sent the content
+        as is, and the connection is closed at the end.
+    '''
+    def __init__(self, source, code=200, headers=None, message=None, content_type=None):
+        super(RESTStream, self).__init__(code, headers=headers, message=message, content_type=content_type)
+        self.is_finished = False
+        self._handler = None
+        self._pending = []  # written before the response started
+        self._compress = None  # zlib compressobj, set by the RESTHandler
+        self._is_chunked = True  # False for an HTTP/1.0 request, set by the RESTHandler
+        self._is_pumping = False
+        self._write_count = 0
+        if callable(source):
+            self._producer, self._iter = source, None
+        else:
+            self._producer, self._iter = None, iter(source)
+
+    def write(self, data):
+        if self._handler is None:
+            self._pending.append(data)
+        elif not self._handler.closed:
+            self._write_count += 1
+            if self._compress:
+                if isinstance(data, unicode):
+                    data = data.encode('utf8')
+                data = self._compress.compress(data)
+            self._handler.send_chunk(data)
+
+    def finish(self):
+        if self.is_finished:
+            return
+        self.is_finished = True
+        if self._handler is not None:
+            self._handler._rest_stream = None
+            if self._compress and not self._handler.closed:
+                self._handler.send_chunk(self._compress.flush())
+            self._handler.send_chunk_end()
+            self._handler._rest_flush()  # responses to pipelined requests
+
+    def _start(self, handler):
+        self._handler = handler
+        handler._rest_stream = self
+        handler.send_server_chunked(self.code, self.message, self.headers, close=self.close is True, keep_alive=self.close is False, chunked=self._is_chunked)
+        for data in self._pending:
+            self.write(data)
+        self._pending = []
+        if self.is_finished:
+            self.is_finished = False
+            self.finish()
+        else:
+            self._pump()
+
+    def _pump(self):
+        if self._is_pumping:
+            return  # re-entered from a write that completed immediately
+        self._is_pumping = True
+        handler = self._handler
+        try:
+            while not self.is_finished and not handler.closed and handler.queued_bytes == 0:
+                if self._producer:
+                    count = self._write_count
+                    self._producer(self)
+                    if self._write_count == count:
+                        break  # nothing ready; write or finish will be called later
+                else:
+                    try:
+                        data = next(self._iter)
+                    except StopIteration:
+                        self.finish()
+                    else:
+                        self.write(data)
+        except Exception:
+            handler.on_rest_exception(*sys.exc_info())
+            handler._rest_stream = None
+            handler.close('exception in stream source')
+        finally:
+            self._is_pumping = False
+
+
 class RESTHandler(HTTPHandler):
     '''
         Identify and execute REST handler functions.
@@ -345,6 +628,38 @@ class RESTHandler(HTTPHandler):
         request object; the socket will remain open and set the
         is_delayed flag on the RESTRequest.
 
+        Large uploads can be spooled to disk by setting http_spool_threshold
+        to a number of bytes; content up to the threshold is available, as
+        usual, in http_content, larger content is written to a temp file
+        which is available as request.body. Combine with http_message_limit
+        and http_max_content_length=None to accept uploads of any size in
+        constant memory.
+
+        Multipart uploads (forms with files) can instead be parsed as they
+        arrive by setting http_multipart_spool_threshold; each part with
+        more content than the threshold is written to its own temp file
+        (see HTTPPart) and the message is not spooled as a whole.
+
+        Persistent connections:
+
+        Requests can be pipelined on a connection, and later requests can be
+        handled while a delayed response is outstanding; responses are always
+        sent in request order. A connection is closed after a response if the
+        request included 'Connection: close', or was HTTP/1.0 without
+        'Connection: keep-alive', or if http_max_requests (default None) have
+        been handled on the connection, or if the RESTResult has close=True. If http_keep_alive_timeout (seconds,
+        default None) is set, a connection that has no outstanding responses
+        and receives no data for that long is closed.
+
+        Compression:
+
+        If http_compress_min_size is set (bytes, default None), responses
+        are compressed with gzip or deflate, as allowed by the request's
+        Accept-Encoding header, if the content is at least that long and the
+        Content-Type starts with one of http_compress_types. The zlib level
+        is http_compress_level. RESTStream content of an allowed type is
+        compressed regardless of size.
+
         Callback methods:
             on_rest_data(self, *groups)
             on_rest_exception(self, exc_type, exc_value, exc_traceback)
@@ -354,28 +669,189 @@ class RESTHandler(HTTPHandler):
     def __init__(self, *args, **kwargs):
         super(RESTHandler, self).__init__(*args, **kwargs)
         self._silent = False
+        self.http_spool_threshold = None
+        self._spool_parts = []
+        self._spool_size = 0
+        self._http_body = None
+        self._rest_stream = None
+        self.http_keep_alive_timeout = None
+        self.http_max_requests = None
+        self._request_count = 0
+        self._responses = deque()  # [request, result, close] in request order
+        self._is_last_response = False  # no more requests are handled
+        self._idle_timer = None
+        self.http_compress_min_size = None
+        self.http_compress_level = 6
+        self.http_compress_types = COMPRESS_TYPES
+
+    @property
+    def http_spool_threshold(self):
+        return self._http_spool_threshold
+
+    @http_spool_threshold.setter
+    def http_spool_threshold(self, value):
+        self._http_spool_threshold = value
+        self.http_stream = value is not None
+
+    def on_http_body_chunk(self, data):
+        if self._http_body is not None:
+            self._http_body.write(data)
+            return
+        self._spool_parts.append(data)
+        self._spool_size += len(data)
+        if self._spool_size > self.http_spool_threshold:
+            self._http_body = tempfile.TemporaryFile()
+            for part in self._spool_parts:
+                self._http_body.write(part)
+            self._spool_parts = []
+
+    def on_http_body_end(self):
+        if self._http_body is not None:
+            self._http_body.seek(0)
+        else:
+            self.http_content = ''.join(self._spool_parts)
+            self._spool_parts = []
+        self._spool_size = 0
 
     def on_http_data(self):
-        handler, groups, silent = self.context._match(
+        if self._is_last_response:
+            return  # the connection closes after responding to an earlier request
+        self._request_count += 1
+        mapping, handler, groups = self.context._lookup(
             self.http_resource, self.http_method
         )
+        request = RESTRequest(self)
+        self._http_body = None  # owned by the request now
+        close = self._is_close(request)
+        self._responses.append([request, None, close])
+        self._is_last_response = close
         if handler:
-            self._silent = silent
+            self._silent = mapping.silent
             try:
-                request = RESTRequest(self)
                 self.on_rest_data(request, *groups)
+                if mapping.cache is not None and request.http_method == 'GET':
+                    result = mapping.cache.get(request)
+                    if result is not None:
+                        self._rest_queue(request, result)
+                        return
+                    request._cache = mapping.cache
                 result = handler(request, *groups)
                 if not request.is_delayed:
-                    self.rest_response(RESTResult.coerce(result))
+                    request.respond(result)
             except Exception:
                 content = self.on_rest_exception(*sys.exc_info())
                 kwargs = dict(code=501, message='Internal Server Error')
                 if content:
                     kwargs['content'] = str(content)
-                self._rest_send(**kwargs)
+                self._rest_queue(request, RESTResult(**kwargs))
         else:
+            if request._body is not None:
+                request._body.close()
             self.on_rest_no_match()
-            self._rest_send(code=404, message='Not Found')
+            self._rest_queue(request, RESTResult(404, message='Not Found'))
+
+    def _is_close(self, request):
+        ''' True if the connection closes after the response to request '''
+        connection = request.http_headers.get('Connection', '').lower()
+        if connection == 'close':
+            return True
+        if request.http_version == 'HTTP/1.0' and connection != 'keep-alive':
+            return True
+        if self.http_max_requests and self._request_count >= self.http_max_requests:
+            return True
+        return False
+
+    def _rest_queue(self, request, result):
+        for response in self._responses:
+            if response[0] is request:
+                if response[1] is None:
+                    response[1] = result = RESTResult.coerce(result)
+                    if request._cache is not None:
+                        request._cache.put(request, result)
+                    self._rest_flush()
+                return  # a second response to the same request is ignored
+
+    def _rest_flush(self):
+        ''' send completed responses in request order '''
+        responses = self._responses
+        while responses and responses[0][1] is not None and self._rest_stream is None and not self.closed:
+            request, result, close = responses.popleft()
+            if isinstance(result, RESTStream) and request.http_version == 'HTTP/1.0':
+                result._is_chunked = False
+                close = True  # the close marks the end of the content
+            close = close or result.close is True  # the rest_handler can also close the connection
+            self._is_last_response = self._is_last_response or close
+            result.close = close
+            if close:
+                result.headers = dict(result.headers or {}, Connection='close')
+            elif request.http_version == 'HTTP/1.0':
+                result.headers = dict(result.headers or {}, Connection='keep-alive')
+            if self.http_compress_min_size is not None:
+                self._compress(request, result)
+            self.rest_response(result)
+            if close:
+                responses.clear()  # nothing after this will be sent
+        self._start_idle_timer()
+
+    def _compress(self, request, result):
+        ''' compress the content of result, if request allows it and it's worthwhile '''
+        headers = result.headers or {}
+        names = {name.lower(): name for name in headers}  # the result's headers are a plain dict
+        if 'content-encoding' in names:
+            return
+        content_type = headers.get(names.get('content-type'), '')
+        if not content_type.startswith(tuple(self.http_compress_types)):
+            return
+        is_stream = isinstance(result, RESTStream)
+        if not is_stream and (not result.content or len(result.content) < self.http_compress_min_size):
+            return
+        encoding = accepted_encoding(request.http_headers.get('accept-encoding', ''))
+        if encoding is None:
+            return
+        wbits = zlib.MAX_WBITS | 16 if encoding == 'gzip' else zlib.MAX_WBITS
+        compress = zlib.compressobj(self.http_compress_level, zlib.DEFLATED, wbits)
+        if is_stream:
+            result._compress = compress
+        else:
+            content = result.content
+            if isinstance(content, unicode):
+                content = content.encode('utf8')
+            result.content = compress.compress(content) + compress.flush()
+        headers = dict(headers)
+        vary = headers.pop(names['vary']) if 'vary' in names else None
+        headers['Content-Encoding'] = encoding
+        headers['Vary'] = vary + ', Accept-Encoding' if vary else 'Accept-Encoding'
+        result.headers = headers
+
+    def _start_idle_timer(self):
+        ''' start the keep-alive timer if the connection is idle: no outstanding responses and nothing left to send '''
+        if not self.http_keep_alive_timeout or self.closed:
+            return
+        if self._responses or self._rest_stream is not None or self.queued_bytes:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()  # a response is still being written; _on_send_complete restarts it
+            return
+        if self._idle_timer is None:
+            self._idle_timer = TIMERS.add(self._on_idle_timeout, self.http_keep_alive_timeout * 1000.0)
+        self._idle_timer.re_start()
+
+    def _on_idle_timeout(self):
+        self.close('keep-alive timeout')
+
+    def _on_ready(self):
+        super(RESTHandler, self)._on_ready()
+        self._start_idle_timer()
+
+    def _on_data(self, data):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+        super(RESTHandler, self)._on_data(data)
+        self._start_idle_timer()
+
+    def _on_close(self):
+        super(RESTHandler, self)._on_close()
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
 
     def on_rest_data(self, request, *groups):
         ''' called on rest_handler match '''
@@ -386,7 +862,16 @@ class RESTHandler(HTTPHandler):
 
     def rest_response(self, result):
         result = RESTResult.coerce(result)
-        self._rest_send(result.content, result.code, result.message, result.headers, result.close)
+        if isinstance(result, RESTStream):
+            self.on_rest_send(result.code, result.message, None, result.headers)
+            result._start(self)
+        else:
+            self._rest_send(result.content, result.code, result.message, result.headers, result.close)
+
+    def _on_send_complete(self):
+        if self._rest_stream is not None:
+            self._rest_stream._pump()
+        self._start_idle_timer()
 
     def on_rest_exception(self, exception_type, exception_value, exception_traceback):
         ''' handle Exception raised during REST processing
@@ -403,8 +888,10 @@ class RESTHandler(HTTPHandler):
         '''
         return None
 
-    def _rest_send(self, content=None, code=200, message='OK', headers=None, close=False):
-        args = dict(code=code, message=message, close=close)
+    def _rest_send(self, content=None, code=200, message='OK', headers=None, close=None):
+        args = dict(code=code, message=message, close=close is True)
+        if close is False:
+            args['keep_alive'] = True  # decided by _is_close for this request
         if content:
             args['content'] = content
         if headers:
@@ -497,11 +984,30 @@ class RESTMapper(object):
         The on_http_data method of the RESTHandler calls the _match method
         on this object to resolve a URI to a previously defined pattern.
         Patterns are added with the add method.
+
+        Routing:
+
+        The mappings are grouped by the first segment of the resource
+        (eg, '/foo' for '/foo/123/bar') when the pattern starts with that
+        much literal text; a resource is only tried against the mappings
+        in its group and those without a literal first segment. A pattern
+        which is entirely literal text, ending in '$', is compared as a
+        string. The results of recent lookups are remembered, up to
+        match_cache_size (default 1024, 0 to disable) of them: when half
+        that many are recent, they become the older generation and the
+        previous older generation is dropped; an older result which is
+        used again becomes recent. This keeps the results in use without
+        the cost of tracking the exact order of use.
     '''
 
-    def __init__(self, context=None):
+    def __init__(self, context=None, match_cache_size=1024):
         self.context = context
+        self.match_cache_size = match_cache_size
         self.__mapping = []
+        self.__routes = None  # first segment -> [RESTMapping, ...]; built on first _match
+        self.__generic = None  # mappings tried for any resource
+        self.__recent = {}  # (resource, method) -> _match result
+        self.__older = {}
         self.map()
 
     def map(self):
@@ -509,7 +1015,7 @@ class RESTMapper(object):
         pass
 
     def add(self, pattern, get=None, post=None, put=None, delete=None,
-            silent=False):
+            silent=False, cache=None, cache_size=1000, vary=None):
         '''
             Add a mapping between a URI and a CRUD method.
 
@@ -517,6 +1023,12 @@ class RESTMapper(object):
             groups are included in the regex, they will be passed as
             parameters to the matching method.
 
+            If cache is specified, responses to GET requests are cached
+            for that many seconds (see RESTCache); cache_size is the most
+            responses kept, and vary is a list of request header names
+            which are part of the cache key. Use invalidate_cache to
+            discard cached responses when the data behind them changes.
+
             The _match method will evaluate each mapping in the order
             that they are added. The first match wins.
 
@@ -536,12 +1048,57 @@ class RESTMapper(object):
                 parameter.
         '''
         self.__mapping.append(RESTMapping(pattern, get, post, put, delete,
-                                          silent))
+                                          silent, RESTCache(cache, cache_size, vary) if cache else None))
+        self.__routes = None
+        self.__recent = {}
+        self.__older = {}
+
+    def __compile(self):
+        ''' group the mappings by first segment, keeping the order in which they were added '''
+        routes = {mapping.segment: [] for mapping in self.__mapping if mapping.segment is not None}
+        generic = []
+        for mapping in self.__mapping:
+            if mapping.segment is None:
+                generic.append(mapping)
+                for group in routes.values():
+                    group.append(mapping)
+            else:
+                routes[mapping.segment].append(mapping)
+        self.__routes = routes
+        self.__generic = generic
+
+    @property
+    def caches(self):
+        ''' dict of pattern: RESTCache for the routes which have a cache '''
+        return {mapping.pattern.pattern: mapping.cache for mapping in self.__mapping if mapping.cache is not None}
+
+    def invalidate_cache(self, resource=None):
+        '''
+            discard cached responses for resource (any query or headers) on
+            every route, or all cached responses if resource is None
+        '''
+        for mapping in self.__mapping:
+            if mapping.cache is not None:
+                mapping.cache.invalidate(resource)
 
     def _match(self, resource, method):
+        '''
+            Match a resource + method to a handler
+
+            Returns (handler, groups, silent); see _lookup.
+        '''
+        mapping, handler, groups = self._lookup(resource, method)
+        if handler is None:
+            return None, None, False
+        return handler, groups, mapping.silent
+
+    def _lookup(self, resource, method):
         '''
             Match a resource + method to a RESTMapping
 
+            Returns (mapping, handler, groups), or (None, None, None) if
+            there is no match.
+
             The resource parameter is the resource string from the
             http call. The method parameter is the method from
             the http call. The user shouldn't call this method, it
@@ -552,13 +1109,72 @@ class RESTMapper(object):
             and look for a match on the regex which also has a method
             defined.
         '''
-        for mapping in self.__mapping:
-            m = mapping.pattern.match(resource)
-            if m:
-                handler = mapping.method.get(method.lower())
-                if handler:
-                    return handler, m.groups(), mapping.silent
-        return None, None, False
+        key = (resource, method)
+        result = self.__recent.get(key)
+        if result is not None:
+            return result
+        result = self.__older.get(key)
+        if result is None:
+            result = self.__route(resource, method)
+        if self.match_cache_size:
+            recent = self.__recent
+            recent[key] = result
+            if len(recent) * 2 >= self.match_cache_size:
+                self.__older = recent
+                self.__recent = {}
+        return result
+
+    def __route(self, resource, method):
+        if self.__routes is None:
+            self.__compile()
+        method = method.lower()
+        for mapping in self.__routes.get(_first_segment(resource), self.__generic):
+            if not resource.startswith(mapping.prefix):
+                continue
+            if mapping.is_literal:
+                if resource != mapping.prefix:
+                    continue
+                groups = ()
+            else:
+                m = mapping.pattern.match(resource)
+                if not m:
+                    continue
+                groups = m.groups()
+            handler = mapping.method.get(method)
+            if handler:
+                return mapping, handler, groups
+        return None, None, None
+
+
+def _first_segment(resource):
+    ''' '/foo/123/bar' -> '/foo' '''
+    end = resource.find('/', 1)
+    return resource if end == -1 else resource[:end]
+
+
+def _literal_prefix(pattern):
+    '''
+        return (prefix, is_literal) for a regex pattern
+
+        prefix is the literal text at the start of every match, and
+        is_literal is True if the pattern matches nothing but the prefix
+        (it ends with '$'). a resource never contains a newline, so the
+        match '$' allows before a final newline is ignored.
+    '''
+    parsed = sre_parse.parse(pattern)
+    if parsed.pattern.flags & sre_constants.SRE_FLAG_IGNORECASE:
+        return '', False
+    ops = list(parsed)
+    if ops and ops[0] in ((sre_constants.AT, sre_constants.AT_BEGINNING), (sre_constants.AT, sre_constants.AT_BEGINNING_STRING)):
+        ops = ops[1:]  # match is already anchored at the start
+    prefix = []
+    for op, av in ops:
+        if op != sre_constants.LITERAL or av > 255:
+            break
+        prefix.append(chr(av))
+    rest = ops[len(prefix):]
+    is_literal = rest == [(sre_constants.AT, sre_constants.AT_END)]
+    return ''.join(prefix), is_literal
 
 
 def import_by_pathname(target):
@@ -575,8 +1191,13 @@ class RESTMapping(object):
 
     ''' container for one mapping definition '''
 
-    def __init__(self, pattern, get, post, put, delete, silent):
+    def __init__(self, pattern, get, post, put, delete, silent, cache=None):
         self.pattern = re.compile(pattern)
+        self.prefix, self.is_literal = _literal_prefix(pattern)
+        if self.prefix.find('/', 1) != -1 or self.is_literal:
+            self.segment = _first_segment(self.prefix)  # every match starts with this segment
+        else:
+            self.segment = None
         self.method = {
             'get': import_by_pathname(get),
             'post': import_by_pathname(post),
@@ -584,6 +1205,7 @@ class RESTMapping(object):
             'delete': import_by_pathname(delete),
         }
         self.silent = silent
+        self.cache = cache
 
 
 def content_to_json(*fields, **kwargs):
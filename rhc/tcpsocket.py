@@ -21,17 +21,30 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 '''
+from collections import deque, OrderedDict
 import errno
+import functools
+import math
 import os
 import select
 import socket
 import ssl as ssl_library
+import sys
 import time
 
+from rhc.resolver import Resolver
+
 
 EVENT_READ = select.POLLIN | select.POLLPRI
 EVENT_WRITE = select.POLLOUT
 
+BACKENDS = ('poll', 'epoll')
+
+SEND_COALESCE_LEN = 16384  # small buffers are joined into one send up to this size
+SSL_SEND_LEN = 16384  # maximum size of an ssl record
+
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15 if sys.platform.startswith('linux') else None)
+
 
 class Server(object):
 
@@ -47,33 +60,110 @@ class Server(object):
       allocated for each connection. An optional context is also permitted, one
       context shared for every socket on a listener, and one unshared context
       for each outbound connection.
+
+      Network events are detected with select.poll unless another backend is
+      chosen, either here or with set_backend.
+
+      Counters (for monitoring the cost of socket registration):
+        register_count      - register/modify calls made to the backend
+        register_skip_count - registrations skipped because the socket's
+                              event mask did not change
+        iteration_count     - passes through the service loop
+        last_register_count - register/modify calls made to the backend
+                              during the most recent pass
+
+      Host names for outbound connections are resolved by resolver
+      (rhc.resolver.Resolver), which caches results.
+
+      SSL for outbound connections:
+        SSLContexts are created once for each (certfile, cafile, verify
+        mode) and shared. If the ssl library supports sessions (python
+        3.6+), the session from the last handshake with each (host, port)
+        is offered on the next connection to it (at most max_ssl_sessions
+        are kept), allowing the handshake to be resumed.
+
+      Counters (ssl handshakes, incoming and outgoing):
+        ssl_handshake_count - completed handshakes
+        ssl_resumed_count   - handshakes which resumed a session
+        ssl_handshake_time  - total time, in seconds, spent in handshakes
     '''
-    def __init__(self):
+    def __init__(self, backend='poll', edge_triggered=False):
         self._poll_map = {}
-        self._poll = select.poll()
+        self._poll = None
+        self._ready = {}
+        self._pending = []  # callbacks to run at the end of the next _service
         self._id = 0
+        self.resolver = Resolver(self)
+        self._ssl_contexts = {}
+        self._ssl_sessions = OrderedDict()  # (host, port) -> SSLSession; least recently used first
+        self.max_ssl_sessions = 1024
+        self.ssl_handshake_count = 0
+        self.ssl_resumed_count = 0
+        self.ssl_handshake_time = 0.0
+        self.register_count = 0
+        self.register_skip_count = 0
+        self.iteration_count = 0
+        self.last_register_count = 0
+        self.set_backend(backend, edge_triggered)
 
     @property
     def next_id(self):
         self._id += 1
         return self._id
 
-    def add_server(self, port, handler, context=None, ssl=None, ssl_certfile=None, ssl_keyfile=None):
+    def set_backend(self, backend='poll', edge_triggered=False):
+        '''
+          Select the mechanism used to wait for network activity.
+
+          Parameters:
+            backend        - 'poll' (select.poll) or 'epoll' (select.epoll)
+            edge_triggered - register sockets with EPOLLET (epoll only). a
+                             socket reported as ready is serviced on every
+                             pass of the service loop until it would block.
+
+          Sockets which are already registered are moved to the new backend.
+        '''
+        if backend not in BACKENDS:
+            raise ValueError("invalid backend '%s', expecting one of %s" % (backend, ', '.join(BACKENDS)))
+        if backend == 'epoll' and not hasattr(select, 'epoll'):
+            raise ValueError('epoll is not supported on this platform')
+        if edge_triggered and backend != 'epoll':
+            raise ValueError('edge triggering requires the epoll backend')
+        self._close_poll()
+        self.backend = backend
+        self.edge_triggered = edge_triggered
+        self._open_poll()
+        for fileno, (_, _, mask) in self._poll_map.items():
+            self._poll.register(fileno, self._event_mask(mask))
+
+    def add_server(self, port, handler, context=None, ssl=None, ssl_certfile=None, ssl_keyfile=None, reuse_port=False, backlog=100, max_accept=16):
         '''
           Start a listening socket.
 
           Parameters:
-            port    - listening port
-            handler - name of handler class (subclass of BasicHandler)
-            context - optional context associated with this listener
-            ssl     - optional SSLParam, if this exists the keyfile and
-                      certfile are the only values respected.
+            port       - listening port
+            handler    - name of handler class (subclass of BasicHandler)
+            context    - optional context associated with this listener
+            ssl        - optional SSLParam, if this exists the keyfile and
+                         certfile are the only values respected.
+            reuse_port - if True, set SO_REUSEPORT so that several processes
+                         can listen on the same port; the kernel distributes
+                         incoming connections among them.
+            backlog    - size of the queue of connections waiting to be
+                         accepted (see socket.listen)
+            max_accept - maximum number of connections accepted each time
+                         the listening socket is serviced, so that a burst
+                         of connections does not starve other sockets
         '''
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            if SO_REUSEPORT is None:
+                raise ValueError('SO_REUSEPORT is not supported on this platform')
+            s.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
         s.bind(('', port))
         s.setblocking(False)
-        s.listen(100)
+        s.listen(backlog)
         if ssl:
             ssl_ctx = ssl_library.create_default_context(purpose=ssl_library.Purpose.CLIENT_AUTH)
             if isinstance(ssl, SSLParam) and ssl.certfile:
@@ -82,11 +172,11 @@ class Server(object):
                 ssl_ctx.load_cert_chain(ssl_certfile, ssl_keyfile)
         else:
             ssl_ctx = None
-        l = Listener(s, self, context=context, handler=handler, ssl_ctx=ssl_ctx)
+        l = Listener(s, self, context=context, handler=handler, ssl_ctx=ssl_ctx, max_accept=max_accept)
         self._register(s, EVENT_READ, l._do_accept)
         return l
 
-    def add_connection(self, address, handler, context=None, ssl=None, certfile=None, cafile=None):
+    def add_connection(self, address, handler, context=None, ssl=None, certfile=None, cafile=None, pool=None):
         '''
           Connect to a listening socket.
 
@@ -96,39 +186,109 @@ class Server(object):
             context - optional context associated with connection
             ssl     - optional SSLParam, if this exists (not None or False)
                       then ssl will be setup using python defaults.
+            pool    - optional rhc.pool.ConnectionPool
+
+          A name is resolved using self.resolver, which never blocks. If
+          the name's address is not cached, the handler is returned before
+          the connection is attempted. If the name cannot be resolved,
+          handler.error is set and on_fail is called.
+
+          If pool is specified, an idle connection to the same destination
+          is taken from the pool, if one is available, and handed to the
+          handler, which is made ready (on_ready is called) before this
+          method returns; on_open is not called. The handler can return
+          the connection to the pool with pool.release.
         '''
+        key = (address[0], address[1], bool(ssl), certfile, cafile)
+        if pool is not None:
+            idle = pool.acquire(key)
+            if idle is not None:
+                h = self._new_handler(idle.sock, address, handler, context)
+                h._ssl_ctx = idle.ssl_ctx
+                h._pool, h._pool_key = pool, key
+                h.after_init()
+                h._on_reuse()
+                return h
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.setblocking(0)
-        h = handler(s, context)
-        h._incoming = False
-        h._network = self
-        h.name = '%s:%s' % address
-        h.host = address[0]
-        h.id = self.next_id
+        h = self._new_handler(s, address, handler, context)
+        if pool is not None:
+            h._pool, h._pool_key = pool, key
         if ssl:
-            ssl_ctx = ssl_library.create_default_context()  # ignore the SSLParams, and make our own context
+            h._ssl_ctx = self._client_ssl_context(certfile, cafile)  # ignore the SSLParams, and use our own context
+            h._ssl_session_key = address
+        h.after_init()
+        self.resolver.resolve(address[0], functools.partial(self._connect, h, address[1]))
+        return h
+
+    def _client_ssl_context(self, certfile, cafile):
+        verify_mode = ssl_library.CERT_REQUIRED if cafile is not None else ssl_library.CERT_NONE
+        key = (certfile, cafile, verify_mode)
+        ssl_ctx = self._ssl_contexts.get(key)
+        if ssl_ctx is None:
+            ssl_ctx = ssl_library.create_default_context()
             ssl_ctx.check_hostname = False
             if certfile is not None:
                 ssl_ctx.load_cert_chain(certfile)
             if cafile is not None:
                 ssl_ctx.load_verify_locations(cafile)
-            else:
-                ssl_ctx.verify_mode = ssl_library.CERT_NONE
-            h._ssl_ctx = ssl_ctx
-        h.after_init()
+            ssl_ctx.verify_mode = verify_mode
+            self._ssl_contexts[key] = ssl_ctx
+        return ssl_ctx
+
+    def _ssl_session(self, key):
+        return self._ssl_sessions.get(key)
+
+    def _on_ssl_handshake(self, handler):
+        self.ssl_handshake_count += 1
+        self.ssl_handshake_time += handler.ssl_handshake_time
+        if handler.is_ssl_resumed:
+            self.ssl_resumed_count += 1
+        key = handler._ssl_session_key
+        session = getattr(handler._sock, 'session', None)
+        if key is not None and session is not None:
+            self._ssl_sessions.pop(key, None)
+            self._ssl_sessions[key] = session
+            while len(self._ssl_sessions) > self.max_ssl_sessions:
+                self._ssl_sessions.popitem(last=False)
+
+    @property
+    def ssl_resumption_rate(self):
+        ''' fraction of completed ssl handshakes which resumed a session '''
+        if self.ssl_handshake_count == 0:
+            return 0.0
+        return float(self.ssl_resumed_count) / self.ssl_handshake_count
+
+    def _new_handler(self, sock, address, handler, context):
+        h = handler(sock, context)
+        h._incoming = False
+        h._network = self
+        h.name = '%s:%s' % address
+        h.host = address[0]
+        h.id = self.next_id
+        return h
+
+    def _connect(self, h, port, rc, result):
+        if h.closed:
+            return
+        if rc != 0:
+            h.error = result
+            h.close_reason = 'failed to setup connection: %s' % result
+            h.on_fail()
+            h.close()
+            return
         try:
-            s.connect(address)
+            h._sock.connect((result, port))
         except socket.error, e:
             error, errmsg = e
             if errno.EINPROGRESS == error:
-                self._register(s, EVENT_WRITE, h._on_delayed_connect)
+                self._register(h._sock, EVENT_WRITE, h._on_delayed_connect)
             else:
                 h.on_fail()
                 h.close_reason = 'failed to setup connection: %s' % errmsg
                 h.close()
         else:
             h._on_connect()
-        return h
 
     def service(self, delay=0, max_iterations=0):
         '''
@@ -146,6 +306,9 @@ class Server(object):
 
           if max_iterations is set, it will limit the number of times the
           service loop will execute if network activity persists.
+
+          if delay is None, the first call to select blocks until there is
+          network activity.
         '''
         iterations = 0
         did_anything = False
@@ -159,39 +322,111 @@ class Server(object):
         return did_anything
 
     def close(self):
-        for _, sock in self._poll_map.values():
+        self.resolver.close()
+        for _, sock, _ in self._poll_map.values():
             try:
                 sock.close()
             except Exception:
                 pass
+        self._poll_map = {}
+        self._close_poll()
+        self._open_poll()
+
+    def _open_poll(self):
+        if self.backend == 'epoll':
+            self._poll = select.epoll()
+        else:
+            self._poll = select.poll()
+        self._ready = {}
+
+    def _close_poll(self):
+        if self._poll is not None and self.backend == 'epoll':
+            self._poll.close()
+
+    def _event_mask(self, mask):
+        if self.edge_triggered:
+            return mask | select.EPOLLET
+        return mask
 
     def _register(self, sock, mask, callback):
         fileno = sock.fileno()
-        if fileno in self._poll_map:
-            self._poll.modify(fileno, mask)
+        current = self._poll_map.get(fileno)
+        if current:
+            if current[2] == mask:
+                self.register_skip_count += 1
+                if current[0] != callback:
+                    self._poll_map[fileno] = (callback, sock, mask)
+                return
+            self._poll.modify(fileno, self._event_mask(mask))
+            self._ready.pop(fileno, None)  # modify re-arms the fd, the next poll reports it if still ready
         else:
-            self._poll.register(fileno, mask)
-        self._poll_map[fileno] = (callback, sock)
+            self._poll.register(fileno, self._event_mask(mask))
+        self.register_count += 1
+        self._poll_map[fileno] = (callback, sock, mask)
 
     def _unregister(self, sock):
         sock = sock.fileno()
         if sock in self._poll_map:
             self._poll.unregister(sock)
             del self._poll_map[sock]
+            self._ready.pop(sock, None)
 
     def _set_pending(self, callback):
         self._pending.append(callback)
 
+    def _set_idle(self, sock):
+        '''
+          indicate that a socket has no more activity (it would block)
+
+          this only matters with edge triggering, where a socket is serviced
+          repeatedly after a notification until it has been drained.
+        '''
+        try:
+            self._ready.pop(sock.fileno(), None)
+        except socket.error:
+            pass
+
+    def _poll_events(self, timeout):
+        if timeout is None:
+            timeout = -1
+        elif self.backend == 'poll':
+            timeout = int(math.ceil(timeout * 1000))  # poll timeout is in milliseconds; don't wake early
+        else:
+            timeout = math.ceil(timeout * 1000) / 1000.0  # epoll truncates to milliseconds
+        try:
+            return self._poll.poll(timeout)
+        except (select.error, IOError) as e:
+            if e.args[0] == errno.EINTR:
+                return []  # interrupted by a signal
+            raise
+
     def _service(self, timeout):
         processed = False
-        self._pending = []
+        register_count = self.register_count
 
-        for sock, _ in self._poll.poll(timeout * 1000):
+        ready = set(self._ready)  # edge triggered: sockets not yet drained
+        if ready or self._pending:
+            timeout = 0  # don't block while there is work to do
+        for sock, _ in self._poll_events(timeout):
             processed = True
+            if self.edge_triggered:
+                ready.discard(sock)
+                self._ready[sock] = True
             self._poll_map[sock][0]()
 
-        for callback in self._pending:
-            callback()
+        for sock in ready:
+            if sock in self._ready and sock in self._poll_map:
+                processed = True
+                self._poll_map[sock][0]()
+
+        while self._pending:  # including any set outside _service, for instance by resume_reading from a timer
+            processed = True
+            pending, self._pending = self._pending, []
+            for callback in pending:
+                callback()
+
+        self.iteration_count += 1
+        self.last_register_count = self.register_count - register_count
         return processed
 
 
@@ -234,19 +469,51 @@ class BasicHandler(object):
 
     '''
       Base class for connection listeners.
+
+      Data passed to send which cannot be written immediately is kept in a
+      queue of buffers (not copied) until the socket is writable again. The
+      number of bytes waiting to be sent is available as queued_bytes.
+
+      Each socket read asks for between RECV_LEN and MAX_RECV_LEN bytes. The
+      size doubles each time a read fills the buffer, and halves when a read
+      uses a quarter of it or less.
+
+      Backpressure:
+
+        When queued_bytes rises above HIGH_WATER, is_writing_paused is set,
+        reading from the socket stops and on_pause_writing is called. When
+        queued_bytes drops to LOW_WATER, reading resumes and
+        on_resume_writing is called. A handler which sends data that it
+        reads from another connection (a proxy) can use these callbacks to
+        call pause_reading and resume_reading on the other connection.
+
+        Set HIGH_WATER to 0 to disable.
     '''
     def __init__(self, socket, context=None):
         self.RECV_LEN = 1024
-        self.MAX_RECV_LEN = 0
+        self.MAX_RECV_LEN = 65536
+        self._recv_len = 0
+        self.HIGH_WATER = 1048576
+        self.LOW_WATER = 262144
+        self.is_writing_paused = False
+        self.is_reading_paused = False
+        self._is_read_deferred = False  # woken while paused; read on resume
         self.NAGLE = False
         self.start = time.time()
         self.context = context
         self.closed = False
-        self._sending = ''
+        self._send_queue = deque()
+        self.queued_bytes = 0
         self._sock = socket
         self._incoming = True
         self._ssl_ctx = None
         self._network = None
+        self._pool = None
+        self._pool_key = None
+        self._ssl_session_key = None
+        self._t_handshake = 0
+        self.ssl_handshake_time = 0  # seconds (see on_handshake)
+        self.is_ssl_resumed = False
 
         self.name = 'BasicHandler::init'
         self.host = None
@@ -265,10 +532,33 @@ class BasicHandler(object):
         self.on_init()
 
     def send(self, data):
-        if len(self._sending) != 0:
-            self._sending += data
-        else:
-            self._do_write(data)
+        if isinstance(data, unicode):
+            data = data.encode('utf8')
+        self._send_buffers((data,))
+
+    def _send_buffers(self, buffers):
+        ''' queue each (str) buffer without copying, then send (for libraries) '''
+        is_sending = self.queued_bytes != 0
+        for data in buffers:
+            if len(data):
+                self._send_queue.append(memoryview(data))
+                self.queued_bytes += len(data)
+        if not is_sending and self.queued_bytes:
+            self._do_write()
+        if self.HIGH_WATER and not self.is_writing_paused and self.queued_bytes > self.HIGH_WATER and not self.closed:
+            self.is_writing_paused = True
+            self.on_pause_writing()
+
+    def pause_reading(self):
+        ''' stop reading data from the socket until resume_reading is called '''
+        self.is_reading_paused = True
+        self._register_read()
+
+    def resume_reading(self):
+        self.is_reading_paused = False
+        self._register_read()
+        if self._is_pending and not self.is_writing_paused:
+            self._network._set_pending(self._do_read)
 
     def close(self, reason=None):
         if not self.closed:
@@ -377,6 +667,10 @@ class BasicHandler(object):
           None is passed. If the certificate fails any tests that
           the on_handshake method performs, a False will close the
           socket; otherwise, return True.
+
+          Before this is called, ssl_handshake_time is set to the duration
+          of the handshake, in seconds, and is_ssl_resumed indicates
+          whether a previous session was resumed.
         '''
         return True
 
@@ -411,6 +705,21 @@ class BasicHandler(object):
         '''
         pass
 
+    def on_pause_writing(self):
+        '''
+          Called when the data waiting to be sent rises above HIGH_WATER.
+
+          Reading from this socket stops until on_resume_writing is called.
+        '''
+        pass
+
+    def on_resume_writing(self):
+        '''
+          Called, after on_pause_writing, when the data waiting to be sent
+          drops to LOW_WATER.
+        '''
+        pass
+
     def on_send_complete(self):
         '''
           Called when all the data in the application buffer has been sent.
@@ -452,12 +761,17 @@ class BasicHandler(object):
         self.on_open()
         self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # bye bye NAGLE
         if self._ssl_ctx:
+            kwargs = {}
+            session = self._network._ssl_session(self._ssl_session_key)
+            if session is not None:
+                kwargs['session'] = session
             try:
-                self._sock = self._ssl_ctx.wrap_socket(self._sock, server_side=self._incoming, do_handshake_on_connect=False)
+                self._sock = self._ssl_ctx.wrap_socket(self._sock, server_side=self._incoming, do_handshake_on_connect=False, **kwargs)
             except Exception as e:
                 self.close_reason = str(e)
                 self.close()
             else:
+                self._t_handshake = time.time()
                 self._do_handshake()
         else:
             self._on_ready()
@@ -467,6 +781,7 @@ class BasicHandler(object):
             self._sock.do_handshake()
         except ssl_library.SSLWantReadError:
             self._network._register(self._sock, EVENT_READ, self._do_handshake)
+            self._network._set_idle(self._sock)
         except ssl_library.SSLWantWriteError:
             self._network._register(self._sock, EVENT_WRITE, self._do_handshake)
         except Exception as e:
@@ -474,6 +789,9 @@ class BasicHandler(object):
             self.close_reason = 'failed ssl handshake'
             self.close()
         else:
+            self.ssl_handshake_time = time.time() - self._t_handshake
+            self.is_ssl_resumed = getattr(self._sock, 'session_reused', False) is True
+            self._network._on_ssl_handshake(self)
             self.peer_cert = self._sock.getpeercert()
             if not self.on_handshake(self.peer_cert):
                 self.close_reason = 'failed ssl certificate check'
@@ -481,25 +799,65 @@ class BasicHandler(object):
                 return
             self._on_ready()
 
+    def _register_read(self):
+        ''' wait for data to read, unless paused or sending (sending resumes reading when done) '''
+        if self.t_ready and not self.closed and not self.queued_bytes:
+            is_paused = self.is_reading_paused or self.is_writing_paused
+            self._network._register(self._sock, 0 if is_paused else EVENT_READ, self._do_read)
+
     def _on_ready(self):
         self.t_ready = time.time()
-        self._network._register(self._sock, EVENT_READ, self._do_read)
+        self._register_read()
         self.on_ready()
 
+    def _on_reuse(self):
+        self.t_open = time.time()
+        self.name = self.full_address()
+        self._on_ready()
+
+    def _detach(self):
+        ''' give up the socket without closing it (see rhc.pool) '''
+        sock, self._sock = self._sock, None
+        self.closed = True
+        self.t_close = time.time()
+        return sock
+
     @property
     def _is_pending(self):
+        if self._is_read_deferred:
+            return True
         return self._ssl_ctx is not None and self._sock.pending()
 
+    def _recv(self):
+        size = max(self._recv_len, self.RECV_LEN)
+        data = self._sock.recv(size)
+        count = len(data)
+        if count == size:
+            self._recv_len = min(size * 2, max(self.MAX_RECV_LEN, self.RECV_LEN))
+        elif count <= size / 4:
+            self._recv_len = size / 2
+        return data
+
     def _do_read(self):
+        if self.is_reading_paused or self.is_writing_paused:
+            # a mask of 0 doesn't stop poll reporting a hang-up or error;
+            # leave it until resume_reading, without being woken for it again
+            self._is_read_deferred = True
+            self._network._unregister(self._sock)
+            return
+        self._is_read_deferred = False
         try:
-            data = self._sock.recv(self.RECV_LEN)
+            data = self._recv()
         except ssl_library.SSLWantReadError:
             self._network._register(self._sock, EVENT_READ, self._do_read)
+            self._network._set_idle(self._sock)
         except ssl_library.SSLWantWriteError:
             self._network._register(self._sock, EVENT_WRITE, self._do_read)
         except socket.error as e:
             errnum, errmsg = e
-            if errnum == errno.ENOENT:
+            if errnum in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._network._set_idle(self._sock)  # nothing left to read
+            elif errnum == errno.ENOENT:
                 pass  # apparently this can happen. http://www.programcreek.com/python/example/374/errno.ENOENT says it comes from the SSL library.
             else:
                 self.close_reason = 'recv error on socket: %s' % errmsg
@@ -512,63 +870,108 @@ class BasicHandler(object):
                 self.close_reason = 'remote close'
                 self.close()
             else:
-                self._network._register(self._sock, EVENT_READ, self._do_read)
+                self._register_read()
                 self.rxByteCount += len(data)
-                self.on_data(data)
-                if self._is_pending:
+                self._on_data(data)
+                if not self.closed and self._is_pending and not (self.is_reading_paused or self.is_writing_paused):
                     self._network._set_pending(self._do_read)  # give buffered ssl data another chance
 
-    def _do_write(self, data=None):
-        if data is None:
-            data = self._sending
-            self._sending = ''
-        if not data:
+    def _next_send(self):
+        ''' the data for the next socket send, taken from the front of the send queue '''
+        queue = self._send_queue
+        data = queue[0]
+        if self._ssl_ctx:
+            return data[:SSL_SEND_LEN].tobytes()  # the head buffer stays the same until sent, as ssl retries require
+        if len(queue) == 1 or len(data) >= SEND_COALESCE_LEN:
+            return data
+        parts = []
+        size = 0
+        for data in queue:
+            if size + len(data) > SEND_COALESCE_LEN:
+                break
+            parts.append(data.tobytes())
+            size += len(data)
+        return ''.join(parts) if len(parts) > 1 else queue[0]
+
+    def _consume(self, count):
+        ''' remove count sent bytes from the front of the send queue '''
+        self.queued_bytes -= count
+        queue = self._send_queue
+        while count:
+            data = queue[0]
+            if len(data) > count:
+                queue[0] = data[count:]
+                break
+            count -= len(data)
+            queue.popleft()
+
+    def _do_write(self):
+        if not self.queued_bytes:
             self.close_reason = 'logic error in handler'
             self.close()
             return
         try:
-            l = self._sock.send(data)
+            l = self._sock.send(self._next_send())
         except ssl_library.SSLWantReadError:
             self._network._register(self._sock, EVENT_READ, self._do_write)
         except ssl_library.SSLWantWriteError:
             self._network._register(self._sock, EVENT_WRITE, self._do_write)
+            self._network._set_idle(self._sock)
         except socket.error as e:
             errnum, errmsg = e
             if errnum in (errno.EINTR, errno.EWOULDBLOCK):
                 self.error = errmsg
                 self.on_send_error()  # not fatal
-                self._sending = data
                 self._network._register(self._sock, EVENT_WRITE, self._do_write)
+                self._network._set_idle(self._sock)
             else:
                 self.close('send error on socket: %s' % errmsg)
         except Exception as e:
             self.close('send error on socket: %s' % str(e))
         else:
             self.txByteCount += l
-            if l == len(data):
-                self._network._register(self._sock, EVENT_READ, self._do_read)
+            self._consume(l)
+            is_resumed = self.is_writing_paused and self.queued_bytes <= self.LOW_WATER
+            if is_resumed:
+                self.is_writing_paused = False
+            if self.queued_bytes == 0:
+                self._register_read()
                 self.on_send_complete()
+                self._on_send_complete()  # for libraries
             else:
-                # we couldn't send all the data. buffer the remainder in self._sending and start
-                # waiting for the socket to be writable again (EVENT_WRITE).
-                self._sending = data[l:]
+                # we couldn't send all the data. the remainder stays in the send queue;
+                # wait for the socket to be writable again (EVENT_WRITE).
                 self._network._register(self._sock, EVENT_WRITE, self._do_write)
+            if is_resumed and not self.closed:
+                self.on_resume_writing()
+                self._on_resume_writing()  # for libraries
     # --- I/O
     # ---
     # ---
 
+    def _on_data(self, data):
+        self.on_data(data)  # libraries can intercept the raw data here
+
+    def _on_resume_writing(self):
+        pass
+
+    def _on_send_complete(self):
+        pass
+
     def _on_close(self):
         pass
 
 
 class Listener(object):
 
-    def __init__(self, socket, server, handler, context=None, ssl_ctx=None):
+    def __init__(self, socket, server, handler, context=None, ssl_ctx=None, max_accept=16):
         self.socket = socket
         self.network = server
         self.handler = handler
         self.context = context
         self.ssl_ctx = ssl_ctx
+        self.max_accept = max_accept
+        self.closed = False
 
     def close(self):
         ''' close a listening socket
@@ -576,11 +979,25 @@ class Listener(object):
             Normally, a listening socket lasts for for duration of a server's life. If
             there is a need to close a listener, this is the way to do it.
         '''
+        self.closed = True
         self.network._unregister(self.socket)
         self.socket.close()
 
     def _do_accept(self):
-        s, _ = self.socket.accept()
+        ''' accept waiting connections until the listen queue is empty or max_accept is reached '''
+        for _ in range(self.max_accept):
+            try:
+                s, _ = self.socket.accept()
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.network._set_idle(self.socket)  # listen queue is empty
+                    return
+                raise
+            self._on_accept(s)
+            if self.closed:
+                return
+
+    def _on_accept(self, s):
         s.setblocking(False)
         h = self.handler(s, self.context)
         h._network = self.network
@@ -23,6 +23,8 @@ THE SOFTWARE.
 '''
 import datetime
 import heapq
+import itertools
+import math
 import time
 
 
@@ -30,6 +32,9 @@ import logging
 log = logging.getLogger(__name__)
 
 
+ENGINES = ('heap', 'wheel')
+
+
 class Timer(object):
     '''
     The python library threading.Timer provides a timer which runs in a separate
@@ -60,22 +65,75 @@ class Timer(object):
         cancel   - expire a running timer without executing the action routine.
 
         delete   - same as cancel (for backward compatablity)
+
+    Running timers are kept by an engine, chosen with the engine argument or
+    the set_engine method:
+
+        heap  - a heap ordered by expiration time (default). start, re_start
+                and cancel are O(log n) (see HeapEngine).
+
+        wheel - a hierarchical timing wheel (see WheelEngine). start, re_start
+                and cancel are O(1); timers expire on a tick boundary.
+
+    The current time is read from clock (default time.time), which can be
+    replaced, for instance, to drive timers from a simulated clock in tests.
     '''
 
-    def __init__(self):
-        self._list = []  # manage list with heapq so that first timer is always the smallest
+    def __init__(self, engine='heap', clock=time.time, **kwargs):
+        self._engine = None
+        self.clock = clock
+        self.set_engine(engine, **kwargs)
 
     def __repr__(self):
-        return str(self._list)
+        return repr(self._engine)
 
     def __len__(self):
-        return len(self._list)
+        return len(self._engine)
+
+    def set_engine(self, engine='heap', **kwargs):
+        '''
+            Select the engine which keeps track of running timers.
+
+            Parameters:
+                engine - one of ENGINES
+                kwargs - passed to the engine's constructor
+
+            Running timers are moved to the new engine.
+        '''
+        if engine == 'heap':
+            new_engine = HeapEngine(clock=self.clock, **kwargs)
+        elif engine == 'wheel':
+            new_engine = WheelEngine(clock=self.clock, **kwargs)
+        else:
+            raise ValueError("invalid timer engine '%s', expecting one of %s" % (engine, ', '.join(ENGINES)))
+        if self._engine is not None:
+            for item in self._engine.clear():
+                new_engine.schedule(item)
+        self._engine = new_engine
+        self.engine = engine
+
+    def next_expiration(self):
+        '''
+            Return the time (as returned by clock) at which the next
+            running timer expires, or None if no timer is running.
+
+            The wheel engine may return an earlier time, at which point
+            calling service will bring the next expiration closer.
+        '''
+        return self._engine.next_expiration()
+
+    @property
+    def live_count(self):
+        ''' number of running timers held by the engine '''
+        return self._engine.live_count
+
+    @property
+    def dead_count(self):
+        ''' number of stale entries held by the engine (awaiting removal) '''
+        return self._engine.dead_count
 
     def service(self):
-        while len(self) and self._list[0].is_expired:  # handle all expired timers
-            item = heapq.heappop(self._list)  # grabs the smallest expiration (per SimpleTimer.__lt__)
-            item._is_in_heap = False  # Note: expired timers are removed from the timer list; start() will re-insert
-            item.execute()
+        self._engine.service()
 
     def add(self, action, duration, **kwargs):
         '''
@@ -93,7 +151,7 @@ class Timer(object):
         '''
         if isinstance(action, (int, float)):
             action, duration = duration, action
-        return SimpleTimer(self._list, action, duration)
+        return SimpleTimer(self, action, duration)
 
     def add_backoff(self, action, initial, maximum, multiplier=2):
         '''
@@ -111,7 +169,7 @@ class Timer(object):
             The re_start method will cause the duration to return to
             the initial value.
         '''
-        return BackoffTimer(self._list, action, initial, maximum, multiplier)
+        return BackoffTimer(self, action, initial, maximum, multiplier)
 
     def add_hourly(self, action):
         '''
@@ -122,23 +180,293 @@ class Timer(object):
             Return    :
                 unstarted Timer instance
         '''
-        return HourlyTimer(self._list, action)
+        return HourlyTimer(self, action)
+
+
+class HeapEngine(object):
+    '''
+        Keep running timers in a heap ordered by expiration time.
+
+        Parameters:
+            compact_ratio - fraction of dead entries which triggers compaction
+            compact_min   - number of dead entries below which the heap is
+                            never compacted
+            clock         - function returning the current time in seconds
+
+        Deletion is lazy. Each heap entry records the timer's generation at
+        the time it was pushed; starting, re-starting, expiring or cancelling
+        a timer bumps its generation, which makes any entry already in the
+        heap dead. Dead entries are skipped when they reach the top of the
+        heap. When the dead entries exceed compact_ratio of the heap (and
+        number at least compact_min) the heap is rebuilt from the live
+        entries.
+
+        Every operation is O(log n), plus the amortized cost of compaction.
+    '''
+
+    def __init__(self, compact_ratio=0.5, compact_min=64, clock=time.time):
+        self._clock = clock
+        self._list = []  # heap of [expiration, sequence, generation, timer]
+        self._sequence = itertools.count()  # tie-breaker: timers are never compared
+        self._compact_ratio = compact_ratio
+        self._compact_min = compact_min
+        self.dead_count = 0
+        self.compact_count = 0
+
+    def __repr__(self):
+        return str([entry[3] for entry in self._list if entry[2] == entry[3]._generation])
+
+    def __len__(self):
+        return len(self._list)
+
+    @property
+    def live_count(self):
+        return len(self._list) - self.dead_count
+
+    def _kill(self, item):
+        item._generation += 1
+        if item._is_in_heap:
+            item._is_in_heap = False
+            self.dead_count += 1
+            if self.dead_count >= self._compact_min and self.dead_count > len(self._list) * self._compact_ratio:
+                self._compact()
+
+    def _compact(self):
+        self._list = [entry for entry in self._list if entry[2] == entry[3]._generation]
+        heapq.heapify(self._list)
+        self.dead_count = 0
+        self.compact_count += 1
+
+    def _pop_dead(self):
+        while self._list and self._list[0][2] != self._list[0][3]._generation:
+            heapq.heappop(self._list)
+            self.dead_count -= 1
+
+    def schedule(self, item):
+        self._kill(item)
+        heapq.heappush(self._list, [item._expiration, next(self._sequence), item._generation, item])
+        item._is_in_heap = True
+
+    def cancel(self, item):
+        self._kill(item)
+
+    def clear(self):
+        items = [entry[3] for entry in self._list if entry[2] == entry[3]._generation]
+        for item in items:
+            item._is_in_heap = False
+        self._list = []
+        self.dead_count = 0
+        return items
+
+    def next_expiration(self):
+        self._pop_dead()
+        if self._list:
+            return self._list[0][0]
+        return None
+
+    def service(self):
+        now = self._clock()
+        while True:  # handle all expired timers
+            self._pop_dead()
+            if not self._list or self._list[0][0] >= now:
+                break
+            item = heapq.heappop(self._list)[3]
+            item._is_in_heap = False  # Note: expired timers are removed from the timer list; start() will re-insert
+            item.execute()
+
+
+class WheelEngine(object):
+    '''
+        Keep running timers in a hierarchical timing wheel.
+
+        Parameters:
+            resolution - duration, in ms, of one tick
+            slots      - number of slots in each wheel (a power of two)
+            levels     - number of wheels
+            clock      - function returning the current time in seconds
+
+        The first wheel has one slot per tick; each slot of the next wheel
+        covers a full rotation of the wheel below it. A timer is placed in
+        the lowest wheel which can hold its expiration, and is moved down a
+        wheel (cascaded) when the wheel below it comes around to its slot.
+        Timers too far in the future to fit are parked in the highest wheel
+        and re-placed each time their slot comes around.
+
+        Starting, re-starting and cancelling a timer are O(1). A timer
+        expires on the first call to service at or after the end of the
+        tick which contains its expiration time, so timers are never early
+        and are late by at most one tick plus the service interval.
+
+        With the defaults (10ms, 256 slots, 4 wheels) the wheels span more
+        than a year.
+
+        The result of next_expiration, which otherwise scans the first wheel,
+        is cached until a timer lands on an earlier tick, the slot it points
+        at is emptied by a cancel, or service moves the wheel on. It is never
+        later than the next cascade: if the current tick starts a rotation
+        whose cascade has not yet run, the current tick is returned.
+    '''
+
+    def __init__(self, resolution=10, slots=256, levels=4, clock=time.time):
+        if slots < 2 or slots & (slots - 1):
+            raise ValueError('slots must be a power of two')
+        self._resolution = resolution / 1000.0
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        self._span = 1 << (self._bits * levels)  # ticks covered by all wheels
+        self._count = 0
+        self._clock = clock
+        self._current = self._tick(clock())  # next tick to process
+        self._next = None  # cached next_expiration, in ticks (None if unknown)
+
+    def __repr__(self):
+        return 'Wheel[n=%d, tick=%d]' % (self._count, self._current)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def live_count(self):
+        return self._count
+
+    @property
+    def dead_count(self):
+        return 0
+
+    def _tick(self, when):
+        return int(math.ceil(when / self._resolution))
+
+    def _insert(self, item):
+        delta = item._tick - self._current
+        if delta < 0:
+            delta = 0  # already due; process on the next tick
+        elif delta >= self._span:
+            delta = self._span - 1
+        tick = self._current + delta
+        level = 0
+        while delta >> (self._bits * (level + 1)):
+            level += 1
+        slot = self._wheels[level][(tick >> (self._bits * level)) & self._mask]
+        slot[id(item)] = item
+        item._slot = slot
+        if self._next is not None and tick < self._next:
+            self._next = tick
+
+    def _remove(self, item):
+        slot = item._slot
+        del slot[id(item)]
+        item._slot = None
+        self._count -= 1
+        if not slot and self._next is not None and slot is self._wheels[0][self._next & self._mask]:
+            self._next = None
+
+    def schedule(self, item):
+        if item._slot is not None:
+            self._remove(item)
+        elif not self._count:
+            self._current = self._tick(self._clock())  # nothing running: catch up
+            self._next = None
+        item._tick = self._tick(item._expiration)
+        self._insert(item)
+        self._count += 1
+
+    def cancel(self, item):
+        if item._slot is not None:
+            self._remove(item)
+
+    def clear(self):
+        items = []
+        for wheel in self._wheels:
+            for slot in wheel:
+                for item in slot.values():
+                    item._slot = None
+                    items.append(item)
+                slot.clear()
+        self._count = 0
+        self._next = None
+        return items
+
+    def _cascade(self, level):
+        index = (self._current >> (self._bits * level)) & self._mask
+        slot = self._wheels[level][index]
+        if slot:
+            items = slot.values()
+            slot.clear()
+            for item in items:
+                self._insert(item)
+        return index
+
+    def _is_cascade_pending(self):
+        if self._current & self._mask:
+            return False  # this rotation's cascade is done
+        for level in range(1, len(self._wheels)):
+            index = (self._current >> (self._bits * level)) & self._mask
+            if self._wheels[level][index]:
+                return True
+            if index:
+                break  # service stops cascading here too
+        return False
+
+    def next_expiration(self):
+        if not self._count:
+            return None
+        if self._next is None and self._is_cascade_pending():
+            self._next = self._current  # the first wheel is not complete until the cascade
+        if self._next is None:
+            wheel = self._wheels[0]
+            end = self._current | self._mask  # last tick before the next cascade
+            self._next = end + 1
+            for tick in range(self._current, end + 1):
+                if wheel[tick & self._mask]:
+                    self._next = tick
+                    break
+        return self._next * self._resolution
+
+    def service(self):
+        now = int(self._clock() / self._resolution)  # last completed tick
+        if not self._count:
+            self._current = now + 1
+            self._next = None
+            return
+        if self._current <= now:
+            self._next = None  # the wheel moves on (and may cascade)
+        wheel = self._wheels[0]
+        while self._current <= now and self._count:
+            if self._current & self._mask == 0:
+                level = 1
+                while level < len(self._wheels) and self._cascade(level) == 0:
+                    level += 1
+            slot = wheel[self._current & self._mask]
+            self._current += 1  # timers started by an action land on a later tick
+            if slot:
+                items = slot.values()
+                slot.clear()
+                self._count -= len(items)
+                for item in items:
+                    item._slot = None
+                    item.execute()
+        if not self._count:
+            self._current = now + 1
 
 
 class SimpleTimer(object):
 
-    def __init__(self, timer_list, action, duration):
-        self._timer_list = timer_list
+    def __init__(self, timers, action, duration):
+        self._timers = timers
         self._action = action
         self._duration = duration
 
-        self._is_in_heap = False
+        self._is_in_heap = False  # HeapEngine
+        self._generation = 0  # HeapEngine
+        self._slot = None  # WheelEngine
+        self._tick = 0  # WheelEngine
         self._is_restarting = False
         self._expiration = 0
         self.is_running = False
 
     def __repr__(self):
-        return 'Simple[d=%s, r=%s]' % (self._duration, (self._expiration - time.time()) * 1000.0)
+        return 'Simple[d=%s, r=%s]' % (self._duration, (self._expiration - self._timers.clock()) * 1000.0)
 
     def __eq__(self, other):
         return self._expiration == other._expiration
@@ -147,11 +475,11 @@ class SimpleTimer(object):
         return self._expiration < other._expiration
 
     def _calc_expiration(self):
-        return time.time() + (self._duration / 1000.0)
+        return self._timers.clock() + (self._duration / 1000.0)
 
     @property
     def is_expired(self):
-        return self._expiration < time.time()
+        return self._expiration < self._timers.clock()
 
     def set_action(self, action):
         self._action = action
@@ -161,11 +489,7 @@ class SimpleTimer(object):
             raise Exception("can't start a running timer")
         self._expiration = self._calc_expiration()
         self.is_running = True
-        if self._is_in_heap:
-            heapq.heapify(self._timer_list)
-        else:
-            heapq.heappush(self._timer_list, self)
-            self._is_in_heap = True
+        self._timers._engine.schedule(self)
         return self
 
     def re_start(self):
@@ -179,11 +503,12 @@ class SimpleTimer(object):
         if self.is_running:
             self.is_running = False
             self._expiration = 0
+            self._timers._engine.cancel(self)
 
     def expire(self):
         if self.is_running:
-            self._expiration = time.time() - 5
-            heapq.heapify(self._timer_list)
+            self._expiration = self._timers.clock() - 5
+            self._timers._engine.schedule(self)
 
     def delete(self):  # for backward compatibility
         self.cancel()
@@ -199,14 +524,14 @@ class SimpleTimer(object):
 
 class BackoffTimer(SimpleTimer):
 
-    def __init__(self, timer_list, action, initial, maximum, multiplier):
-        super(BackoffTimer, self).__init__(timer_list, action, initial)
+    def __init__(self, timers, action, initial, maximum, multiplier):
+        super(BackoffTimer, self).__init__(timers, action, initial)
         self._backoff_duration = None
         self._maximum = maximum
         self._multiplier = multiplier
 
     def __repr__(self):
-        return 'Backoff[d=%s, r=%s]' % (self._backoff_duration, (self._expiration - time.time()) * 1000.0)
+        return 'Backoff[d=%s, r=%s]' % (self._backoff_duration, (self._expiration - self._timers.clock()) * 1000.0)
 
     def _calc_expiration(self):
         if self._backoff_duration is None or self._is_restarting:
@@ -215,16 +540,16 @@ class BackoffTimer(SimpleTimer):
             self._backoff_duration *= self._multiplier
             if self._backoff_duration > self._maximum:
                 self._backoff_duration = self._maximum
-        return time.time() + (self._backoff_duration / 1000.0)
+        return self._timers.clock() + (self._backoff_duration / 1000.0)
 
 
 class HourlyTimer(SimpleTimer):
 
-    def __init__(self, timer_list, action):
-        super(HourlyTimer, self).__init__(timer_list, action, None)
+    def __init__(self, timers, action):
+        super(HourlyTimer, self).__init__(timers, action, None)
 
     def __repr__(self):
-        r = self._expiration - time.time()
+        r = self._expiration - self._timers.clock()
         rm = int(r / 60)
         rs = int((r - rm * 60) * 1000.0) / 1000.0
         return 'Hourly[r=%s:%06.3f]' % (rm, rs)
@@ -233,7 +558,7 @@ class HourlyTimer(SimpleTimer):
         now = datetime.datetime.now()
         next_hour = datetime.datetime(now.year, now.month, now.day, now.hour) + datetime.timedelta(hours=1)
         self._duration = (next_hour - now).total_seconds() * 1000.0
-        return time.time() + (self._duration / 1000.0)
+        return self._timers.clock() + (self._duration / 1000.0)
 
 
 TIMERS = Timer()
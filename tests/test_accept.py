@@ -41,3 +41,39 @@ def test_accept():
     while c.is_open:
         n.service()
     n.close()
+
+
+def test_reuse_port():
+    n1 = network.Server()
+    n2 = network.Server()
+    n1.add_server(PORT, AcceptServer, reuse_port=True)
+    n2.add_server(PORT, AcceptServer, reuse_port=True)  # second listener on the same port
+    c = n1.add_connection(('localhost', PORT), network.BasicHandler)
+    while c.is_open:
+        n1.service()
+        n2.service()
+    n1.close()
+    n2.close()
+
+
+class CountServer(network.BasicHandler):
+
+    accepted = 0
+
+    def on_accept(self):
+        CountServer.accepted += 1
+        return True
+
+
+def test_accept_batch():
+    n = network.Server()
+    n.add_server(PORT, CountServer, backlog=50, max_accept=4)
+    clients = [n.add_connection(('localhost', PORT), network.BasicHandler) for _ in range(10)]
+    while CountServer.accepted < 10:
+        before = CountServer.accepted
+        n._service(.1)
+        assert CountServer.accepted - before <= 4  # never more than max_accept per pass
+    assert CountServer.accepted == 10
+    for c in clients:
+        c.close()
+    n.close()
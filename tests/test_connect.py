@@ -208,7 +208,7 @@ def test_form(server):
 
     def on_complete(rc, result):
         assert rc == 0
-        assert result['headers']['content-type'] == \
+        assert result['headers']['Content-Type'] == \
             'application/x-www-form-urlencoded'
         assert result['body'] in (
                 'whatever=yeah&yeah=whatever',
@@ -1,3 +1,9 @@
+import os
+import socket
+import struct
+import time
+import pytest
+
 import rhc.tcpsocket as network
 
 
@@ -28,3 +34,240 @@ def test_echo():
     while c.is_open:  # keep going until the client closes
         n.service()
     n.close()
+
+
+@pytest.mark.parametrize('backend, edge_triggered', [
+    ('poll', False),
+    ('epoll', False),
+    ('epoll', True),
+])
+def test_echo_backend(backend, edge_triggered):
+    n = network.Server(backend, edge_triggered)
+    n.add_server(PORT, EchoServer)
+    c = n.add_connection(('localhost', PORT), EchoClient)
+    while c.is_open:
+        n.service()
+    n.close()
+
+
+class BulkServer(network.BasicHandler):
+
+    def on_init(self):
+        self.RECV_LEN = 7  # force many reads per notification
+        self.MAX_RECV_LEN = 7
+
+    def on_data(self, data):
+        self.send(data)
+
+
+class BulkClient(network.BasicHandler):
+
+    def on_ready(self):
+        self.test_data = b'x' * 10000
+        self.received = b''
+        self.send(self.test_data)
+
+    def on_data(self, data):
+        self.received += data
+        if len(self.received) == len(self.test_data):
+            self.close()
+
+
+def test_edge_triggered_drain():
+    n = network.Server('epoll', edge_triggered=True)
+    n.add_server(PORT, BulkServer)
+    c = n.add_connection(('localhost', PORT), BulkClient)
+    while c.is_open:
+        n.service(delay=.1)
+    assert c.received == c.test_data
+    n.close()
+
+
+def test_set_backend():
+    n = network.Server()
+    n.add_server(PORT, EchoServer)
+    n.set_backend('epoll')  # move the listener to the new backend
+    c = n.add_connection(('localhost', PORT), EchoClient)
+    while c.is_open:
+        n.service()
+    n.close()
+
+
+@pytest.mark.parametrize('backend', ('poll', 'epoll'))
+def test_poll_timeout(backend):
+    n = network.Server(backend)
+    start = time.time()
+    n.service(delay=.0004)  # rounded up to a millisecond, not down to zero
+    assert time.time() - start >= .0004
+    n.close()
+
+
+def test_invalid_backend():
+    with pytest.raises(ValueError):
+        network.Server('select')
+    with pytest.raises(ValueError):
+        network.Server('poll', edge_triggered=True)
+
+
+def test_register_unchanged():
+    n = network.Server()
+    n.add_server(PORT, BulkServer)
+    c = n.add_connection(('localhost', PORT), BulkClient)
+    while c.is_open:
+        n.service()
+    assert c.received == c.test_data
+    assert n.register_skip_count > 1000  # one per read on the server side
+    assert n.register_count < 20
+    assert n.iteration_count > 0
+    n.close()
+
+
+class BigServer(network.BasicHandler):
+
+    def on_ready(self):
+        self.is_queued = False
+        for _ in range(50):
+            self.send(b'y' * 100000)
+        self.is_queued = True
+        assert self.queued_bytes > 0  # not everything fits in the kernel buffer
+
+    def on_send_complete(self):
+        if self.is_queued:
+            assert self.queued_bytes == 0
+            self.close()
+
+
+class BigClient(network.BasicHandler):
+
+    def on_ready(self):
+        self.received = 0
+
+    def on_data(self, data):
+        self.received += len(data)
+
+
+@pytest.mark.parametrize('ssl', [False, True])
+def test_send_queue(ssl):
+    n = network.Server()
+    cert_dir = os.path.dirname(__file__) + '/cert/'
+    n.add_server(PORT, BigServer, ssl=ssl, ssl_certfile=cert_dir + 'cert.pem', ssl_keyfile=cert_dir + 'key.pem')
+    c = n.add_connection(('localhost', PORT), BigClient, ssl=ssl)
+    while c.is_open:
+        n.service()
+    assert c.received == 5000000
+    n.close()
+
+
+class AdaptServer(network.BasicHandler):
+
+    handler = None
+
+    def on_ready(self):
+        AdaptServer.handler = self
+        self.MAX_RECV_LEN = 32768
+        self.received = 0
+        self.max_recv_len = 0
+
+    def on_data(self, data):
+        self.received += len(data)
+        self.max_recv_len = max(self.max_recv_len, self._recv_len)
+
+
+def test_recv_len_adapts():
+    n = network.Server()
+    n.add_server(PORT, AdaptServer)
+    c = n.add_connection(('localhost', PORT), BigClient)
+    c.on_ready = lambda: c.send(b'z' * 1000000)
+    while AdaptServer.handler is None or AdaptServer.handler.received < 1000000:
+        n.service()
+    assert AdaptServer.handler.max_recv_len == 32768  # grew from RECV_LEN while reads were full
+    n.close()
+
+
+class PauseServer(network.BasicHandler):
+
+    handler = None
+
+    def on_init(self):
+        self.HIGH_WATER = 100000
+        self.LOW_WATER = 10000
+        self.events = []
+
+    def on_ready(self):
+        PauseServer.handler = self
+        for _ in range(50):
+            self.send(b'y' * 100000)
+
+    def on_pause_writing(self):
+        self.events.append('pause')
+
+    def on_resume_writing(self):
+        assert self.queued_bytes <= self.LOW_WATER
+        self.events.append('resume')
+
+
+def test_water_marks():
+    n = network.Server()
+    n.add_server(PORT, PauseServer)
+    c = n.add_connection(('localhost', PORT), BigClient)
+    while getattr(c, 'received', 0) < 5000000:
+        n.service()
+    assert PauseServer.handler.events == ['pause', 'resume']
+    assert PauseServer.handler.is_writing_paused is False
+    n.close()
+
+
+class PausedServer(network.BasicHandler):
+
+    handler = None
+
+    def on_ready(self):
+        PausedServer.handler = self
+        self.received = ''
+        self.pause_reading()
+
+    def on_data(self, data):
+        self.received += data
+
+
+class HangUpClient(network.BasicHandler):
+
+    reset = False
+
+    def on_ready(self):
+        self.send(b'abc')
+
+    def on_send_complete(self):
+        if self.reset:  # poll reports HUP and ERR even with an event mask of 0
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.close()
+        else:
+            self._sock.shutdown(socket.SHUT_WR)
+
+
+@pytest.mark.parametrize('backend, edge_triggered', [
+    ('poll', False),
+    ('epoll', False),
+    ('epoll', True),
+])
+@pytest.mark.parametrize('reset, reason', [
+    (False, 'remote close'),
+    (True, 'recv error on socket: Connection reset by peer'),
+])
+def test_pause_reading_hang_up(backend, edge_triggered, reset, reason):
+    PausedServer.handler = None
+    HangUpClient.reset = reset
+    n = network.Server(backend, edge_triggered)
+    n.add_server(PORT, PausedServer)
+    n.add_connection(('localhost', PORT), HangUpClient)
+    for _ in range(20):
+        n.service(.01)
+    h = PausedServer.handler
+    assert h.received == ''  # nothing read while paused
+    assert not h.closed
+    h.resume_reading()
+    for _ in range(20):
+        n.service(.01)
+    assert h.received == 'abc'
+    assert h.close_reason == reason
+    n.close()
@@ -1,6 +1,7 @@
 import pytest
+import zlib
 
-from rhc.httphandler import HTTPHandler
+from rhc.httphandler import HTTPHandler, HTTPHeaders, content_boundary, parse_multipart
 from rhc.resthandler import RESTRequest
 
 
@@ -205,3 +206,293 @@ for record in data['feedback']['record']:
     assert handler.request.http_multipart[0].disposition['name'] == '"foo"'
     assert handler.request.http_multipart[0].content == 'whatever\r\n'
     assert handler.request.http_multipart[1].disposition['filename'] == '"tmp.py"'
+
+
+def test_pipeline_held_while_writing_paused(handler):
+    handler.is_writing_paused = True
+    handler.on_data('GET /one HTTP/1.1\r\n\r\nGET /two HTTP/1.1\r\n\r\n')
+    assert not hasattr(handler, 'request')
+    handler.is_writing_paused = False
+    handler._on_resume_writing()
+    assert handler.request.http_resource == '/two'
+
+
+def test_trickle(handler):
+    data = 'POST /trickle HTTP/1.1\r\nHost: whatever\r\nContent-Length: 10\r\n\r\nabcde12345'
+    for c in data:
+        handler.on_data(c)
+    assert handler.is_open
+    assert handler.request.http_resource == '/trickle'
+    assert handler.request.http_content == 'abcde12345'
+    assert handler.request.http_message == data
+
+
+def test_pipeline(handler):
+    handler.on_data('POST /one HTTP/1.1\r\nContent-Length: 3\r\n\r\nabcPOST /two HTTP/1.1\r\nContent-Length: 4\r\n\r\n12')
+    assert handler.request.http_content == 'abc'
+    handler.on_data('34')
+    assert handler.request.http_resource == '/two'
+    assert handler.request.http_content == '1234'
+
+
+def test_line_too_long_trickle(handler):
+    handler.http_max_line_length = 20
+    for c in 'GET /' + 'a' * 20:
+        handler.on_data(c)
+    assert handler.closed
+    assert handler.error == 'too much data without a line termination (a)'
+
+
+def test_message_limit(handler):
+    handler.http_message_limit = 10
+    data = 'POST /limit HTTP/1.1\r\nContent-Length: 10\r\n\r\nabcde12345'
+    for c in data[:5]:
+        handler.on_data(c)
+    handler.on_data(data[5:])
+    assert handler.request.http_content == 'abcde12345'
+    assert handler.request.http_message == data[:10]
+
+
+def test_message_limit_none(handler):
+    handler.http_message_limit = 0
+    handler.on_data('POST /limit HTTP/1.1\r\nContent-Length: 10\r\n\r\nabcde12345')
+    assert handler.request.http_content == 'abcde12345'
+    assert handler.request.http_message == ''
+
+
+@pytest.fixture
+def streamer(handler):
+    handler.http_stream = True
+    handler.chunks = []
+    handler.on_http_body_chunk = handler.chunks.append
+    handler.on_http_body_end = lambda: handler.chunks.append(None)
+    return handler
+
+
+def test_stream_content(streamer):
+    streamer.on_data('POST /up HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc')
+    assert streamer.chunks == ['abc']
+    streamer.on_data('defghijGET /next HTTP/1.1\r\n\r\n')
+    assert streamer.chunks == ['abc', 'defghij', None, None]
+    assert streamer.request.http_resource == '/next'
+
+
+def test_stream_chunked(streamer):
+    streamer.on_data('POST /up HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nab')
+    streamer.on_data('cde\r\n2\r\nfg\r\n0\r\n\r\n')
+    assert streamer.chunks == ['ab', 'cde', 'fg', None]
+    assert streamer.request.http_resource == '/up'
+    assert streamer.request.http_content == ''
+
+
+def test_chunked_response_holds_pipeline(handler):
+    handler._do_write = lambda: None
+    resources = []
+
+    def on_http_data():
+        resources.append(handler.http_resource)
+        handler.send_server_chunked()
+
+    handler.on_http_data = on_http_data
+    handler.on_data('GET /one HTTP/1.1\r\n\r\nGET /two HTTP/1.1\r\n\r\n')
+    assert resources == ['/one']
+    handler.send_chunk('abc')
+    handler.send_chunk_end()
+    assert resources == ['/one', '/two']
+    sent = ''.join(m.tobytes() for m in handler._send_queue)
+    assert sent.count('Transfer-Encoding: chunked') == 2
+    assert '\r\n\r\n3\r\nabc\r\n0\r\n\r\nHTTP/1.1 200' in sent
+
+
+@pytest.mark.parametrize('connection, kwargs, is_close', [
+    ('', {}, False),
+    ('Connection: close\r\n', {}, True),
+    ('Connection: Close\r\n', dict(close=False), True),
+    ('', dict(close=True), True),
+    ('Connection: close\r\n', dict(keep_alive=True), False),
+])
+def test_send_server_close(handler, connection, kwargs, is_close):
+    handler._do_write = lambda: None
+    handler.on_http_data = lambda: handler.send_server('ok', **kwargs)
+    handler.on_data('GET / HTTP/1.1\r\n%s\r\n' % connection)
+    assert handler._HTTPHandler__http_close_on_complete is is_close
+
+
+def _gzip(data):
+    compress = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    return compress.compress(data) + compress.flush()
+
+
+def test_gzip_content(handler):
+    body = _gzip('abcde' * 1000)
+    handler.on_data('HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nContent-Length: %d\r\n\r\n' % len(body))
+    for n in range(0, len(body), 10):
+        handler.on_data(body[n:n + 10])
+    assert handler.is_open
+    assert handler.request.http_content == 'abcde' * 1000
+
+
+def test_deflate_chunked(handler):
+    body = zlib.compress('abcde' * 1000)
+    handler.on_data('POST /z HTTP/1.1\r\nContent-Encoding: deflate\r\nTransfer-Encoding: chunked\r\n\r\n')
+    handler.on_data('%x\r\n%s\r\n' % (20, body[:20]))
+    handler.on_data('%x\r\n%s\r\n0\r\n\r\n' % (len(body) - 20, body[20:]))
+    assert handler.request.http_content == 'abcde' * 1000
+
+
+def test_gzip_invalid(handler):
+    handler.on_data('HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nContent-Length: 5\r\n\r\nabcde')
+    assert handler.closed
+    assert handler.error == 'Invalid compressed content'
+
+
+def test_gzip_max_length(handler):
+    handler.http_max_content_length = 100
+    body = _gzip('a' * 101)
+    handler.on_data('HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body))
+    assert handler.closed
+    assert handler.error == 'Decompressed content exceeds maximum length'
+
+
+def test_stream_gzip(streamer):
+    body = _gzip('abcde' * 1000)
+    streamer.on_data('POST / HTTP/1.1\r\nContent-Encoding: gzip\r\nContent-Length: %d\r\n\r\n' % len(body))
+    for i in range(0, len(body), 10):
+        streamer.on_data(body[i:i + 10])
+    assert streamer.chunks[-1] is None
+    assert ''.join(streamer.chunks[:-1]) == 'abcde' * 1000
+
+
+def test_headers_case_insensitive(handler):
+    handler.on_data('GET / HTTP/1.1\r\nContent-Type: text/plain\r\nX-Custom-ID: 42\r\n\r\n')
+    headers = handler.request.http_headers
+    assert sorted(headers.keys()) == ['Content-Type', 'X-Custom-ID']
+    assert headers['content-type'] == 'text/plain'
+    assert headers.get('x-custom-id') == '42'
+    assert 'CONTENT-TYPE' in headers
+    assert headers.get('missing') is None
+
+
+def test_headers_repeated(handler):
+    handler.on_data('GET / HTTP/1.1\r\nAccept: text/html\r\naccept: application/json\r\n\r\n')
+    headers = handler.request.http_headers
+    assert headers.keys() == ['Accept']
+    assert headers['accept'] == 'text/html, application/json'
+    assert headers.get_all('ACCEPT') == ['text/html', 'application/json']
+    assert headers.get_all('missing') == []
+
+
+def test_headers_set_replaces_variant():
+    headers = HTTPHeaders()
+    headers['content-type'] = 'text/plain'
+    headers['Content-Type'] = 'text/html'
+    assert headers.items() == [('Content-Type', 'text/html')]
+    del headers['CONTENT-TYPE']
+    assert not headers
+    assert 'content-type' not in headers
+
+
+def test_query_lazy(handler):
+    handler.on_data('GET /test?a=1&b=2&b=3 HTTP/1.1\r\n\r\n')
+    request = handler.request
+    assert request._http_query is None
+    assert request.http_query == {'a': '1', 'b': ['2', '3']}
+    assert request.http_query is request.http_query
+
+
+def test_resource_absolute(handler):
+    handler.on_data('GET http://localhost/test?a=1#frag HTTP/1.1\r\n\r\n')
+    assert handler.request.http_resource == '/test'
+    assert handler.request.http_query_string == 'a=1'
+
+
+def test_charset_lazy(handler):
+    content = u'caf\xe9'.encode('latin-1')
+    handler.on_data('POST / HTTP/1.1\r\nContent-Type: text/plain; charset=latin-1\r\nContent-Length: %d\r\n\r\n%s' % (len(content), content))
+    request = handler.request
+    assert request._http_content is None
+    assert request.http_content == u'caf\xe9'
+
+
+def test_multipart_malformed(handler):
+    handler.on_data('POST / HTTP/1.1\r\nContent-Type: multipart/form-data; boundary=xx\r\nContent-Length: 24\r\n\r\n--xx\r\nno headers\r\n--xx--')
+    assert handler.is_open  # nothing is parsed until asked for
+    with pytest.raises(Exception) as e:
+        handler.request.http_multipart
+    assert str(e.value) == 'Malformed multipart message'
+
+
+MULTIPART = '''--xyz\r
+Content-Disposition: form-data; name="foo"\r
+\r
+whatever\r
+--xyz\r
+Content-Disposition: form-data; name="upload"; filename="data.txt"\r
+Content-Type: text/plain\r
+\r
+%s\r
+--xyz--\r
+''' % ('0123456789' * 100)
+
+
+def _multipart_message(body):
+    return 'POST /upload HTTP/1.1\r\nContent-Type: multipart/form-data; boundary=xyz\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body)
+
+
+@pytest.mark.parametrize('content_type, boundary', [
+    ('multipart/form-data; boundary=xyz', 'xyz'),
+    ('multipart/form-data;boundary=xyz', 'xyz'),
+    ('multipart/form-data; boundary="x y"', 'x y'),
+    ('multipart/form-data; boundary="xyz"; charset=utf-8', 'xyz'),
+    ('multipart/form-data; Boundary = xyz ', 'xyz'),
+    ('multipart/form-data', None),
+    ('multipart/form-data; boundary=', None),
+])
+def test_content_boundary(content_type, boundary):
+    assert content_boundary(content_type) == boundary
+
+
+@pytest.mark.parametrize('content_type', ('multipart/form-data;boundary=xyz', 'multipart/form-data; boundary="xyz"'))
+def test_multipart_boundary(handler, content_type):
+    handler.on_data('POST /upload HTTP/1.1\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n%s' % (content_type, len(MULTIPART), MULTIPART))
+    parts = handler.request.http_multipart
+    assert [p.disposition['name'] for p in parts] == ['"foo"', '"upload"']
+
+
+@pytest.mark.parametrize('piece', (1, 7, 100000))
+def test_multipart_incremental(handler, piece):
+    handler.http_multipart_spool_threshold = 100000
+    message = _multipart_message(MULTIPART)
+    for i in range(0, len(message), piece):
+        handler.on_data(message[i:i + piece])
+    assert handler.is_open
+    parts = handler.request.http_multipart
+    expected = [(p.headers, p.disposition, p.content) for p in parse_multipart(MULTIPART, 'xyz')]
+    assert [(p.headers, p.disposition, p.content) for p in parts] == expected
+    assert parts[0].content == 'whatever\r\n'
+    assert parts[1].disposition['filename'] == '"data.txt"'
+    assert all(p.file is None for p in parts)
+    assert handler.request.http_content == ''
+
+
+def test_multipart_spool(handler):
+    handler.http_multipart_spool_threshold = 100
+    handler.on_data(_multipart_message(MULTIPART))
+    small, large = handler.request.http_multipart
+    assert small.content == 'whatever\r\n' and small.file is None
+    assert large.content is None
+    assert large.file.read() == '0123456789' * 100 + '\r\n'
+
+
+def test_multipart_incremental_malformed(handler):
+    handler.http_multipart_spool_threshold = 100
+    handler.on_data(_multipart_message('--xyz\r\nno headers\r\n\r\n--xyz--\r\n'))
+    assert handler.closed
+    assert handler.error == 'Malformed multipart message'
+
+
+def test_multipart_incremental_incomplete(handler):
+    handler.http_multipart_spool_threshold = 100
+    handler.on_data(_multipart_message('--xyz\r\nContent-Type: text/plain\r\n\r\nabc'))
+    assert handler.closed
+    assert handler.error == 'Malformed multipart message'
@@ -0,0 +1,86 @@
+import errno
+import signal
+
+import pytest
+
+import rhc.micro as micro
+
+
+class _OS(object):
+    ''' stand-in for the process calls made by the supervisor
+
+        wait returns the next scripted result; a callable is called first
+        (for instance, to deliver a signal) and wait is interrupted.
+    '''
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.pids = iter(range(101, 200))
+        self.forked = []
+        self.killed = []
+
+    def fork(self):
+        pid = next(self.pids)
+        self.forked.append(pid)
+        return pid
+
+    def wait(self):
+        result = self.script.pop(0)
+        if callable(result):
+            result()
+            raise OSError(errno.EINTR, 'interrupted system call')
+        return result
+
+    def kill(self, pid, signum):
+        self.killed.append((pid, signum))
+
+
+def _signal(signum):
+    def deliver():
+        signal.getsignal(signum)(signum, None)
+    return deliver
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(micro.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def _run(monkeypatch, script, workers=2, restart_delay=1.0):
+    fake = _OS(script)
+    monkeypatch.setattr(micro.os, 'fork', fake.fork)
+    monkeypatch.setattr(micro.os, 'wait', fake.wait)
+    monkeypatch.setattr(micro.os, 'kill', fake.kill)
+    micro.run_workers(None, workers, restart_delay)
+    return fake
+
+
+def test_restart(monkeypatch, sleeps):
+    fake = _run(monkeypatch, [
+        (101, 256),  # dies right away: replaced after restart_delay
+        _signal(signal.SIGTERM),
+        (102, 0),
+        (103, 0),
+    ])
+    assert fake.forked == [101, 102, 103]
+    assert sleeps == [1.0]
+    assert fake.killed == [(102, signal.SIGTERM), (103, signal.SIGTERM)]
+    assert not fake.script  # every worker reaped
+
+
+def test_restart_no_delay(monkeypatch, sleeps):
+    fake = _run(monkeypatch, [(101, 256), _signal(signal.SIGINT), (102, 0)], workers=1, restart_delay=0)
+    assert fake.forked == [101, 102]
+    assert sleeps == []
+
+
+@pytest.mark.parametrize('signum', (signal.SIGINT, signal.SIGTERM, signal.SIGHUP))
+def test_stop(monkeypatch, sleeps, signum):
+    previous = signal.getsignal(signum)
+    fake = _run(monkeypatch, [_signal(signum), (102, 0), (101, 0)])
+    assert fake.forked == [101, 102]
+    assert sorted(fake.killed) == [(101, signal.SIGTERM), (102, signal.SIGTERM)]  # always SIGTERM
+    assert not fake.script
+    assert signal.getsignal(signum) == previous
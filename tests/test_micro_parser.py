@@ -297,3 +297,66 @@ def test_config_validate():
     assert p.config.foo is None
     p.config._set('foo', 'a')
     assert p.config.foo == 'aa'
+
+
+def test_loop():
+    p = Parser.parse(['SERVER test 12345'])
+    assert p.config.loop.backend == 'poll'
+    assert p.config.loop.edge_triggered is False
+    p.config._load(['loop.backend=epoll', 'loop.edge_triggered=true'])
+    assert p.config.loop.backend == 'epoll'
+    assert p.config.loop.edge_triggered is True
+    try:
+        p.config._load(['loop.backend=select'])
+        assert False
+    except Exception as e:
+        assert 'invalid backend' in str(e)
+
+
+def test_loop_timers():
+    p = Parser.parse(['SERVER test 12345'])
+    assert p.config.loop.timers == 'heap'
+    p.config._load(['loop.timers=wheel'])
+    assert p.config.loop.timers == 'wheel'
+    try:
+        p.config._load(['loop.timers=list'])
+        assert False
+    except Exception as e:
+        assert 'invalid timer engine' in str(e)
+
+
+def test_server_backlog():
+    p = Parser.parse(['SERVER test 12345'])
+    assert p.servers['test'].backlog == 100
+    assert p.config.server.test.backlog == 100
+
+    p = Parser.parse(['SERVER test 12345 backlog=1000'])
+    assert p.servers['test'].backlog == 1000
+    assert p.config.server.test.backlog == 1000
+
+
+def test_connection_pool():
+    p = Parser.parse([
+        'CONNECTION foo http://foo.com:10101',
+        'CONNECTION bar http://bar.com:11101 pool=true',
+    ])
+    assert p.connections['foo'].pool is False
+    assert p.config.connection.foo.pool is False
+    assert p.connections['bar'].pool is True
+    assert p.config.connection.bar.pool is True
+    assert p.config.pool.max_idle == 100
+    assert p.config.pool.max_per_host == 10
+    assert p.config.pool.idle_timeout == 30.0
+
+
+def test_route_cache():
+    p = Parser.parse([
+        'SERVER test 12345',
+        'ROUTE /foo$',
+        'ROUTE /bar$ cache=30 cache_size=10 vary=Accept,Accept-Language',
+    ])
+    foo, bar = p.servers['test'].routes
+    assert foo.cache is None
+    assert bar.cache == 30.0
+    assert bar.cache_size == 10
+    assert bar.vary == ['Accept', 'Accept-Language']
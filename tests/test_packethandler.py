@@ -0,0 +1,52 @@
+import rhc.tcpsocket as network
+from rhc.packethandler import TwoBytePacketHandler
+
+
+PORT = 12345
+
+
+class PacketServer(TwoBytePacketHandler):
+
+    def on_data(self, data):
+        self.send(data)
+
+
+class PacketClient(TwoBytePacketHandler):
+
+    def on_ready(self):
+        self.packets = []
+        self.raw_send(b''.join(b'\x00\x03' + d for d in (b'one', b'two', b'six')))  # several packets in one read
+
+    def raw_send(self, data):
+        network.BasicHandler.send(self, data)
+
+    def on_data(self, data):
+        self.packets.append(data)
+        if len(self.packets) == 3:
+            self.close()
+
+
+def test_packets():
+    n = network.Server()
+    n.add_server(PORT, PacketServer)
+    c = n.add_connection(('localhost', PORT), PacketClient)
+    while c.is_open:
+        n.service()
+    n.close()
+    assert c.packets == [b'one', b'two', b'six']
+    assert c.rxPacketCount == 3
+
+
+def test_framing():
+    packets = []
+
+    class Handler(TwoBytePacketHandler):
+        def on_data(self, data):
+            packets.append(data)
+
+    h = Handler(None)
+    data = b''.join(b'\x00\x04' + b'%04d' % n for n in range(1000))
+    h._on_data(data[:3001])  # many packets in one read, ending in a partial one
+    h._on_data(data[3001:])
+    assert packets == [b'%04d' % n for n in range(1000)]
+    assert h.rxPacketCount == 1000
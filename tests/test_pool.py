@@ -0,0 +1,148 @@
+import socket
+
+import pytest
+
+import rhc.connect as connect
+import rhc.httphandler as http
+from rhc.pool import ConnectionPool, _Idle
+
+
+PORT = 12346
+URL = 'http://localhost:{}'.format(PORT)
+
+
+class _TestServer(http.HTTPHandler):
+
+    connections = []
+
+    def on_ready(self):
+        self.connections.append(self)
+
+    def on_http_data(self):
+        close = self.http_resource == '/close'
+        self.send_server('ok', close=close, headers={'Connection': 'close'} if close else None)
+
+
+@pytest.fixture
+def server():
+    _TestServer.connections = []
+    connect.SERVER.add_server(PORT, _TestServer)
+    yield None
+    connect.SERVER.close()
+
+
+def request(pool, path=''):
+    result = {}
+
+    def on_complete(rc, data):
+        result['rc'] = rc
+        result['data'] = data
+
+    connect.run(connect.connect(on_complete, URL + path, is_json=False, pool=pool))
+    assert result['rc'] == 0
+    assert result['data'] == 'ok'
+
+
+def test_reuse(server):
+    pool = ConnectionPool()
+    request(pool)
+    assert len(pool) == 1
+    request(pool)
+    request(pool)
+    assert len(_TestServer.connections) == 1
+    assert pool.hit_count == 2
+    assert pool.miss_count == 1
+    assert pool.release_count == 3
+    assert pool.hit_rate == 2.0 / 3
+    pool.close()
+
+
+def test_no_pool(server):
+    request(None)
+    request(None)
+    assert len(_TestServer.connections) == 2
+
+
+def test_close_response(server):
+    pool = ConnectionPool()
+    request(pool, '/close')
+    assert len(pool) == 0
+    assert pool.release_count == 0
+
+
+def test_stale(server):
+    pool = ConnectionPool()
+    request(pool)
+    _TestServer.connections[0].close()  # server closes the idle connection
+    request(pool)
+    assert pool.stale_count == 1
+    assert len(_TestServer.connections) == 2
+    pool.close()
+
+
+def test_stale_while_idle(server):
+    pool = ConnectionPool()
+    request(pool)
+    _TestServer.connections[0].close()
+    while len(pool):
+        connect.SERVER.service(.01)  # idle connection notices remote close
+    assert pool.stale_count == 1
+
+
+def test_idle_timeout(server):
+    pool = ConnectionPool(idle_timeout=.01)
+    request(pool)
+    assert len(pool) == 1
+    while len(pool):
+        connect.event_loop.service(.01)
+    assert pool.expire_count == 1
+
+
+def test_max_per_host(server):
+    pool = ConnectionPool(max_per_host=1)
+    results = []
+
+    def on_complete(rc, data):
+        results.append(rc)
+
+    handlers = [connect.connect(on_complete, URL, is_json=False, pool=pool) for _ in range(3)]
+    while len(results) < 3:
+        connect.SERVER.service(.01)
+    assert all(h.is_done for h in handlers)
+    assert len(pool) == 1
+    assert pool.discard_count == 2
+    pool.close()
+
+
+def test_async_connection(server):
+    import rhc.async as async
+    pool = ConnectionPool()
+    c = async.Connection(URL, is_json=False, pool=pool)
+    c.add_resource('ping', '/')
+    results = []
+
+    def on_complete(rc, data):
+        results.append((rc, data))
+
+    for _ in range(2):
+        async.run(c.ping()(on_complete))
+    assert results == [(0, 'ok'), (0, 'ok')]
+    assert len(_TestServer.connections) == 1
+    assert pool.hit_count == 1
+    pool.close()
+
+
+def test_is_stale():
+    pool = ConnectionPool()
+    local, remote = socket.socketpair()
+    local.setblocking(False)
+    entry = _Idle('key', local, None)
+    assert pool._is_stale(entry) is False  # nothing to read
+    remote.send('x')
+    assert pool._is_stale(entry) is True  # unexpected data
+    assert local.recv(10) == 'x'  # peeked, not consumed
+    assert pool._is_stale(entry) is False
+    remote.close()
+    assert pool._is_stale(entry) is True  # EOF
+    local.close()
+    assert pool._is_stale(entry) is True  # closed
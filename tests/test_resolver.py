@@ -0,0 +1,136 @@
+import socket
+import time
+
+import rhc.tcpsocket as network
+from rhc.resolver import Resolver
+
+
+PORT = 12345
+
+
+class Result(object):
+
+    def __init__(self):
+        self.rc = None
+        self.result = None
+
+    def __call__(self, rc, result):
+        self.rc = rc
+        self.result = result
+
+
+def wait(server, result):
+    start = time.time()
+    while result.rc is None and time.time() - start < 5:
+        server.service(.01)
+
+
+def test_address():
+    n = network.Server()
+    r = Resolver(n)
+    result = Result()
+    r.resolve('127.0.0.1', result)
+    assert result.rc == 0
+    assert result.result == '127.0.0.1'
+    assert r.miss_count == 0
+    n.close()
+
+
+def test_resolve(monkeypatch):
+    lookups = []
+
+    def gethostbyname(host):
+        lookups.append(host)
+        return '127.0.0.2'
+    monkeypatch.setattr(socket, 'gethostbyname', gethostbyname)
+
+    n = network.Server()
+    r = Resolver(n)
+    first, second = Result(), Result()
+    r.resolve('Example.com', first)
+    r.resolve('example.com', second)  # shares the first lookup
+    assert first.rc is None
+    wait(n, second)
+    assert first.rc == second.rc == 0
+    assert second.result == '127.0.0.2'
+    assert lookups == ['example.com']
+    assert r.lookup('example.com') == '127.0.0.2'
+
+    cached = Result()
+    r.resolve('example.com', cached)  # from cache, immediately
+    assert cached.result == '127.0.0.2'
+    assert r.hit_count == 1
+    assert r.miss_count == 2
+    assert len(lookups) == 1
+    n.close()
+
+
+def test_negative(monkeypatch):
+    def gethostbyname(host):
+        raise socket.gaierror(-2, 'Name or service not known')
+    monkeypatch.setattr(socket, 'gethostbyname', gethostbyname)
+
+    n = network.Server()
+    r = Resolver(n, negative_ttl=.05)
+    result = Result()
+    r.resolve('bad.example', result)
+    wait(n, result)
+    assert result.rc == 1
+    assert 'bad.example' in result.result
+
+    again = Result()
+    r.resolve('bad.example', again)
+    assert again.rc == 1
+    assert r.negative_hit_count == 1
+
+    time.sleep(.06)  # negative entry expires
+    again = Result()
+    r.resolve('bad.example', again)
+    assert again.rc is None
+    n.close()
+
+
+def test_lru(monkeypatch):
+    monkeypatch.setattr(socket, 'gethostbyname', lambda host: '127.0.0.%d' % ord(host))
+
+    n = network.Server()
+    r = Resolver(n, max_size=2)
+    for host in ('a', 'b', 'a', 'c'):  # a is used more recently than b
+        result = Result()
+        r.resolve(host, result)
+        wait(n, result)
+    assert r.lookup('a') == '127.0.0.97'
+    assert r.lookup('b') is None
+    assert r.lookup('c') == '127.0.0.99'
+    n.close()
+
+
+class FailClient(network.BasicHandler):
+
+    def on_fail(self):
+        self.failed = self.error
+
+
+def test_connect_unresolved(monkeypatch):
+    def gethostbyname(host):
+        raise socket.gaierror(-2, 'Name or service not known')
+    monkeypatch.setattr(socket, 'gethostbyname', gethostbyname)
+
+    n = network.Server()
+    c = n.add_connection(('bad.example', PORT), FailClient)
+    assert c.is_open  # waiting for resolution
+    while c.is_open:
+        n.service(.01)
+    assert 'unable to resolve bad.example' in c.failed
+    n.close()
+
+
+def test_connect_name():
+    n = network.Server()
+    n.add_server(PORT, network.BasicHandler)
+    c = n.add_connection(('localhost', PORT), network.BasicHandler)
+    while not c.t_ready:
+        n.service(.01)
+    assert n.resolver.lookup('localhost')
+    c.close()
+    n.close()
@@ -0,0 +1,141 @@
+import pytest
+
+import rhc.connect as connect
+from rhc.resthandler import RESTHandler, RESTMapper, RESTStream
+
+
+PORT = 12347
+URL = 'http://localhost:{}'.format(PORT)
+
+ROW = 'x' * 65535 + '\n'
+ROWS = 200
+
+
+def rows():
+    for n in range(ROWS):
+        yield ROW
+
+
+def generate(request):
+    return RESTStream(rows(), content_type='text/plain')
+
+
+def produce(request):
+
+    items = ['a', 'b', 'c']
+
+    def producer(stream):
+        if items:
+            stream.write(items.pop(0))
+        else:
+            stream.finish()
+
+    request.respond(RESTStream(producer, content_type='text/plain'))
+
+
+def broken(request):
+
+    def rows():
+        yield 'a'
+        raise Exception('broken')
+
+    return RESTStream(rows())
+
+
+class _Handler(RESTHandler):
+
+    def __init__(self, *args, **kwargs):
+        super(_Handler, self).__init__(*args, **kwargs)
+        self.http_compress_min_size = 1000
+
+    def on_rest_exception(self, exception_type, exception_value, exception_traceback):
+        self.context.context.append(exception_value)
+
+
+@pytest.fixture
+def errors():
+    errors = []
+    mapper = RESTMapper(errors)
+    mapper.add('/generate$', get=generate)
+    mapper.add('/produce$', get=produce)
+    mapper.add('/broken$', get=broken)
+    connect.SERVER.add_server(PORT, _Handler, mapper)
+    yield errors
+    connect.SERVER.close()
+
+
+def request(path, headers=None):
+    result = {}
+
+    def on_complete(rc, data):
+        result['rc'] = rc
+        result['data'] = data
+
+    connect.run(connect.connect(on_complete, URL + path, headers=headers, is_json=False))
+    return result['rc'], result['data']
+
+
+def test_generator(errors):
+    rc, data = request('/generate')
+    assert rc == 0
+    assert data == ROW * ROWS
+
+
+def test_generator_gzip(errors):
+    rc, data = request('/generate', headers={'Accept-Encoding': 'gzip'})
+    assert rc == 0
+    assert data == ROW * ROWS
+
+
+def test_producer(errors):
+    rc, data = request('/produce')
+    assert rc == 0
+    assert data == 'abc'
+
+
+def test_exception(errors):
+    rc, data = request('/broken')
+    assert data == 'remote close'  # no complete response
+    assert str(errors[0]) == 'broken'
+
+
+class _Socket(object):
+    ''' a peer which reads everything immediately '''
+
+    def __init__(self):
+        self.data = ''
+        self.closed = False
+
+    def send(self, data):
+        self.data += data.tobytes()
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+
+class _Network(object):
+
+    def _register(self, sock, mask, callback):
+        pass
+
+    def _unregister(self, sock):
+        pass
+
+    def _set_idle(self, sock):
+        pass
+
+
+@pytest.mark.parametrize('connection', ('', 'Connection: keep-alive\r\n'))
+def test_http_10(connection):
+    mapper = RESTMapper()
+    mapper.add('/produce$', get=produce)
+    sock = _Socket()
+    h = RESTHandler(sock, mapper)
+    h._network = _Network()
+    h.on_data('GET /produce HTTP/1.0\r\n%s\r\n' % connection)
+    headers, content = sock.data.split('\r\n\r\n', 1)
+    assert 'Transfer-Encoding' not in headers
+    assert 'Connection: close' in headers
+    assert content == 'abc'  # not chunked
+    assert sock.closed  # the close marks the end
@@ -1,5 +1,9 @@
 import pytest
-from rhc.resthandler import RESTMapper
+import re
+import time
+import zlib
+from rhc.resthandler import RESTHandler, RESTMapper, RESTResult, accepted_encoding
+from rhc.timer import TIMERS
 
 
 class TestRestHandler(object):
@@ -28,3 +32,390 @@ class TestRestHandler(object):
         assert handler == 2
         handler, group, _ = mapper._match('/foo', 'put')
         assert handler == 5
+
+
+ROUTES = (
+    ('/foo$', 2),
+    ('/foo/(\\d+)$', 3),
+    ('/fo+/bar', 4),
+    ('/foo/(\\w+)/bar$', 5),
+    ('^/baz/(.*)', 6),
+    ('(?i)/QUX$', 7),
+    ('/foo/', 8),
+    ('/a\\.b$', 9),
+    ('/$', 10),
+    ('/', 11),
+)
+
+
+@pytest.mark.parametrize('match_cache_size', (0, 2))
+@pytest.mark.parametrize('resource', (
+    '/', '/foo', '/foo/123', '/foo/abc/bar', '/fooo/bar', '/foo/bar', '/baz/x/y', '/qux',
+    '/a.b', '/axb', '/nothing', '', 'foo', '/foo/123/bar', '/foo/123',
+))
+def test_route_order(match_cache_size, resource):
+    ''' the route table finds the same first match as trying every pattern in order '''
+    mapper = RESTMapper(match_cache_size=match_cache_size)
+    for pattern, handler in ROUTES:
+        mapper.add(pattern, get=handler)
+    expected = None, None, False
+    for pattern, handler in ROUTES:
+        m = re.match(pattern, resource)
+        if m:
+            expected = handler, m.groups(), False
+            break
+    assert mapper._match(resource, 'GET') == expected
+    assert mapper._match(resource, 'GET') == expected  # again, possibly from the cache
+
+
+def test_route_method():
+    mapper = RESTMapper()
+    mapper.add('/foo$', post=1)
+    mapper.add('/(foo)', get=2)
+    assert mapper._match('/foo', 'GET') == (2, ('foo',), False)
+    assert mapper._match('/foo', 'POST') == (1, (), False)
+    mapper.add('/foo$', get=3)
+    assert mapper._match('/foo', 'GET') == (2, ('foo',), False)
+
+
+def test_route_cache_size():
+    mapper = RESTMapper(match_cache_size=2)
+    mapper.add('/item/(\\d+)$', get=1)
+    for n in range(10):
+        assert mapper._match('/item/%d' % n, 'GET') == (1, (str(n),), False)
+    assert len(mapper._RESTMapper__recent) + len(mapper._RESTMapper__older) <= 2
+    mapper.add('/other$', get=2)
+    assert not mapper._RESTMapper__recent and not mapper._RESTMapper__older  # routes changed
+
+
+class _network(object):
+    def _unregister(self, sock):
+        pass
+
+
+class _SpoolHandler(RESTHandler):
+
+    def __init__(self, threshold):
+        mapper = RESTMapper()
+        mapper.add('/up$', post=self.upload)
+        super(_SpoolHandler, self).__init__(0, mapper)
+        self._network = _network()
+        self.http_spool_threshold = threshold
+
+    def upload(self, request):
+        self.request = request
+
+    def send_server(self, **kwargs):
+        self.response = kwargs
+
+
+@pytest.mark.parametrize('threshold, is_spooled', [
+    (10, False),
+    (9, True),
+])
+def test_spool(threshold, is_spooled):
+    h = _SpoolHandler(threshold)
+    h.on_data('POST /up HTTP/1.1\r\nContent-Length: 10\r\n\r\nabcde')
+    h.on_data('12345')
+    assert h.request.body.read() == 'abcde12345'
+    assert h.request.http_content == ('' if is_spooled else 'abcde12345')
+    assert isinstance(h.request.body, file) is is_spooled
+
+
+@pytest.mark.parametrize('threshold', (10, 9))
+def test_spool_charset(threshold):
+    body = u'\xe9' * 5
+    h = _SpoolHandler(threshold)
+    h.on_data('POST /up HTTP/1.1\r\nContent-Type: text/plain; charset=utf-8\r\nContent-Length: 10\r\n\r\n' + body.encode('utf-8'))
+    content = h.request.body.read()
+    assert isinstance(content, str)  # raw bytes, spooled or not
+    assert content == body.encode('utf-8')
+
+
+@pytest.mark.parametrize('threshold', (10000, 9))
+def test_spool_gzip(threshold):
+    compress = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    body = compress.compress('abcde12345' * 100) + compress.flush()
+    h = _SpoolHandler(threshold)
+    h.on_data('POST /up HTTP/1.1\r\nContent-Encoding: gzip\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body))
+    assert h.request.body.read() == 'abcde12345' * 100  # decompressed, spooled or not
+
+
+class _KeepAliveHandler(RESTHandler):
+
+    def __init__(self):
+        mapper = RESTMapper()
+        mapper.add('/delay$', get=self.delay)
+        mapper.add('/now$', get=self.now)
+        mapper.add('/close$', get=self.close_now)
+        super(_KeepAliveHandler, self).__init__(0, mapper)
+        self._network = _network()
+        self.delayed = []
+        self.sent = []
+
+    def delay(self, request):
+        request.delay()
+        self.delayed.append(request)
+
+    def now(self, request):
+        return 'now'
+
+    def close_now(self, request):
+        result = RESTResult(content='close')
+        result.close = True
+        return result
+
+    def send_server(self, content='', code=200, message='OK', headers=None, close=False, keep_alive=False):
+        self.sent.append((content, (headers or {}).get('Connection'), close))
+
+
+def test_ordered_responses():
+    h = _KeepAliveHandler()
+    h.on_data('GET /delay HTTP/1.1\r\n\r\nGET /now HTTP/1.1\r\n\r\nGET /nomatch HTTP/1.1\r\n\r\n')
+    assert h.sent == []
+    h.delayed[0].respond('later')
+    assert [s[0] for s in h.sent] == ['later', 'now', '']
+    assert all(s[2] is False for s in h.sent)
+
+
+def test_connection_close():
+    h = _KeepAliveHandler()
+    h.on_data('GET /now HTTP/1.1\r\nConnection: close\r\n\r\nGET /now HTTP/1.1\r\n\r\n')
+    assert h.sent == [('now', 'close', True)]
+
+
+def test_handler_close():
+    h = _KeepAliveHandler()
+    h.on_data('GET /close HTTP/1.1\r\n\r\nGET /now HTTP/1.1\r\n\r\n')
+    assert h.sent == [('close', 'close', True)]
+
+
+@pytest.mark.parametrize('connection, sent', [
+    ('', ('now', 'close', True)),
+    ('Connection: keep-alive\r\n', ('now', 'keep-alive', False)),
+])
+def test_http_10(connection, sent):
+    h = _KeepAliveHandler()
+    h.on_data('GET /now HTTP/1.0\r\n%s\r\n' % connection)
+    assert h.sent == [sent]
+
+
+def test_max_requests():
+    h = _KeepAliveHandler()
+    h.http_max_requests = 2
+    h.on_data('GET /delay HTTP/1.1\r\n\r\nGET /now HTTP/1.1\r\n\r\nGET /now HTTP/1.1\r\n\r\n')
+    h.delayed[0].respond('later')
+    assert h.sent == [('later', None, False), ('now', 'close', True)]
+
+
+def test_keep_alive_timeout():
+    h = _KeepAliveHandler()
+    h.http_keep_alive_timeout = 10
+    h.on_data('GET /delay HTTP/1.1\r\n\r\n')
+    assert h._idle_timer is None  # response outstanding
+    h.delayed[0].respond('later')
+    assert h._idle_timer.is_running
+    h._idle_timer.expire()
+    TIMERS.service()
+    assert h.closed
+    assert h.close_reason == 'keep-alive timeout'
+
+
+class _SlowSocket(object):
+    ''' a peer which reads 1000 bytes at a time '''
+
+    def send(self, data):
+        return min(len(data), 1000)
+
+    def close(self):
+        pass
+
+
+class _WriteNetwork(_network):
+
+    def _register(self, sock, mask, callback):
+        pass
+
+    def _set_idle(self, sock):
+        pass
+
+
+def test_keep_alive_timeout_slow_reader():
+    mapper = RESTMapper()
+    mapper.add('/big$', get=lambda request: 'x' * 10000)
+    h = RESTHandler(_SlowSocket(), mapper)
+    h._network = _WriteNetwork()
+    h.http_keep_alive_timeout = 10
+    h.on_data('GET /big HTTP/1.1\r\n\r\n')
+    while h.queued_bytes:
+        assert h._idle_timer is None or not h._idle_timer.is_running  # still writing
+        h._do_write()
+    assert h._idle_timer.is_running
+    assert not h.closed
+
+
+@pytest.mark.parametrize('accept, encoding', [
+    ('gzip, deflate', 'gzip'),
+    ('deflate', 'deflate'),
+    ('gzip;q=0, deflate;q=0.5', 'deflate'),
+    ('*', 'gzip'),
+    ('*, gzip;q=0', 'deflate'),
+    ('identity', None),
+    ('', None),
+])
+def test_accepted_encoding(accept, encoding):
+    assert accepted_encoding(accept) == encoding
+
+
+class _CompressHandler(_KeepAliveHandler):
+
+    def __init__(self):
+        super(_CompressHandler, self).__init__()
+        self.http_compress_min_size = 100
+        self.context.add('/json/(\\d+)$', get=self.json)
+        self.context.add('/text$', get=self.text)
+
+    def json(self, request, size):
+        return {'data': 'x' * int(size)}
+
+    def text(self, request):
+        return 'x' * 1000
+
+    def send_server(self, content='', code=200, message='OK', headers=None, close=False, keep_alive=False):
+        self.sent.append((content, headers))
+
+
+@pytest.mark.parametrize('resource, accept, encoding', [
+    ('/json/1000', 'gzip', 'gzip'),
+    ('/json/1000', 'deflate', 'deflate'),
+    ('/json/1000', '', None),
+    ('/json/10', 'gzip', None),
+    ('/text', 'gzip', None),  # no Content-Type
+])
+def test_compress(resource, accept, encoding):
+    h = _CompressHandler()
+    h.on_data('GET %s HTTP/1.1\r\nAccept-Encoding: %s\r\n\r\n' % (resource, accept))
+    content, headers = h.sent[0]
+    assert (headers or {}).get('Content-Encoding') == encoding
+    if encoding:
+        assert headers['Vary'] == 'Accept-Encoding'
+        content = zlib.decompress(content, zlib.MAX_WBITS | 32)
+    assert len(content) > 10
+
+
+@pytest.mark.parametrize('headers, encoding, vary', [
+    ({'content-type': 'text/plain', 'vary': 'Accept'}, 'gzip', 'Accept, Accept-Encoding'),
+    ({'Content-Type': 'text/plain', 'content-encoding': 'identity'}, None, None),
+])
+def test_compress_header_case(headers, encoding, vary):
+    h = _CompressHandler()
+    h.context.add('/headers$', get=lambda request: RESTResult(content='x' * 1000, headers=dict(headers)))
+    h.on_data('GET /headers HTTP/1.1\r\nAccept-Encoding: gzip\r\n\r\n')
+    content, sent = h.sent[0]
+    names = dict((k.lower(), v) for k, v in sent.items())
+    assert len(names) == len(sent)  # no duplicate names in different case
+    assert names.get('content-encoding') == (encoding or headers.get('content-encoding'))
+    assert names.get('vary') == vary
+    assert len(content) < 1000 if encoding else content == 'x' * 1000
+
+
+class _CacheHandler(RESTHandler):
+
+    def __init__(self, mapper=None):
+        if mapper is None:
+            mapper = RESTMapper()
+            mapper.add('/item/(\d+)$', get=self.get_item, post=self.post_item, cache=30, cache_size=2, vary=['Accept-Language'])
+            mapper.add('/delay$', get=self.delay, cache=30)
+        super(_CacheHandler, self).__init__(0, mapper)
+        self._network = _network()
+        self.calls = 0
+        self.delayed = []
+        self.sent = []
+
+    def get_item(self, request, item):
+        self.calls += 1
+        if item == '0':
+            return 404
+        return {'item': item, 'call': self.calls}
+
+    def post_item(self, request, item):
+        request.invalidate_cache('/item/%s' % item)
+        return 'ok'
+
+    def delay(self, request):
+        self.calls += 1
+        request.delay()
+        self.delayed.append(request)
+
+    def send_server(self, content='', code=200, message='OK', headers=None, close=False, keep_alive=False):
+        self.sent.append((code, content))
+
+
+def test_cache():
+    h = _CacheHandler()
+    h.on_data('GET /item/1 HTTP/1.1\r\n\r\nGET /item/1 HTTP/1.1\r\n\r\nGET /item/1?a=1 HTTP/1.1\r\n\r\n')
+    assert h.calls == 2
+    assert h.sent[0] == h.sent[1]
+    cache = h.context.caches['/item/(\d+)$']
+    assert (cache.hit_count, cache.miss_count) == (1, 2)
+
+
+def test_cache_vary():
+    h = _CacheHandler()
+    h.on_data('GET /item/1 HTTP/1.1\r\nAccept-Language: en\r\n\r\nGET /item/1 HTTP/1.1\r\naccept-language: fr\r\n\r\n')
+    assert h.calls == 2
+    h.on_data('GET /item/1 HTTP/1.1\r\nACCEPT-LANGUAGE: en\r\n\r\n')
+    assert h.calls == 2
+
+
+def test_cache_not_ok():
+    h = _CacheHandler()
+    h.on_data('GET /item/0 HTTP/1.1\r\n\r\nGET /item/0 HTTP/1.1\r\n\r\n')
+    assert h.calls == 2
+    assert [s[0] for s in h.sent] == [404, 404]
+
+
+@pytest.mark.parametrize('name', ('Set-Cookie', 'set-cookie', 'SET-COOKIE'))
+def test_cache_cookie(name):
+    h = _CacheHandler()
+    h.context.add('/cookie$', get=lambda request: RESTResult(content='x', headers={name: 'id=1'}), cache=30)
+    h.on_data('GET /cookie HTTP/1.1\r\n\r\n')
+    assert len(h.context.caches['/cookie$']) == 0  # never replayed to another client
+
+
+def test_cache_ttl(monkeypatch):
+    h = _CacheHandler()
+    h.on_data('GET /item/1 HTTP/1.1\r\n\r\n')
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 31)
+    h.on_data('GET /item/1 HTTP/1.1\r\n\r\n')
+    assert h.calls == 2
+
+
+def test_cache_size():
+    h = _CacheHandler()
+    h.on_data('GET /item/1 HTTP/1.1\r\n\r\nGET /item/2 HTTP/1.1\r\n\r\nGET /item/1 HTTP/1.1\r\n\r\nGET /item/3 HTTP/1.1\r\n\r\n')
+    assert h.calls == 3
+    cache = h.context.caches['/item/(\d+)$']
+    assert len(cache) == 2
+    h.on_data('GET /item/1 HTTP/1.1\r\n\r\nGET /item/2 HTTP/1.1\r\n\r\n')  # 2 was least recently used
+    assert h.calls == 4
+
+
+def test_cache_invalidate():
+    h = _CacheHandler()
+    h.on_data('GET /item/1 HTTP/1.1\r\n\r\nGET /item/2 HTTP/1.1\r\n\r\nPOST /item/1 HTTP/1.1\r\n\r\n')
+    h.on_data('GET /item/1 HTTP/1.1\r\n\r\nGET /item/2 HTTP/1.1\r\n\r\n')
+    assert h.calls == 3
+    h.context.invalidate_cache()
+    h.on_data('GET /item/2 HTTP/1.1\r\n\r\n')
+    assert h.calls == 4
+
+
+def test_cache_delayed():
+    h = _CacheHandler()
+    h.on_data('GET /delay HTTP/1.1\r\n\r\n')
+    h.delayed[0].respond('later')
+    h.on_data('GET /delay HTTP/1.1\r\n\r\n')
+    assert h.calls == 1
+    assert h.sent == [(200, 'later'), (200, 'later')]
@@ -1,5 +1,6 @@
 import rhc.tcpsocket as network
 import os
+import ssl
 
 PORT = 12345
 
@@ -56,3 +57,36 @@ def test_success():
         n.service()
     n.close()
     assert c.is_failed_handshake is False  # ssl handshake worked
+
+
+def test_context_cache():
+    n = network.Server()
+    a = n._client_ssl_context(None, None)
+    assert n._client_ssl_context(None, None) is a
+    cert_dir = os.path.dirname(__file__) + '/cert/'
+    b = n._client_ssl_context(None, cert_dir + 'cert.pem')
+    assert b is not a
+    assert b.verify_mode == ssl.CERT_REQUIRED
+    assert a.verify_mode == ssl.CERT_NONE
+    n.close()
+
+
+def test_handshake_metrics():
+    n = network.Server()
+    cert_dir = os.path.dirname(__file__) + '/cert/'
+    n.add_server(PORT, network.BasicHandler, ssl=True,
+                 ssl_certfile=cert_dir + 'cert.pem', ssl_keyfile=cert_dir + 'key.pem')
+    clients = []
+    for _ in range(2):
+        c = n.add_connection(('localhost', PORT), SuccessClient, ssl=True)
+        while c.is_open:
+            n.service()
+        clients.append(c)
+    n.close()
+    assert clients[0]._ssl_ctx is clients[1]._ssl_ctx
+    assert all(c.ssl_handshake_time > 0 for c in clients)
+    assert n.ssl_handshake_count >= 2  # client side, plus server side when complete
+    assert n.ssl_handshake_time > 0
+    if not hasattr(ssl, 'SSLSession'):  # no session support: never resumed
+        assert n.ssl_resumed_count == 0
+        assert n.ssl_resumption_rate == 0.0
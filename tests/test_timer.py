@@ -1,5 +1,9 @@
 import time
 
+import pytest
+
+import rhc.loop as loop
+from rhc.tcpsocket import Server
 import rhc.timer as timer
 
 
@@ -116,3 +120,242 @@ def test_backoff():
     time.sleep(.01)
     t.service()
     assert a.c1 == 3
+
+
+def test_next_expiration():
+    t = timer.Timer()
+    a = Action()
+    assert t.next_expiration() is None
+    t1 = t.add(a.a1, 50).start()
+    t2 = t.add(a.a2, 10).start()
+    assert t.next_expiration() == t2._expiration
+    t2.cancel()
+    assert t.next_expiration() == t1._expiration
+    assert len(t) == 1
+    t1.cancel()
+    assert t.next_expiration() is None
+    assert len(t) == 0
+
+
+def test_loop_timeout():
+    t = timer.Timer()
+    a = Action()
+    assert loop.timeout(None, t) is None
+    assert loop.timeout(.5, t) == .5
+    t.add(a.a1, 100).start()
+    assert .05 < loop.timeout(None, t) <= .1
+    assert loop.timeout(.01, t) == .01
+    t.add(a.a2, 10).start().expire()
+    assert loop.timeout(None, t) == 0
+
+
+def test_loop_service():
+    t = timer.Timer()
+    a = Action()
+    server = Server()
+    t.add(a.a1, 30).start()
+    start = time.time()
+    assert loop.service(timers=t, server=server) is False
+    elapsed = time.time() - start
+    assert a.t1 is True
+    assert .03 <= elapsed < .1
+    server.close()
+
+
+class Clock(object):
+    ''' simulated time, advanced explicitly '''
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, ms):
+        self.now += ms / 1000.0
+
+
+def test_wheel():
+    clock = Clock()
+    t = timer.Timer('wheel', clock=clock, resolution=1)
+    a = Action()
+    t.add(a.a1, 10).start()
+    t2 = t.add(a.a2, 30).start()
+    assert len(t) == 2
+    clock.advance(9)
+    t.service()
+    assert a.t1 is False
+    clock.advance(3)
+    t.service()
+    assert a.t1 is True
+    assert a.t2 is False
+    assert len(t) == 1
+    t2.re_start()
+    assert len(t) == 1
+    clock.advance(25)
+    t.service()
+    assert a.t2 is False
+    t2.cancel()
+    assert len(t) == 0
+    clock.advance(50)
+    t.service()
+    assert a.t2 is False
+
+
+def test_wheel_expire():
+    clock = Clock()
+    t = timer.Timer('wheel', clock=clock, resolution=1)
+    a = Action()
+    t1 = t.add(a.a1, 10000).start()
+    t1.expire()
+    clock.advance(1)
+    t.service()
+    assert a.t1 is True
+    assert len(t) == 0
+
+
+def test_wheel_cascade():
+    clock = Clock()
+    t = timer.Timer('wheel', clock=clock, resolution=1, slots=4, levels=2)  # spans 16 ticks
+    fired = []
+    for duration in (7, 13, 40):  # 40 is beyond the span
+        t.add(lambda duration=duration: fired.append((duration, clock())), duration).start()
+    start = clock()
+    for _ in range(60):
+        clock.advance(1)
+        t.service()
+    assert [d for d, _ in fired] == [7, 13, 40]
+    for duration, when in fired:
+        assert 0 <= (when - start) * 1000.0 - duration < 2  # within a tick
+    assert len(t) == 0
+
+
+def test_wheel_cascade_one_service():
+    clock = Clock()
+    t = timer.Timer('wheel', clock=clock, resolution=1, slots=4, levels=2)
+    a = ActionBackoff()
+    t.add(a.a1, 7).start()
+    t.add(a.a1, 13).start()
+    t.add(a.a1, 40).start()
+    clock.advance(100)
+    t.service()
+    assert a.c1 == 3
+    assert len(t) == 0
+
+
+def test_wheel_never_early():
+    clock = Clock()
+    t = timer.Timer('wheel', clock=clock, resolution=5)
+    fired = []
+    start = clock()
+    t.add(lambda: fired.append(clock()), 12).start()
+    while not fired:
+        clock.advance(.5)
+        t.service()
+    assert fired[0] - start >= .012
+    assert fired[0] - start < .012 + .005 + .001  # late by at most a tick plus the service interval
+
+
+def test_wheel_next_expiration():
+    clock = Clock()
+    t = timer.Timer('wheel', clock=clock, resolution=1)
+    a = Action()
+    assert t.next_expiration() is None
+    t1 = t.add(a.a1, 20).start()
+    assert clock() < t.next_expiration() < t1._expiration + .001  # earlier if t1 is beyond this rotation
+    t1.cancel()
+    assert t.next_expiration() is None
+
+
+def test_wheel_next_expiration_cache():
+    clock = Clock()
+    t = timer.Timer('wheel', clock=clock, resolution=1)
+    a = Action()
+    engine = t._engine
+    start = engine._current
+    t1 = t.add(a.a1, 100).start()
+    assert engine._tick(t.next_expiration()) == start + 100
+    assert engine._next == start + 100
+    t2 = t.add(a.a2, 50).start()  # earlier: cache follows
+    assert engine._next == start + 50
+    t.add(a.a2, 70).start()  # later: cache kept
+    assert engine._next == start + 50
+    t2.cancel()  # the cached slot empties
+    assert engine._next is None
+    assert engine._tick(t.next_expiration()) == start + 70
+    t1.cancel()  # not the cached slot
+    assert engine._next == start + 70
+    clock.advance(10)
+    t.service()  # the wheel moves on
+    assert engine._next is None
+    assert engine._tick(t.next_expiration()) == start + 70
+
+
+def test_wheel_next_expiration_cascade():
+    clock = Clock()
+    t = timer.Timer('wheel', clock=clock)  # 10ms ticks, 256 slots: 2.56s rotation
+    engine = t._engine
+    fired = []
+    t1 = t.add(lambda: fired.append(clock()), 3000).start()
+    boundary = (engine._current | engine._mask) + 1  # start of the next rotation
+    clock.now = (boundary - 1) * .01 + .005  # just before the boundary
+    t.service()
+    assert engine._current == boundary  # cascade not yet run
+    assert loop.timeout(timers=t) <= t1._expiration - clock()
+    while not fired:  # sleep exactly as long as the loop would
+        clock.now += loop.timeout(timers=t)
+        t.service()
+    assert t1._expiration <= fired[0] < t1._expiration + .011
+
+
+def test_set_engine():
+    clock = Clock()
+    t = timer.Timer(clock=clock)
+    a = Action()
+    t.add(a.a1, 10).start()
+    t.add(a.a2, 10).start().cancel()
+    t.set_engine('wheel', resolution=1)
+    assert t.engine == 'wheel'
+    assert len(t) == 1
+    clock.advance(12)
+    t.service()
+    assert a.t1 is True
+    assert a.t2 is False
+    with pytest.raises(ValueError):
+        t.set_engine('list')
+
+
+def test_heap_dead_count():
+    t = timer.Timer()
+    a = Action()
+    t1 = t.add(a.a1, 10).start()
+    t1.re_start()
+    t1.re_start()
+    assert len(t) == 3
+    assert t.live_count == 1
+    assert t.dead_count == 2
+    t1.cancel()
+    assert t.live_count == 0
+    assert t.dead_count == 3
+    assert t.next_expiration() is None
+    assert len(t) == 0
+    assert t.dead_count == 0
+
+
+def test_heap_compact():
+    t = timer.Timer('heap', compact_ratio=.5, compact_min=10)
+    a = Action()
+    timers = [t.add(a.a1, 1000).start() for _ in range(20)]
+    for item in timers[:10]:
+        item.cancel()
+    assert t._engine.compact_count == 0
+    assert t.dead_count == 10
+    timers[10].cancel()
+    assert t._engine.compact_count == 1
+    assert t.dead_count == 0
+    assert len(t) == t.live_count == 9
+    timers[19].expire()
+    time.sleep(.001)
+    t.service()
+    assert a.t1 is True
+    assert t.live_count == 8